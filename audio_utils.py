@@ -0,0 +1,270 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+# 4000 кадров 16-битного моно - порция, которой Vosk читал WAV
+CHUNK_BYTES = 8000
+# Наибольшая длина записи, принимаемой по WebSocket, секунды (~115 МБ float32 при 30 минутах)
+MAX_AUDIO_SECONDS = int(os.environ.get('MAX_AUDIO_SECONDS', 1800))
+
+
+class AudioDecodeError(Exception):
+    """ffmpeg не смог декодировать входной файл"""
+
+
+def is_pcm16_mono_wav(fileobj):
+    """Проверяет, что поток уже является WAV 16 kHz mono PCM"""
+    if not fileobj.seekable():
+        return False
+    position = fileobj.tell()
+    try:
+        with wave.open(fileobj, 'rb') as wf:
+            return (wf.getnchannels() == 1 and wf.getsampwidth() == 2
+                    and wf.getframerate() == SAMPLE_RATE and wf.getcomptype() == 'NONE')
+    except (wave.Error, EOFError):
+        return False
+    finally:
+        fileobj.seek(position)
+
+
+def _iter_wav_chunks(fileobj, chunk_bytes):
+    with wave.open(fileobj, 'rb') as wf:
+        frames = chunk_bytes // 2
+        while True:
+            data = wf.readframes(frames)
+            if not data:
+                break
+            yield data
+
+
+def _iter_ffmpeg_chunks(source, chunk_bytes):
+    """Декодирует source через ffmpeg, отдавая PCM из stdout по мере готовности"""
+    from_pipe = not isinstance(source, (str, os.PathLike))
+    process = subprocess.Popen([
+        'ffmpeg', '-loglevel', 'error',
+        '-i', 'pipe:0' if from_pipe else str(source),
+        '-vn',  # пропускаем видеопоток
+        '-acodec', 'pcm_s16le',
+        '-ar', str(SAMPLE_RATE),
+        '-ac', '1',
+        '-f', 's16le', 'pipe:1'
+    ], stdin=subprocess.PIPE if from_pipe else subprocess.DEVNULL,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    stderr = []
+    threads = [threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)]
+    if from_pipe:
+        def feed():
+            try:
+                shutil.copyfileobj(source, process.stdin)
+            except (BrokenPipeError, ValueError):
+                pass  # ffmpeg завершился раньше, чем дочитал вход
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+        threads.append(threading.Thread(target=feed, daemon=True))
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            data = process.stdout.read(chunk_bytes)
+            if not data:
+                break
+            yield data
+        process.wait()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        for thread in threads:
+            thread.join()
+        process.stdout.close()
+
+    if process.returncode != 0:
+        raise AudioDecodeError(b''.join(stderr).decode(errors='replace').strip())
+
+
+def probe_duration(path):
+    """Длительность записи в секундах или None, если её не удалось определить"""
+    try:
+        with wave.open(str(path), 'rb') as wf:
+            return wf.getnframes() / wf.getframerate()
+    except (wave.Error, EOFError):
+        pass
+    try:
+        output = subprocess.run([
+            'ffprobe', '-v', 'error',
+            '-show_entries', 'format=duration',
+            '-of', 'default=noprint_wrappers=1:nokey=1',
+            str(path)
+        ], check=True, capture_output=True, text=True).stdout
+        return float(output.strip())
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+
+def iter_pcm_chunks(source, chunk_bytes=CHUNK_BYTES):
+    """Отдаёт 16 kHz mono PCM из пути или потока с аудио/видео любого формата
+
+    WAV, уже подходящий Vosk, читается напрямую, остальное декодируется
+    ffmpeg через pipe без промежуточных файлов.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            if is_pcm16_mono_wav(f):
+                yield from _iter_wav_chunks(f, chunk_bytes)
+                return
+        yield from _iter_ffmpeg_chunks(source, chunk_bytes)
+        return
+
+    if is_pcm16_mono_wav(source):
+        yield from _iter_wav_chunks(source, chunk_bytes)
+        return
+
+    start = source.tell() if source.seekable() else None
+    produced = False
+    try:
+        for data in _iter_ffmpeg_chunks(source, chunk_bytes):
+            produced = True
+            yield data
+    except AudioDecodeError:
+        # Контейнеры с индексом в конце (mp4 без faststart) не читаются из pipe:
+        # копируем такой файл во временный файл с уникальным именем
+        if produced or start is None:
+            raise
+        source.seek(start)
+        with tempfile.NamedTemporaryFile(suffix='.media') as tmp:
+            shutil.copyfileobj(source, tmp)
+            tmp.flush()
+            yield from _iter_ffmpeg_chunks(tmp.name, chunk_bytes)
+
+
+class AudioAssembler:
+    """Собирает аудио из сообщений-порций в заранее выделенный float32 буфер
+
+    Каждая порция читается через np.frombuffer без копии и за один проход
+    конвертируется прямо в своё место в буфере. Длина записи ограничена
+    max_samples - и заявленная в total_samples, и набранная по порциям.
+    """
+
+    FORMATS = {'pcm_s16le': np.int16, 'f32le': np.float32}
+
+    def __init__(self, audio_format='f32le', total_samples=None, max_chunk_samples=None,
+                 max_samples=SAMPLE_RATE * MAX_AUDIO_SECONDS):
+        if audio_format not in self.FORMATS:
+            raise ValueError(f"Неподдерживаемый формат аудио: {audio_format}")
+        self.dtype = self.FORMATS[audio_format]
+        self.total = int(total_samples) if total_samples else None
+        self.max_chunk = max_chunk_samples
+        self.max_samples = max_samples
+        # Буфер выделяется по заявленной длине - её нужно проверить до выделения
+        if self.total is not None and not 0 < self.total <= max_samples:
+            raise ValueError(f"Недопустимая длина записи: {self.total} сэмплов (не больше {max_samples})")
+        self.buffer = np.empty(self.total or min(SAMPLE_RATE * 60, max_samples), dtype=np.float32)
+        self.length = 0
+
+    @property
+    def complete(self):
+        return self.total is not None and self.length >= self.total
+
+    @property
+    def audio(self):
+        return self.buffer[:self.length]
+
+    def add(self, message):
+        """Добавляет порцию и возвращает её как float32 срез буфера"""
+        samples = np.frombuffer(message, dtype=self.dtype)
+        count = len(samples)
+        if self.max_chunk is not None and count > self.max_chunk:
+            raise ValueError(f"Порция аудио больше согласованной: {count} > {self.max_chunk}")
+        end = self.length + count
+        if end > len(self.buffer):
+            if self.total is not None:
+                raise ValueError("Получено больше аудио, чем заявлено в total_samples")
+            if end > self.max_samples:
+                raise ValueError(f"Запись длиннее {self.max_samples} сэмплов")
+            # Длина заранее неизвестна - растим буфер геометрически, но не выше предела
+            grown = np.empty(min(max(end, len(self.buffer) * 2), self.max_samples), dtype=np.float32)
+            grown[:self.length] = self.buffer[:self.length]
+            self.buffer = grown
+
+        target = self.buffer[self.length:end]
+        if self.dtype is np.int16:
+            np.multiply(samples, np.float32(1 / 32768), out=target)
+        else:
+            target[:] = samples
+        self.length = end
+        return target
+
+
+def pcm_to_samples(pcm):
+    """Представляет 16-битный PCM как массив int16 без копирования"""
+    return np.frombuffer(pcm, dtype=np.int16)
+
+
+def frame_levels(samples, sample_rate=SAMPLE_RATE, frame_ms=30):
+    """Считает уровень громкости (dBFS) по кадрам фиксированной длины"""
+    frame = int(sample_rate * frame_ms / 1000)
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return np.empty(0, dtype=np.float32), frame
+    frames = samples[:n_frames * frame].reshape(n_frames, frame).astype(np.float32)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1)) / 32768.0
+    return 20 * np.log10(rms + 1e-10), frame
+
+
+def find_silence_cuts(samples, sample_rate=SAMPLE_RATE, frame_ms=30,
+                      min_silence_ms=300, threshold_db=-45):
+    """Возвращает позиции (в сэмплах) середин пауз, пригодных для разреза"""
+    levels, frame = frame_levels(samples, sample_rate, frame_ms)
+    if len(levels) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    # Порог подстраивается под шумовой фон записи, но не выше уровня речи
+    noise_floor = np.percentile(levels, 10)
+    speech_level = np.percentile(levels, 90)
+    threshold = min(max(threshold_db, noise_floor + 6), speech_level - 10)
+    silent = levels < threshold
+
+    # Границы непрерывных участков тишины
+    edges = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    min_frames = max(1, int(min_silence_ms / frame_ms))
+    long_enough = (ends - starts) >= min_frames
+    return ((starts[long_enough] + ends[long_enough]) // 2) * frame
+
+
+def split_on_silence(samples, sample_rate=SAMPLE_RATE, target_seconds=30,
+                     max_seconds=60, min_seconds=1):
+    """Делит запись на сегменты (start, end) в сэмплах, разрезая по паузам"""
+    total = len(samples)
+    target = int(target_seconds * sample_rate)
+    max_len = int(max_seconds * sample_rate)
+    min_len = int(min_seconds * sample_rate)
+
+    bounds = [0]
+    for cut in find_silence_cuts(samples, sample_rate):
+        if cut - bounds[-1] >= target and total - cut >= min_len:
+            bounds.append(int(cut))
+    bounds.append(total)
+
+    segments = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        # Если пауз не нашлось, режем слишком длинный сегмент принудительно
+        while end - start > max_len:
+            segments.append((start, start + max_len))
+            start += max_len
+        if end > start:
+            segments.append((start, end))
+    return segments
@@ -0,0 +1,180 @@
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from audio_utils import SAMPLE_RATE, iter_pcm_chunks
+from transcript_cache import HashingChunks, TranscriptCache
+
+AUDIO_EXTENSIONS = {
+    '.wav', '.mp3', '.m4a', '.ogg', '.oga', '.opus', '.flac', '.aac', '.wma',
+    '.mp4', '.mkv', '.mov', '.avi', '.webm'
+}
+
+# Сервисы, созданные в процессе-воркере один раз на весь прогон
+_worker = {}
+
+
+def collect_inputs(source):
+    """Список файлов из каталога или манифеста (по пути в строке или JSONL с полем path)"""
+    if os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            for name in files:
+                if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS:
+                    paths.append(os.path.join(root, name))
+        return sorted(paths)
+
+    base = os.path.dirname(os.path.abspath(source))
+    paths = []
+    with open(source, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            path = json.loads(line)['path'] if line.startswith('{') else line
+            paths.append(path if os.path.isabs(path) else os.path.join(base, path))
+    return paths
+
+
+def load_done(output):
+    """Файлы, уже успешно распознанные в прошлых запусках"""
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # строка, оборванная при аварийной остановке
+            if record.get('error') is None:
+                done.add(record['path'])
+    return done
+
+
+def _init_worker(engine, model, language, models_dir):
+    """Создаёт сервис и загружает модель один раз на процесс"""
+    if engine == 'vosk':
+        from vosk_service import VoskService
+        service = VoskService(models_dir)
+        service.load_model(model)
+    else:
+        from whisper_service import WhisperService
+        service = WhisperService()
+        if not service.load_model(model):
+            raise RuntimeError(f"Модель Whisper {model} не скачана")
+    _worker.update(engine=engine, model=model, language=language, service=service, cache=TranscriptCache())
+
+
+def _transcribe_file(path):
+    engine, model, language = _worker['engine'], _worker['model'], _worker['language']
+    service, cache = _worker['service'], _worker['cache']
+    record = {'path': path, 'engine': engine, 'model': model, 'language': language}
+    started = time.perf_counter()
+    try:
+        chunks = HashingChunks(iter_pcm_chunks(path))
+        pcm = b''.join(chunks)
+        digest = chunks.hexdigest()
+        record['duration'] = len(pcm) / 2 / SAMPLE_RATE
+        # Результаты квантованной модели Whisper кэшируются отдельно от fp32
+        cache_model = service.registry_key(model)[1] if engine == 'whisper' else model
+        text = cache.get(digest, engine, cache_model, language)
+        if text is None:
+            if engine == 'vosk':
+                text = service.transcribe_pcm(pcm, model)
+            else:
+                audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+                text = service.transcribe_audio(audio, language, model)
+            cache.put(digest, engine, cache_model, language, text)
+        record['text'] = text
+        record['error'] = None
+    except Exception as e:
+        record['text'] = None
+        record['error'] = str(e)
+    record['seconds'] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def run_batch(source, output, engine='vosk', model='small', language='ru', workers=None,
+              models_dir='models', progress=None):
+    """Распознаёт все файлы source пулом процессов, дописывая результаты в JSONL
+
+    Уже распознанные файлы из output пропускаются, поэтому прерванный
+    прогон можно запустить повторно. progress(done, total) вызывается
+    после каждого файла.
+    """
+    if engine == 'vosk':
+        # Без модели процессы пула упадут в инициализаторе - проверяем заранее
+        from vosk_service import VoskService
+        model_dir = os.path.join(models_dir, VoskService.MODELS[model]['path'])
+        if not os.path.isdir(model_dir):
+            raise FileNotFoundError(f"Модель Vosk не найдена: {model_dir}")
+
+    paths = collect_inputs(source)
+    done = load_done(output)
+    pending = [path for path in paths if path not in done]
+    # Каждый процесс Whisper держит свою копию модели, поэтому по умолчанию он один
+    workers = workers or ((os.cpu_count() or 1) if engine == 'vosk' else 1)
+    logging.info(f"Batch: {len(paths)} files, {len(done)} already done, {len(pending)} to process, {workers} workers")
+
+    summary = {'files': 0, 'failed': 0, 'skipped': len(paths) - len(pending), 'audio_seconds': 0.0}
+    started = time.perf_counter()
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(engine, model, language, models_dir)
+    )
+    try:
+        with open(output, 'a', encoding='utf-8') as out:
+            futures = [executor.submit(_transcribe_file, path) for path in pending]
+            for future in as_completed(futures):
+                record = future.result()
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                out.flush()
+                summary['files'] += 1
+                summary['failed'] += record['error'] is not None
+                summary['audio_seconds'] += record.get('duration', 0.0)
+                if progress is not None:
+                    progress(summary['files'], len(pending))
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+    wall = time.perf_counter() - started
+    summary['wall_seconds'] = round(wall, 2)
+    summary['audio_seconds'] = round(summary['audio_seconds'], 2)
+    summary['files_per_hour'] = round(summary['files'] / wall * 3600, 1) if wall > 0 else None
+    summary['real_time_factor'] = round(wall / summary['audio_seconds'], 4) if summary['audio_seconds'] else None
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная транскрибация каталога или манифеста")
+    parser.add_argument('source', help="Каталог с записями или манифест (пути по строкам либо JSONL с полем path)")
+    parser.add_argument('output', help="JSONL файл результатов; при повторном запуске прогон продолжается")
+    parser.add_argument('--engine', choices=['vosk', 'whisper'], default='vosk')
+    parser.add_argument('--model', default='small')
+    parser.add_argument('--language', default='ru')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--models-dir', default='models')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    def report(done, total):
+        print(f"\r{done}/{total}", end='', flush=True)
+
+    summary = run_batch(args.source, args.output, args.engine, args.model, args.language,
+                        args.workers, args.models_dir, progress=report)
+    print()
+    print(f"Файлов: {summary['files']} (ошибок: {summary['failed']}, пропущено: {summary['skipped']})")
+    print(f"Аудио: {summary['audio_seconds']:.1f} с за {summary['wall_seconds']:.1f} с")
+    print(f"Файлов в час: {summary['files_per_hour']}, RTF: {summary['real_time_factor']}")
+
+
+if __name__ == '__main__':
+    main()
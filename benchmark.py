@@ -0,0 +1,997 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import re
+import subprocess
+import tempfile
+import threading
+import time
+import wave
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from text_utils import estimate_tokens
+from vosk_service import VoskService
+
+
+def read_pcm(path):
+    """Читает 16 kHz mono WAV целиком"""
+    with wave.open(path, 'rb') as wf:
+        return wf.readframes(wf.getnframes())
+
+
+def read_reference(path, fallback):
+    """Эталонный текст из <файл>.txt рядом с записью, иначе fallback"""
+    reference_path = os.path.splitext(path)[0] + '.txt'
+    if os.path.exists(reference_path):
+        with open(reference_path, encoding='utf-8') as f:
+            return f.read()
+    return fallback
+
+
+def word_error_rate(reference, hypothesis):
+    """WER по словам без учёта регистра и пунктуации"""
+    ref = re.findall(r'\w+', reference.lower())
+    hyp = re.findall(r'\w+', hypothesis.lower())
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + (ref_word != hyp_word))
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def default_worker_counts():
+    """Степени двойки до числа ядер включительно"""
+    cores = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 < cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+    return counts
+
+
+def bench_vosk_parallel(args):
+    """Сравнивает последовательное и параллельное распознавание Vosk"""
+    service = VoskService(args.models_dir)
+    service.PARALLEL_MIN_SECONDS = 0
+    workers_list = args.workers or default_worker_counts()
+    corpus = [(path, read_pcm(path)) for path in args.files]
+    audio_seconds = sum(len(pcm) / 2 / 16000 for _, pcm in corpus)
+
+    print(f"Корпус: {len(corpus)} файлов, {audio_seconds:.1f} с аудио, ядер: {os.cpu_count()}")
+
+    started = time.perf_counter()
+    reference = [service.transcribe_pcm(pcm, args.model) for _, pcm in corpus]
+    serial_time = time.perf_counter() - started
+    print(f"Последовательно: {serial_time:.2f} с, RTF {serial_time / audio_seconds:.3f}")
+
+    print(f"{'workers':>8} {'time, s':>9} {'RTF':>7} {'speedup':>8} {'eff.':>6} {'match':>6}")
+    for workers in workers_list:
+        # Прогрев: процессы пула загружают модель до замера
+        service.transcribe_pcm(corpus[0][1], args.model, workers=workers)
+        started = time.perf_counter()
+        texts = [service.transcribe_pcm(pcm, args.model, workers=workers) for _, pcm in corpus]
+        elapsed = time.perf_counter() - started
+        speedup = serial_time / elapsed
+        matched = sum(a == b for a, b in zip(texts, reference))
+        print(f"{workers:>8} {elapsed:>9.2f} {elapsed / audio_seconds:>7.3f} "
+              f"{speedup:>8.2f} {speedup / workers:>6.2f} {matched:>3}/{len(corpus)}")
+        for (path, _), text, ref in zip(corpus, texts, reference):
+            if text != ref:
+                print(f"  расхождение в {path}")
+    service.shutdown()
+
+
+def bench_whisper_stream(args):
+    """Время до первого текста и точность потокового Whisper против обычного"""
+    from whisper_service import WhisperService
+    from whisper_streaming import WhisperStreamingSession
+
+    service = WhisperService()
+    if not service.load_model(args.model):
+        raise SystemExit(f"Модель {args.model} не скачана")
+    chunk = int(args.chunk_seconds * 16000)
+
+    print(f"{'file':<30} {'TTFT, s':>8} {'stream, s':>10} {'offline, s':>11} {'WER stream':>11} {'WER offline':>12}")
+    for path in args.files:
+        audio = np.frombuffer(read_pcm(path), dtype=np.int16).astype(np.float32) / 32768.0
+
+        started = time.perf_counter()
+        offline_text = service.transcribe_audio(audio, args.language, args.model)
+        offline_time = time.perf_counter() - started
+        reference = read_reference(path, offline_text)
+
+        session = WhisperStreamingSession(service, args.model, args.language, step_seconds=args.step)
+        executor = ThreadPoolExecutor(max_workers=1)
+        pending = None
+        started = time.perf_counter()
+        for offset in range(0, len(audio), chunk):
+            session.insert_audio(audio[offset:offset + chunk])
+            if pending is not None and pending.done():
+                session.update(pending.result())
+                pending = None
+            if pending is None and session.ready():
+                pending = executor.submit(session.decode, *session.take_window())
+            if args.realtime:
+                time.sleep(chunk / 16000)
+        if pending is not None:
+            session.update(pending.result())
+        window = session.take_window()
+        if len(window[0]):
+            session.update(session.decode(*window), final=True)
+        stream_time = time.perf_counter() - started
+        executor.shutdown()
+
+        print(f"{os.path.basename(path):<30} {session.time_to_first_text or float('nan'):>8.2f} "
+              f"{stream_time:>10.2f} {offline_time:>11.2f} "
+              f"{word_error_rate(reference, session.committed_text):>11.3f} "
+              f"{word_error_rate(reference, offline_text):>12.3f}")
+
+
+def bench_correct(args):
+    """Исправление текста одним промптом против окон предложений и повторный прогон после правки"""
+    from text_utils import split_sentences
+
+    print(f"{'file':<30} {'tokens':>7} {'single, s':>10} {'windows':>8} {'windowed, s':>12} "
+          f"{'length':>9} {'rerun, s':>9} {'requests':>9}")
+    for path in args.files:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        with tempfile.TemporaryDirectory() as cache_dir:
+            service = make_ollama(args.ollama_url, cache_dir, args.concurrency)
+            service.load_model(args.model)
+            requests_sent = []
+            generate = service._generate
+            service._generate = lambda *a, **kw: requests_sent.append(1) or generate(*a, **kw)
+
+            started = time.perf_counter()
+            single = generate(args.model, f"Исправь грамматические ошибки и пунктуацию в тексте: {text}. "
+                              "В ответ напиши только исправленную версию, ничего больше.",
+                              temperature=0.1).get('response', '')
+            single_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            windowed = service.process_text(text, model_name=args.model)
+            windowed_time = time.perf_counter() - started
+            windows = len(requests_sent)
+
+            # Правка одного предложения в середине: остальные окна должны прийти из кэша
+            sentences = split_sentences(text)
+            sentences[len(sentences) // 2] += ' и ещё одно слово'
+            requests_sent.clear()
+            started = time.perf_counter()
+            service.process_text(' '.join(sentences), model_name=args.model)
+            rerun_time = time.perf_counter() - started
+
+        # Доля длины исходника в ответе: обрезанный одним промптом текст заметно короче
+        length = f"{len(single) / len(text):.2f}/{len(windowed) / len(text):.2f}"
+        print(f"{os.path.basename(path):<30} {estimate_tokens(text):>7} {single_time:>10.2f} {windows:>8} "
+              f"{windowed_time:>12.2f} {length:>9} {rerun_time:>9.2f} {len(requests_sent):>9}")
+
+
+def content_words(text):
+    return re.findall(r'\w{5,}', text.lower())
+
+
+def summary_quality(source, summary, reference=None):
+    """Доля слов эталона (или частых значимых слов исходника), попавших в описание"""
+    if reference:
+        expected = set(content_words(reference))
+    else:
+        counts = {}
+        for word in content_words(source):
+            counts[word] = counts.get(word, 0) + 1
+        expected = set(sorted(counts, key=counts.get, reverse=True)[:30])
+    if not expected:
+        return 0.0
+    return len(expected & set(content_words(summary))) / len(expected)
+
+
+def make_ollama(url, cache_dir, concurrency=None):
+    """OllamaService с отдельным кэшем, чтобы замер не попадал в кэш сервера"""
+    from ollama_service import OllamaService
+    from result_cache import ResultCache
+
+    service = OllamaService(concurrency)
+    service.BASE_URL = url
+    service.cache = ResultCache(os.path.join(cache_dir, 'llm.sqlite3'))
+    return service
+
+
+def bench_summarize(args):
+    """Суммаризация одним промптом против map-reduce"""
+    print(f"{'file':<30} {'tokens':>7} {'single, s':>10} {'map-reduce, s':>14} {'q single':>9} {'q m-r':>7}")
+    for path in args.files:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        reference_path = os.path.splitext(path)[0] + '.summary.txt'
+        reference = None
+        if os.path.exists(reference_path):
+            with open(reference_path, encoding='utf-8') as f:
+                reference = f.read()
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            service = make_ollama(args.ollama_url, cache_dir, args.concurrency)
+            service.load_model(args.model)
+
+            started = time.perf_counter()
+            single = service._generate(args.model, f"Сделай краткое описание текста в нескольких пунктах: {text}",
+                                       temperature=0.1, max_tokens=300).get('response', '')
+            single_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            mapped = service.summarize_text(text, model_name=args.model)
+            mapped_time = time.perf_counter() - started
+
+        print(f"{os.path.basename(path):<30} {estimate_tokens(text):>7} {single_time:>10.2f} {mapped_time:>14.2f} "
+              f"{summary_quality(text, single, reference):>9.2f} {summary_quality(text, mapped, reference):>7.2f}")
+
+
+def generate_speech_like(seconds, seed=0):
+    """Синтетический сигнал, похожий на речь: слоги из гармоник с паузами"""
+    rng = np.random.default_rng(seed)
+    samples = np.zeros(int(seconds * 16000), dtype=np.float32)
+    position = 0
+    while position < len(samples):
+        length = int(rng.uniform(0.15, 0.4) * 16000)
+        t = np.arange(length) / 16000
+        pitch = rng.uniform(100, 220)
+        syllable = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 6))
+        syllable *= np.hanning(length) * rng.uniform(0.1, 0.4)
+        end = min(position + length, len(samples))
+        samples[position:end] = syllable[:end - position]
+        # Между словами - пауза, иногда длинная
+        position = end + int(rng.choice([0.05, 0.1, 0.6]) * 16000)
+    samples += rng.normal(0, 0.003, len(samples)).astype(np.float32)
+    return (np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes()
+
+
+def reset_peak_rss():
+    """Сбрасывает пиковый RSS процесса (Linux), чтобы мерить его по сценариям"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # На macOS ru_maxrss в байтах, на Linux - в килобайтах
+    return peak / 2**20 if platform.system() == 'Darwin' else peak / 1024
+
+
+def run_load(name, func, inputs, concurrency, audio_seconds=None):
+    """Прогоняет func по inputs с заданной параллельностью и считает статистику"""
+    latencies = []
+
+    def timed(item):
+        started = time.perf_counter()
+        func(item)
+        latencies.append(time.perf_counter() - started)
+
+    reset_peak_rss()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, inputs))
+    wall = time.perf_counter() - started
+
+    latency = np.array(latencies)
+    result = {
+        'name': name,
+        'concurrency': concurrency,
+        'requests': len(inputs),
+        'wall_seconds': round(wall, 3),
+        'mean': round(float(latency.mean()), 4),
+        'p50': round(float(np.percentile(latency, 50)), 4),
+        'p95': round(float(np.percentile(latency, 95)), 4),
+        'p99': round(float(np.percentile(latency, 99)), 4),
+        'throughput_rps': round(len(inputs) / wall, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+    if audio_seconds:
+        # RTF одного запроса и сколько секунд аудио обрабатывается за секунду
+        result['rtf'] = round(float(latency.mean()) / audio_seconds, 4)
+        result['audio_seconds_per_second'] = round(audio_seconds * len(inputs) / wall, 2)
+    print(f"{name:<28} c={concurrency:<3} p50={result['p50']:.3f} p95={result['p95']:.3f} "
+          f"p99={result['p99']:.3f} rps={result['throughput_rps']:.2f} rss={result['peak_rss_mb']:.0f}MB"
+          + (f" rtf={result['rtf']:.3f}" if audio_seconds else ''))
+    return result
+
+
+class _OllamaStubHandler(BaseHTTPRequestHandler):
+    """Имитация /api/generate: фиксированная задержка на каждый токен"""
+
+    protocol_version = 'HTTP/1.1'
+    token_delay = 0.01
+    tokens = 40
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        words = ['слово'] * self.tokens
+        if body.get('stream'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            try:
+                for word in words:
+                    time.sleep(self.token_delay)
+                    self._chunk(json.dumps({'response': word + ' ', 'done': False}) + '\n')
+                self._chunk(json.dumps({'response': '', 'done': True}) + '\n')
+                self.wfile.write(b'0\r\n\r\n')
+            except (BrokenPipeError, ConnectionResetError):
+                # Клиент, замеряющий первый токен, закрывает поток досрочно
+                self.close_connection = True
+        else:
+            time.sleep(self.token_delay * len(words))
+            data = json.dumps({'response': ' '.join(words), 'done': True}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    def _chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_ollama_stub(token_delay=0.01):
+    """Запускает локальную заглушку Ollama в фоне и возвращает (сервер, url)"""
+    handler = type('Handler', (_OllamaStubHandler,), {'token_delay': token_delay})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite(args):
+    """Воспроизводимый набор замеров распознавания и LLM, результат - JSON"""
+    levels = args.concurrency
+    results = []
+    clips = {seconds: generate_speech_like(seconds, seed=seconds) for seconds in args.clip_seconds}
+
+    vosk = VoskService(args.models_dir)
+    model_dir = os.path.join(args.models_dir, VoskService.MODELS[args.vosk_model]['path'])
+    if os.path.isdir(model_dir):
+        vosk.load_model(args.vosk_model)
+        for seconds, pcm in clips.items():
+            for concurrency in levels:
+                results.append(run_load(f'vosk/{args.vosk_model}/{seconds}s',
+                                        lambda item: vosk.transcribe_pcm(item, args.vosk_model),
+                                        [pcm] * args.requests, concurrency, audio_seconds=seconds))
+    else:
+        print(f"Пропуск Vosk: нет модели {model_dir}")
+
+    try:
+        from whisper_service import WhisperService
+        whisper = WhisperService()
+        whisper_ready = whisper.is_model_downloaded(args.whisper_model) and whisper.load_model(args.whisper_model)
+    except ImportError:
+        whisper_ready = False
+    if whisper_ready:
+        for seconds, pcm in clips.items():
+            audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+            for concurrency in levels:
+                results.append(run_load(f'whisper/{args.whisper_model}/{seconds}s',
+                                        lambda item: whisper.transcribe_audio(item, 'ru', args.whisper_model),
+                                        [audio] * args.requests, concurrency, audio_seconds=seconds))
+    else:
+        print(f"Пропуск Whisper: модель {args.whisper_model} недоступна")
+
+    server, url = start_ollama_stub(args.token_delay)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        ollama = make_ollama(url, cache_dir)
+        ollama.loaded_models.add(ollama.default_model)
+        text = 'Сегодня обсуждали планы на квартал и бюджет проекта. ' * 40
+        # Уникальные тексты, чтобы каждый запрос проходил мимо кэша
+        operations = {
+            'correct': lambda i: ollama.process_text(f'{i}. {text}'),
+            'summarize': lambda i: ollama.summarize_text(f'{i}. {text}'),
+            'ask': lambda i: ollama.answer_question(f'{i}. {text}', 'Какой бюджет?'),
+            'ask_stream_first_token': lambda i: next(ollama.stream_answer(f'{i}. {text}', 'Какой бюджет?'))
+        }
+        counter = iter(range(10**9))
+        for name, operation in operations.items():
+            for concurrency in levels:
+                results.append(run_load(f'ollama-stub/{name}', lambda _: operation(next(counter)),
+                                        [None] * args.requests, concurrency))
+    server.shutdown()
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                    'cpu_count': os.cpu_count()},
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.output}")
+
+
+def bench_compare(args):
+    """Сравнивает два JSON с результатами suite"""
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding='utf-8') as f:
+        candidate = json.load(f)
+    before = {(r['name'], r['concurrency']): r for r in baseline['results']}
+
+    print(f"{baseline.get('commit')} -> {candidate.get('commit')}")
+    print(f"{'scenario':<34} {'c':>3} {'p50':>9} {'p95':>9} {'rps':>9} {'rss':>9}")
+    for result in candidate['results']:
+        old = before.get((result['name'], result['concurrency']))
+        if old is None:
+            continue
+
+        def delta(key):
+            return f"{(result[key] / old[key] - 1) * 100:+.1f}%" if old[key] else 'n/a'
+
+        print(f"{result['name']:<34} {result['concurrency']:>3} {delta('p50'):>9} {delta('p95'):>9} "
+              f"{delta('throughput_rps'):>9} {delta('peak_rss_mb'):>9}")
+
+
+class _RangeFileHandler(BaseHTTPRequestHandler):
+    """Раздача файлов с поддержкой Range, ограничением скорости соединения и обрывами"""
+
+    protocol_version = 'HTTP/1.1'
+    directory = '.'
+    bytes_per_second = 4 * 2**20
+    # Сколько первых ответов оборвать на середине, чтобы проверить докачку
+    drops = [0]
+
+    def _target(self):
+        path = os.path.join(self.directory, os.path.basename(self.path))
+        return path if os.path.isfile(path) else None
+
+    def do_HEAD(self):
+        path = self._target()
+        if path is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(os.path.getsize(path)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', f'"{int(os.path.getmtime(path))}-{os.path.getsize(path)}"')
+        self.end_headers()
+
+    def do_GET(self):
+        path = self._target()
+        if path is None:
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+        drop = self.drops[0] > 0
+        if drop:
+            self.drops[0] -= 1
+        block = 64 * 2**10
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            sent = 0
+            while remaining > 0:
+                data = f.read(min(block, remaining))
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                remaining -= len(data)
+                sent += len(data)
+                if drop and sent >= (end - start + 1) // 2:
+                    self.close_connection = True
+                    return
+                time.sleep(len(data) / self.bytes_per_second)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_model_archive(directory, name, megabytes):
+    """Zip с несжимаемыми файлами, устроенный как архив модели Vosk"""
+    rng = np.random.default_rng(0)
+    archive = os.path.join(directory, f'{name}.zip')
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as zf:
+        for index in range(8):
+            zf.writestr(f'{name}/part{index}.bin', rng.bytes(megabytes * 2**20 // 8))
+        zf.writestr(f'{name}/conf/model.conf', '--sample-frequency=16000\n')
+    return archive
+
+
+def bench_download(args):
+    """Загрузка модели с локального сервера: один поток против Range-сегментов и докачка"""
+    from model_download import fetch_and_extract
+
+    with tempfile.TemporaryDirectory() as serve_dir:
+        name = 'vosk-model-bench'
+        make_model_archive(serve_dir, name, args.size_mb)
+        handler = type('Handler', (_RangeFileHandler,), {
+            'directory': serve_dir,
+            'bytes_per_second': args.speed_mb * 2**20,
+            'drops': [0]
+        })
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_port}/{name}.zip'
+        print(f"Архив {args.size_mb} МБ, скорость одного соединения {args.speed_mb} МБ/с")
+
+        scenarios = [('1 соединение', 1, 0)] + [(f'{n} соединений', n, 0) for n in args.connections] + \
+                    [(f'{args.connections[-1]} соединений, {args.drops} обрывов', args.connections[-1], args.drops)]
+        for label, connections, drops in scenarios:
+            handler.drops[0] = drops
+            with tempfile.TemporaryDirectory() as target:
+                started = time.perf_counter()
+                fetch_and_extract(url, target, name, connections=connections, segment_bytes=2**20 * 4)
+                elapsed = time.perf_counter() - started
+                files = sum(len(found) for _, _, found in os.walk(os.path.join(target, name)))
+                print(f"{label:<32} {elapsed:6.2f} с  {args.size_mb / elapsed:6.1f} МБ/с  файлов: {files}")
+        server.shutdown()
+
+
+async def _live_session(vosk, model_type, pcm, chunk_bytes, executor, paced, latencies):
+    """Одна живая сессия: порции подаются в темпе реального времени (или без пауз)"""
+    from vosk_streaming import VoskStreamingSession
+
+    loop = asyncio.get_running_loop()
+    session = await loop.run_in_executor(executor, VoskStreamingSession, vosk, model_type)
+    chunk_seconds = chunk_bytes / 2 / 16000
+    started = time.perf_counter()
+    try:
+        for index, offset in enumerate(range(0, len(pcm), chunk_bytes)):
+            if paced:
+                # Порция "приходит" из микрофона не раньше, чем она записана
+                delay = started + (index + 1) * chunk_seconds - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            sent = time.perf_counter()
+            await loop.run_in_executor(executor, session.accept, pcm[offset:offset + chunk_bytes])
+            latencies.append(time.perf_counter() - sent)
+        await loop.run_in_executor(executor, session.finish)
+    finally:
+        session.close()
+
+
+async def _run_live_sessions(vosk, model_type, pcm, sessions, chunk_bytes, workers, paced):
+    latencies = []
+    executor = ThreadPoolExecutor(max_workers=workers)
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(_live_session(vosk, model_type, pcm, chunk_bytes, executor, paced, latencies)
+                               for _ in range(sessions)))
+    finally:
+        executor.shutdown()
+    return time.perf_counter() - started, np.array(latencies)
+
+
+def bench_vosk_sessions(args):
+    """Сколько живых сессий Vosk выдерживает сервер в реальном времени"""
+    model_dir = os.path.join(args.models_dir, VoskService.MODELS[args.model]['path'])
+    if not os.path.isdir(model_dir):
+        raise SystemExit(f"Модель не найдена: {model_dir}")
+    vosk = VoskService(args.models_dir)
+    vosk.load_model(args.model)
+    pcm = read_pcm(args.audio) if args.audio else generate_speech_like(args.seconds)
+    audio_seconds = len(pcm) / 2 / 16000
+    cores = os.cpu_count() or 1
+    chunk_bytes = args.chunk_ms * 16 * 2
+
+    # Без пауз: сколько секунд аудио в секунду перерабатывают все ядра
+    wall, _ = asyncio.run(_run_live_sessions(vosk, args.model, pcm, cores, chunk_bytes, cores, paced=False))
+    capacity = audio_seconds * cores / wall
+    print(f"Пропускная способность: {capacity:.1f} c аудио/с на {cores} ядрах, "
+          f"оценка {capacity / cores:.1f} сессий на ядро")
+
+    # В темпе реального времени: задержка обработки порции при росте числа сессий
+    print(f"{'сессий':>7} {'p50, мс':>9} {'p95, мс':>9} {'успевает':>9}")
+    for sessions in args.sessions:
+        _, latencies = asyncio.run(_run_live_sessions(vosk, args.model, pcm, sessions, chunk_bytes, cores, paced=True))
+        p95 = np.percentile(latencies, 95)
+        # Успевает, если порция обрабатывается быстрее, чем приходит следующая
+        keeps_up = p95 < args.chunk_ms / 1000
+        print(f"{sessions:>7} {np.percentile(latencies, 50) * 1000:>9.1f} {p95 * 1000:>9.1f} {'да' if keeps_up else 'нет':>9}")
+
+
+def bench_vad(args):
+    """Сколько аудио отбрасывает VAD, во что он обходится и что даёт распознаванию"""
+    from vad import compact_speech
+
+    if args.files:
+        corpus = [(path, read_pcm(path)) for path in args.files]
+    else:
+        # Синтетика: речь вперемешку с длинными паузами, как в звонке или лекции
+        rng = np.random.default_rng(0)
+        pieces = []
+        for index in range(args.segments):
+            pieces.append(generate_speech_like(rng.uniform(2, 8), seed=index))
+            noise = rng.normal(0, 0.003 * 32767, int(rng.uniform(1, 2 * args.pause) * 16000))
+            pieces.append(noise.astype(np.int16).tobytes())
+        corpus = [('synthetic', b''.join(pieces))]
+
+    service = VoskService(args.models_dir) if args.model else None
+    print(f"{'file':<30} {'audio, s':>9} {'skipped':>8} {'VAD, ms':>8} {'speedup est.':>13}"
+          + (f" {'plain, s':>9} {'vad, s':>7} {'speedup':>8} {'WER':>6}" if service else ''))
+    for path, pcm in corpus:
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        started = time.perf_counter()
+        _, speech_map = compact_speech(samples)
+        vad_time = time.perf_counter() - started
+        report = speech_map.report()
+        line = (f"{os.path.basename(path)[:30]:<30} {report['audio_seconds']:>9.1f} {report['skipped_ratio']:>8.1%} "
+                f"{vad_time * 1000:>8.1f} {report['estimated_speedup'] or 0:>12.2f}x")
+        if service:
+            started = time.perf_counter()
+            plain_text = service.transcribe_pcm(pcm, args.model)
+            plain_time = time.perf_counter() - started
+            started = time.perf_counter()
+            vad_text = service.transcribe_pcm(pcm, args.model, vad=True)
+            vad_time = time.perf_counter() - started
+            # Расхождение с распознаванием без VAD - цена выброшенной тишины
+            line += (f" {plain_time:>9.2f} {vad_time:>7.2f} {plain_time / vad_time:>7.2f}x "
+                     f"{word_error_rate(plain_text, vad_text):>6.3f}")
+        print(line)
+
+
+def _prefork_app(model, work):
+    """WSGI-приложение бенчмарка: чистый Python на work итераций и чтение общей модели"""
+    from prefork import memory_usage
+
+    def app(environ, start_response):
+        total = 0
+        for i in range(work):
+            total += i * i
+        # Чтение страниц модели не копирует их - память остаётся общей с родителем
+        checksum = float(model[::4096].sum())
+        body = json.dumps({'pid': os.getpid(), 'memory': memory_usage(), 'checksum': checksum}).encode()
+        start_response('200 OK', [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+        return [body]
+    return app
+
+
+def bench_prefork(args):
+    """Пропускная способность и память пре-форк воркеров с общей моделью"""
+    import multiprocessing
+    import urllib.request
+    from werkzeug.serving import make_server
+    from prefork import PreforkServer, listen, memory_usage
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    # Имитация модели: массив, заполненный до fork, как загруженные веса
+    model = np.random.default_rng(0).random(args.model_mb * 2**20 // 8)
+    app = _prefork_app(model, args.work)
+    print(f"Модель {args.model_mb} МБ, ядер: {os.cpu_count()}, память родителя: "
+          f"{memory_usage()['rss'] / 2**20:.0f} МБ RSS")
+    print(f"{'workers':>8} {'req/s':>8} {'speedup':>8} {'RSS/worker, MB':>15} {'sum PSS, MB':>12}")
+    baseline = None
+    for workers in args.workers:
+        sock = listen('127.0.0.1', 0)
+        url = f'http://127.0.0.1:{sock.getsockname()[1]}/'
+        server = PreforkServer(workers, lambda index: make_server('127.0.0.1', 0, app, fd=sock.fileno()).serve_forever())
+        # Супервизор ставит обработчики сигналов, поэтому живёт в своём процессе
+        supervisor = multiprocessing.get_context('fork').Process(target=server.run)
+        supervisor.start()
+
+        def fetch(_):
+            with urllib.request.urlopen(url, timeout=30) as response:
+                return json.loads(response.read())
+        with ThreadPoolExecutor(max_workers=workers * 4) as pool:
+            list(pool.map(fetch, range(workers * 4)))
+            started = time.perf_counter()
+            replies = list(pool.map(fetch, range(args.requests)))
+            elapsed = time.perf_counter() - started
+        supervisor.terminate()
+        supervisor.join()
+        sock.close()
+
+        # Последний замер каждого воркера - после того, как он обработал свою долю запросов
+        memory = {reply['pid']: reply['memory'] for reply in replies}
+        throughput = args.requests / elapsed
+        baseline = baseline or throughput
+        rss = np.mean([m['rss'] for m in memory.values()]) / 2**20
+        pss = sum(m['pss'] for m in memory.values()) / 2**20
+        print(f"{workers:>8} {throughput:>8.1f} {throughput / baseline:>7.2f}x {rss:>15.0f} {pss:>12.0f}")
+
+
+def _whisper_precision_run(model_name, precision, threads, files, language):
+    """Один замер в отдельном процессе: RSS не смешивается с моделями других замеров"""
+    from model_registry import ModelRegistry
+    from whisper_service import WhisperService
+
+    service = WhisperService(model_registry=ModelRegistry(2**40), precision=precision, threads=threads)
+    started = time.perf_counter()
+    if not service.load_model(model_name):
+        return None
+    load_seconds = time.perf_counter() - started
+    texts = []
+    audio_seconds = 0.0
+    started = time.perf_counter()
+    for path in files:
+        audio = np.frombuffer(read_pcm(path), dtype=np.int16).astype(np.float32) / 32768.0
+        audio_seconds += len(audio) / 16000
+        texts.append(service.transcribe_audio(audio, language, model_name))
+    elapsed = time.perf_counter() - started
+    return {'load_seconds': load_seconds, 'rtf': elapsed / audio_seconds, 'rss_mb': peak_rss_mb(), 'texts': texts}
+
+
+def bench_whisper_precision(args):
+    """fp32 против int8 на CPU: скорость, память и WER для каждого размера модели"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    print(f"Файлов: {len(args.files)}, потоков torch: {args.threads or 'по умолчанию'}")
+    print(f"{'model':<10} {'precision':<9} {'load, s':>8} {'RTF':>7} {'speedup':>8} {'peak RSS, MB':>13} {'WER':>6}")
+    for model_name in args.models:
+        results = {}
+        for precision in ('fp32', 'int8'):
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                results[precision] = pool.submit(_whisper_precision_run, model_name, precision, args.threads,
+                                                 args.files, args.language).result()
+        if results['fp32'] is None or results['int8'] is None:
+            print(f"{model_name:<10} модель не скачана")
+            continue
+        for precision, result in results.items():
+            # Без эталона <файл>.txt точность сравнивается с fp32
+            wer = np.mean([word_error_rate(read_reference(path, reference), text)
+                           for path, text, reference in zip(args.files, result['texts'], results['fp32']['texts'])])
+            print(f"{model_name:<10} {precision:<9} {result['load_seconds']:>8.1f} {result['rtf']:>7.3f} "
+                  f"{results['fp32']['rtf'] / result['rtf']:>7.2f}x {result['rss_mb']:>13.0f} {wer:>6.3f}")
+
+
+def bench_whisper_batch(args):
+    """Батчинг Whisper между одновременными клиентами: прирост пропускной способности и цена в задержке"""
+    from metrics import STAGE_SECONDS, WHISPER_BATCH_SIZE
+    from whisper_batching import WhisperBatcher
+    from whisper_service import WhisperService
+
+    service = WhisperService(args.model)
+    if not service.load_model(args.model):
+        raise SystemExit(f"Модель {args.model} не скачана")
+    clip = int(args.clip_seconds * 16000)
+    sources = [read_pcm(path) for path in args.files] or [generate_speech_like(args.clip_seconds, seed)
+                                                          for seed in range(8)]
+    clips = [np.frombuffer(pcm, dtype=np.int16)[:clip].astype(np.float32) / 32768.0 for pcm in sources]
+    batcher = WhisperBatcher(service, args.max_batch, args.max_wait_ms / 1000)
+    # Без батчинга сервер пропускает к модели один запрос за раз (WHISPER_WORKERS=1)
+    lock = threading.Lock()
+
+    def batch_totals():
+        # Сумма гистограммы размеров - запросы, прошедшие батчами, количество - сами батчи;
+        # ожидание попутчиков - чистая задержка, которую добавляет батчинг
+        counts, total = WHISPER_BATCH_SIZE.values.get((), ([0], 0.0))
+        wait_counts, wait = STAGE_SECONDS.values.get(('whisper_batch_wait',), ([0], 0.0))
+        return np.array([total, sum(counts), wait, sum(wait_counts)])
+
+    def serial(audio):
+        with lock:
+            service.transcribe_audio(audio, args.language, args.model)
+
+    serial(clips[0])
+    print(f"Клипы по {args.clip_seconds} с, батч до {args.max_batch}, ожидание {args.max_wait_ms:.0f} мс")
+    rows = []
+    for concurrency in args.concurrency:
+        inputs = [clips[i % len(clips)] for i in range(concurrency * args.requests)]
+        baseline = run_load('whisper serial', serial, inputs, concurrency, args.clip_seconds)
+        before = batch_totals()
+        batched = run_load('whisper batched', lambda audio: batcher.transcribe(audio, args.language, args.model),
+                           inputs, concurrency, args.clip_seconds)
+        after = batch_totals()
+        total, batches, wait, waits = after - before
+        rows.append((concurrency, baseline, batched, total / max(batches, 1), wait / max(waits, 1)))
+
+    print(f"{'clients':>7} {'serial rps':>11} {'batched rps':>12} {'gain':>6} {'mean batch':>11} "
+          f"{'batch wait':>11} {'serial p50':>11} {'batched p50':>12} {'p50 diff':>9} {'p95 diff':>9}")
+    for concurrency, baseline, batched, mean_batch, wait in rows:
+        print(f"{concurrency:>7} {baseline['throughput_rps']:>11.2f} {batched['throughput_rps']:>12.2f} "
+              f"{batched['throughput_rps'] / baseline['throughput_rps']:>5.2f}x {mean_batch:>11.1f} {wait:>11.3f} "
+              f"{baseline['p50']:>11.3f} {batched['p50']:>12.3f} {batched['p50'] - baseline['p50']:>+9.3f} "
+              f"{batched['p95'] - baseline['p95']:>+9.3f}")
+
+
+def bench_cascade(args):
+    """Каскад Vosk -> Whisper против каждого движка отдельно: время и WER"""
+    from cascade import CascadeTranscriber
+    from whisper_service import WhisperService
+
+    vosk = VoskService(args.models_dir)
+    whisper = WhisperService()
+    if not whisper.load_model(args.whisper_model):
+        raise SystemExit(f"Модель {args.whisper_model} не скачана")
+    cascade = CascadeTranscriber(vosk, whisper)
+    corpus = [(path, read_pcm(path)) for path in args.files]
+    audio_seconds = sum(len(pcm) / 2 / 16000 for _, pcm in corpus)
+    # Прогрев обеих моделей, чтобы загрузка не попала в замер
+    vosk.transcribe_pcm(bytes(32000), args.vosk_model)
+    whisper.transcribe_audio(np.zeros(16000, dtype=np.float32), args.language, args.whisper_model)
+
+    def measure(transcribe):
+        started = time.perf_counter()
+        texts = [transcribe(pcm) for _, pcm in corpus]
+        return time.perf_counter() - started, texts
+
+    vosk_time, vosk_texts = measure(lambda pcm: vosk.transcribe_pcm(pcm, args.vosk_model))
+    whisper_time, whisper_texts = measure(lambda pcm: whisper.transcribe_audio(
+        np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0, args.language, args.whisper_model))
+    # Без эталона <файл>.txt точность считается относительно Whisper
+    references = [read_reference(path, text) for (path, _), text in zip(corpus, whisper_texts)]
+
+    def wer(texts):
+        return np.mean([word_error_rate(ref, text) for ref, text in zip(references, texts)])
+
+    print(f"Корпус: {len(corpus)} файлов, {audio_seconds:.1f} с аудио")
+    print(f"{'engine':<18} {'time, s':>8} {'RTF':>7} {'vs whisper':>11} {'redecoded':>10} {'WER':>6}")
+    print(f"{'vosk ' + args.vosk_model:<18} {vosk_time:>8.2f} {vosk_time / audio_seconds:>7.3f} "
+          f"{vosk_time / whisper_time:>10.1%} {'-':>10} {wer(vosk_texts):>6.3f}")
+    print(f"{'whisper ' + args.whisper_model:<18} {whisper_time:>8.2f} {whisper_time / audio_seconds:>7.3f} "
+          f"{1:>10.1%} {'-':>10} {wer(whisper_texts):>6.3f}")
+    for threshold in args.thresholds:
+        reports = []
+
+        def run(pcm):
+            result = cascade.transcribe(pcm, args.vosk_model, args.whisper_model, threshold, args.language)
+            reports.append(result['report'])
+            return result['text']
+        cascade_time, texts = measure(run)
+        redecoded = sum(report['redecoded_seconds'] for report in reports) / audio_seconds
+        print(f"{f'cascade @{threshold}':<18} {cascade_time:>8.2f} {cascade_time / audio_seconds:>7.3f} "
+              f"{cascade_time / whisper_time:>10.1%} {redecoded:>10.1%} {wer(texts):>6.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки распознавания речи")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    vosk_parallel = subparsers.add_parser('vosk-parallel', help="Параллельное распознавание Vosk")
+    vosk_parallel.add_argument('files', nargs='+', help="WAV файлы 16 kHz mono")
+    vosk_parallel.add_argument('--model', default='small', choices=list(VoskService.MODELS))
+    vosk_parallel.add_argument('--models-dir', default='models')
+    vosk_parallel.add_argument('--workers', type=int, nargs='+')
+    vosk_parallel.set_defaults(func=bench_vosk_parallel)
+
+    whisper_stream = subparsers.add_parser('whisper-stream', help="Потоковый Whisper")
+    whisper_stream.add_argument('files', nargs='+', help="WAV файлы 16 kHz mono, эталон - <файл>.txt")
+    whisper_stream.add_argument('--model', default='base')
+    whisper_stream.add_argument('--language', default='ru')
+    whisper_stream.add_argument('--step', type=float, default=2.0, help="Шаг декодирования, секунды")
+    whisper_stream.add_argument('--chunk-seconds', type=float, default=0.5)
+    whisper_stream.add_argument('--realtime', action='store_true', help="Подавать аудио в реальном темпе")
+    whisper_stream.set_defaults(func=bench_whisper_stream)
+
+    whisper_precision = subparsers.add_parser('whisper-precision', help="Whisper fp32 против int8 на CPU")
+    whisper_precision.add_argument('files', nargs='+', help="WAV файлы 16 kHz mono, эталон - <файл>.txt")
+    whisper_precision.add_argument('--models', nargs='+', default=['tiny', 'base', 'small'])
+    whisper_precision.add_argument('--threads', type=int, default=0, help="Потоки torch, 0 - по умолчанию")
+    whisper_precision.add_argument('--language', default='ru')
+    whisper_precision.set_defaults(func=bench_whisper_precision)
+
+    whisper_batch = subparsers.add_parser('whisper-batch', help="Батчинг Whisper между клиентами")
+    whisper_batch.add_argument('files', nargs='*', help="WAV файлы 16 kHz mono (по умолчанию синтетика)")
+    whisper_batch.add_argument('--model', default='base')
+    whisper_batch.add_argument('--language', default='ru')
+    whisper_batch.add_argument('--clip-seconds', type=float, default=5)
+    whisper_batch.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8])
+    whisper_batch.add_argument('--requests', type=int, default=4, help="Запросов на клиента")
+    whisper_batch.add_argument('--max-batch', type=int, default=8)
+    whisper_batch.add_argument('--max-wait-ms', type=float, default=50)
+    whisper_batch.set_defaults(func=bench_whisper_batch)
+
+    cascade = subparsers.add_parser('cascade', help="Каскад Vosk -> Whisper")
+    cascade.add_argument('files', nargs='+', help="WAV файлы 16 kHz mono, эталон - <файл>.txt")
+    cascade.add_argument('--vosk-model', default='small', choices=list(VoskService.MODELS))
+    cascade.add_argument('--whisper-model', default='large-v3')
+    cascade.add_argument('--models-dir', default='models')
+    cascade.add_argument('--language', default='ru')
+    cascade.add_argument('--thresholds', type=float, nargs='+', default=[0.7, 0.85, 0.95])
+    cascade.set_defaults(func=bench_cascade)
+
+    summarize = subparsers.add_parser('summarize', help="Map-reduce суммаризация")
+    summarize.add_argument('files', nargs='+', help="Текстовые файлы, эталон - <файл>.summary.txt")
+    summarize.add_argument('--model', default="electromagneticcyclone/t-lite-q:3_k_l")
+    summarize.add_argument('--ollama-url', default='http://localhost:11434')
+    summarize.add_argument('--concurrency', type=int, default=4)
+    summarize.set_defaults(func=bench_summarize)
+
+    correct = subparsers.add_parser('correct', help="Исправление текста окнами предложений")
+    correct.add_argument('files', nargs='+', help="Текстовые файлы (транскрипты)")
+    correct.add_argument('--model', default="electromagneticcyclone/t-lite-q:3_k_l")
+    correct.add_argument('--ollama-url', default='http://localhost:11434')
+    correct.add_argument('--concurrency', type=int, default=4)
+    correct.set_defaults(func=bench_correct)
+
+    suite = subparsers.add_parser('suite', help="Полный набор замеров с сохранением в JSON")
+    suite.add_argument('--output', default='bench_results.json')
+    suite.add_argument('--models-dir', default='models')
+    suite.add_argument('--vosk-model', default='small', choices=list(VoskService.MODELS))
+    suite.add_argument('--whisper-model', default='tiny')
+    suite.add_argument('--clip-seconds', type=int, nargs='+', default=[5, 30])
+    suite.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4])
+    suite.add_argument('--requests', type=int, default=8, help="Запросов на каждый уровень параллельности")
+    suite.add_argument('--token-delay', type=float, default=0.01, help="Задержка заглушки Ollama на токен, с")
+    suite.set_defaults(func=bench_suite)
+
+    vosk_sessions = subparsers.add_parser('vosk-sessions', help="Живые сессии Vosk на ядро")
+    vosk_sessions.add_argument('--audio', help="16 kHz mono WAV; по умолчанию синтетический сигнал")
+    vosk_sessions.add_argument('--seconds', type=int, default=20)
+    vosk_sessions.add_argument('--model', default='small', choices=list(VoskService.MODELS))
+    vosk_sessions.add_argument('--models-dir', default='models')
+    vosk_sessions.add_argument('--chunk-ms', type=int, default=200)
+    vosk_sessions.add_argument('--sessions', type=int, nargs='+',
+                               default=[1, os.cpu_count() or 1, 2 * (os.cpu_count() or 1), 4 * (os.cpu_count() or 1)])
+    vosk_sessions.set_defaults(func=bench_vosk_sessions)
+
+    download = subparsers.add_parser('download', help="Загрузка модели с локального сервера")
+    download.add_argument('--size-mb', type=int, default=64)
+    download.add_argument('--speed-mb', type=float, default=8.0, help="Ограничение скорости одного соединения, МБ/с")
+    download.add_argument('--connections', type=int, nargs='+', default=[4, 8])
+    download.add_argument('--drops', type=int, default=3, help="Сколько ответов оборвать на середине")
+    download.set_defaults(func=bench_download)
+
+    vad = subparsers.add_parser('vad', help="Отбрасывание тишины перед распознаванием")
+    vad.add_argument('files', nargs='*', help="WAV файлы 16 kHz mono; по умолчанию синтетический сигнал")
+    vad.add_argument('--segments', type=int, default=20, help="Фраз в синтетическом сигнале")
+    vad.add_argument('--pause', type=float, default=3.0, help="Средняя пауза между фразами, с")
+    vad.add_argument('--model', choices=list(VoskService.MODELS), help="Сравнить время распознавания Vosk")
+    vad.add_argument('--models-dir', default='models')
+    vad.set_defaults(func=bench_vad)
+
+    prefork = subparsers.add_parser('prefork', help="Пре-форк воркеры с общей моделью")
+    prefork.add_argument('--workers', type=int, nargs='+', default=default_worker_counts())
+    prefork.add_argument('--model-mb', type=int, default=256, help="Размер имитации модели")
+    prefork.add_argument('--work', type=int, default=200000, help="Итераций Python на запрос")
+    prefork.add_argument('--requests', type=int, default=200)
+    prefork.set_defaults(func=bench_prefork)
+
+    compare = subparsers.add_parser('compare', help="Сравнение двух результатов suite")
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.set_defaults(func=bench_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
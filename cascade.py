@@ -0,0 +1,235 @@
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+
+from audio_utils import CHUNK_BYTES, SAMPLE_RATE
+from metrics import CASCADE_SECONDS, observe_stage
+
+# Кодировщик Whisper всегда обрабатывает окно 30 с, поэтому короткие
+# неуверенные участки выгоднее собрать в одно окно, чем декодировать по одному
+WINDOW_SECONDS = 30.0
+# Тишина между участками в собранном окне и запас аудио по краям участка
+GAP_SECONDS = 0.5
+PAD_SECONDS = 0.2
+# Соседние неуверенные фразы с паузой меньше этой объединяются в один участок
+MERGE_SECONDS = 1.0
+# Сколько предшествующего уверенного текста Vosk подсказывать Whisper как контекст
+PROMPT_CHARS = 200
+
+
+class CascadeTranscriber:
+    """Каскад Vosk -> Whisper: быстрый проход по всей записи и точный - по сомнительным местам
+
+    Vosk распознаёт запись целиком с уверенностью слов. Фразы со средней
+    уверенностью ниже порога перераспознаются Whisper, остальные берутся
+    из Vosk как есть. Неуверенные участки упаковываются в окна Whisper
+    через короткие паузы, а слова Whisper раскладываются обратно по
+    участкам по своим временам.
+
+    whisper_slots (семафор) ограничивает число одновременных
+    декодирований Whisper между запросами.
+    """
+
+    def __init__(self, vosk_service, whisper_service, whisper_slots=None):
+        self.vosk_service = vosk_service
+        self.whisper_service = whisper_service
+        self.whisper_slots = whisper_slots or threading.BoundedSemaphore(1)
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def _pieces(utterance):
+        """Режет фразу длиннее окна Whisper на куски, по возможности в паузах между словами"""
+        limit = WINDOW_SECONDS - 2 * PAD_SECONDS
+        words = utterance.get('words') or []
+        bounds = [utterance['start']]
+        for previous, word in zip(words, words[1:]):
+            if word['end'] - bounds[-1] > limit:
+                bounds.append((previous['end'] + word['start']) / 2)
+        bounds.append(utterance['end'])
+        pieces = []
+        for start, end in zip(bounds, bounds[1:]):
+            # Кусок без пауз длиннее окна (или фраза без слов) делится поровну
+            count = max(math.ceil((end - start) / limit), 1)
+            step = (end - start) / count
+            pieces.extend((start + k * step, start + (k + 1) * step) for k in range(count))
+        return pieces
+
+    @classmethod
+    def _segments(cls, utterances, threshold):
+        """Группирует подряд идущие неуверенные фразы в участки не длиннее окна Whisper
+
+        Фраза длиннее окна становится несколькими участками с одним индексом
+        и пометкой piece - интервалом куска внутри фразы.
+        """
+        segments = []
+        for index, utterance in enumerate(utterances):
+            if utterance['conf'] >= threshold:
+                continue
+            start = max(utterance['start'] - PAD_SECONDS, 0.0)
+            end = utterance['end'] + PAD_SECONDS
+            if end - start > WINDOW_SECONDS:
+                for piece_start, piece_end in cls._pieces(utterance):
+                    segments.append({'start': max(piece_start - PAD_SECONDS, 0.0), 'end': piece_end + PAD_SECONDS,
+                                     'indices': [index], 'piece': (piece_start, piece_end)})
+                continue
+            last = segments[-1] if segments else None
+            if (last is not None and 'piece' not in last and last['indices'][-1] == index - 1
+                    and start - last['end'] < MERGE_SECONDS
+                    and end - last['start'] <= WINDOW_SECONDS):
+                last['end'] = end
+                last['indices'].append(index)
+            else:
+                segments.append({'start': start, 'end': end, 'indices': [index]})
+        return segments
+
+    @staticmethod
+    def _groups(segments):
+        """Участки, заменяющие одни и те же фразы: куски длинной фразы или одиночный участок"""
+        groups = []
+        for segment in segments:
+            if 'piece' in segment and groups and 'piece' in groups[-1][0] \
+                    and groups[-1][0]['indices'] == segment['indices']:
+                groups[-1].append(segment)
+            else:
+                groups.append([segment])
+        return groups
+
+    @staticmethod
+    def _merge(utterances, group):
+        """Заменяет фразы группы текстом Whisper, когда все её участки распознаны"""
+        # Пустой ответ Whisper (слова не попали в участок) - оставляем Vosk, чтобы не потерять речь
+        if not any(segment['text'] for segment in group):
+            return
+        indices = group[0]['indices']
+        texts = []
+        for segment in group:
+            text = segment['text']
+            if not text and 'piece' in segment:
+                # Кусок длинной фразы, где Whisper ничего не услышал, - слова Vosk из его интервала
+                start, end = segment['piece']
+                text = ' '.join(word['word'] for word in utterances[indices[0]].get('words', [])
+                                if start <= (word['start'] + word['end']) / 2 < end)
+            if text:
+                texts.append(text)
+        utterances[indices[0]] = {
+            'text': ' '.join(texts),
+            'start': utterances[indices[0]]['start'],
+            'end': utterances[indices[-1]]['end'],
+            'conf': round(min(utterances[i]['conf'] for i in indices), 3),
+            'engine': 'whisper',
+            'vosk_text': ' '.join(utterances[i]['text'] for i in indices)
+        }
+        for index in indices[1:]:
+            utterances[index] = None
+
+    @staticmethod
+    def _windows(segments):
+        """Раскладывает участки по окнам Whisper так, чтобы окно не превышало 30 с"""
+        windows = []
+        length = 0.0
+        for segment in segments:
+            duration = segment['end'] - segment['start']
+            if windows and length + GAP_SECONDS + duration <= WINDOW_SECONDS:
+                windows[-1].append(segment)
+                length += GAP_SECONDS + duration
+            else:
+                windows.append([segment])
+                length = duration
+        return windows
+
+    def _redecode(self, samples, window, whisper_model, language, prompt):
+        """Распознаёт окно Whisper и возвращает текст каждого участка окна"""
+        gap = np.zeros(int(GAP_SECONDS * SAMPLE_RATE), dtype=np.float32)
+        pieces = []
+        offsets = []
+        position = 0
+        for segment in window:
+            if pieces:
+                pieces.append(gap)
+                position += len(gap)
+            piece = samples[int(segment['start'] * SAMPLE_RATE):int(segment['end'] * SAMPLE_RATE)]
+            offsets.append(position / SAMPLE_RATE)
+            pieces.append(piece)
+            position += len(piece)
+
+        with self.whisper_slots:
+            words = self.whisper_service.transcribe_words(
+                np.concatenate(pieces), language, whisper_model, initial_prompt=prompt or None)
+
+        # Граница между участками - середина паузы: слово с неточным временем
+        # попадает к ближайшему участку, а не теряется
+        bounds = np.array(offsets[1:]) - GAP_SECONDS / 2
+        texts = [[] for _ in window]
+        for word in words:
+            middle = (word['start'] + word['end']) / 2
+            texts[int(np.searchsorted(bounds, middle, side='right'))].append(word['word'])
+        return [''.join(text).strip() for text in texts]
+
+    def transcribe(self, pcm, vosk_model='small', whisper_model='large-v3', threshold=0.85, language='ru',
+                   on_progress=None):
+        """Распознаёт 16 kHz mono PCM каскадом; возвращает текст, фразы с движком и отчёт
+
+        on_progress(stage, progress) вызывается по ходу прохода Vosk (доля
+        аудио) и после каждого окна Whisper (доля окон); исключение из него
+        (например, отмена задачи) прерывает распознавание.
+        """
+        started = time.perf_counter()
+
+        def chunks():
+            for offset in range(0, len(pcm), CHUNK_BYTES):
+                if on_progress is not None:
+                    on_progress('recognition', offset / len(pcm))
+                yield pcm[offset:offset + CHUNK_BYTES]
+        utterances = [dict(utterance, engine='vosk')
+                      for utterance in self.vosk_service.iter_utterances(chunks(), vosk_model)]
+        vosk_time = time.perf_counter() - started
+
+        segments = self._segments(utterances, threshold)
+        windows = self._windows(segments)
+        groups = {id(group[-1]): group for group in self._groups(segments)}
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        started = time.perf_counter()
+        for done, window in enumerate(windows):
+            if on_progress is not None:
+                on_progress('cascade_whisper', done / len(windows))
+            # Подсказка - надёжный текст (уверенный Vosk или уже исправленный Whisper) перед окном
+            first = window[0]['indices'][0]
+            prompt = ' '.join(u['text'] for u in utterances[:first]
+                              if u is not None and (u['engine'] == 'whisper' or u['conf'] >= threshold))
+            prompt = prompt[-PROMPT_CHARS:]
+            texts = self._redecode(samples, window, whisper_model, language, prompt)
+            for segment, text in zip(window, texts):
+                segment['text'] = text
+                # Куски длинной фразы могут попасть в разные окна - заменяем её после последнего
+                group = groups.get(id(segment))
+                if group is not None:
+                    self._merge(utterances, group)
+        whisper_time = time.perf_counter() - started
+        if on_progress is not None and windows:
+            on_progress('cascade_whisper', 1.0)
+        utterances = [utterance for utterance in utterances if utterance is not None]
+        observe_stage('cascade_whisper', whisper_time)
+
+        audio_seconds = len(pcm) / 2 / SAMPLE_RATE
+        redecoded = sum(segment['end'] - segment['start'] for segment in segments)
+        CASCADE_SECONDS.inc(audio_seconds - redecoded, engine='vosk')
+        CASCADE_SECONDS.inc(redecoded, engine='whisper')
+        report = {
+            'audio_seconds': round(audio_seconds, 2),
+            'redecoded_seconds': round(redecoded, 2),
+            'redecoded_ratio': round(redecoded / audio_seconds, 3) if audio_seconds else 0.0,
+            'utterances': len(utterances),
+            'whisper_segments': len(segments),
+            'whisper_windows': len(windows),
+            'vosk_time': round(vosk_time, 3),
+            'whisper_time': round(whisper_time, 3)
+        }
+        self.logger.info(f"Cascade: {report}")
+        return {
+            'text': ' '.join(u['text'] for u in utterances).strip() or 'Текст не распознан',
+            'utterances': utterances,
+            'report': report
+        }
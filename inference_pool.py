@@ -0,0 +1,97 @@
+import asyncio
+import collections
+import contextvars
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(Exception):
+    """Очередь пула переполнена, задача отклонена"""
+
+    def __init__(self, retry_after):
+        super().__init__("Сервер перегружен, попробуйте позже")
+        self.retry_after = retry_after
+
+
+class InferencePool:
+    """Ограниченный пул для тяжёлых задач распознавания вне event loop"""
+
+    def __init__(self, workers=1, max_queue=8, initial_estimate=30.0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inference')
+        self.logger = logging.getLogger(__name__)
+        self.active = 0
+        self.waiting = collections.deque()
+        self.condition = None
+        # Скользящая оценка длительности одной задачи, секунды
+        self.avg_duration = initial_estimate
+
+    @property
+    def queue_depth(self):
+        return len(self.waiting)
+
+    @property
+    def is_full(self):
+        return self.active >= self.workers and len(self.waiting) >= self.max_queue
+
+    def eta(self, position):
+        """Оценка времени ожидания до завершения задачи на позиции position"""
+        rounds = (position - 1) // self.workers + 1
+        return round(rounds * self.avg_duration + self.avg_duration, 1)
+
+    async def run(self, func, *args, on_queued=None):
+        """Выполняет func(*args) в пуле, дожидаясь своей очереди"""
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+
+        if self.is_full:
+            raise QueueFullError(self.eta(len(self.waiting) + 1))
+
+        ticket = object()
+        self.waiting.append(ticket)
+        last_position = None
+        try:
+            while True:
+                async with self.condition:
+                    if self.active < self.workers and self.waiting[0] is ticket:
+                        self.waiting.popleft()
+                        self.active += 1
+                        break
+                    position = self.waiting.index(ticket) + 1
+
+                # Сообщаем клиенту позицию вне блокировки, чтобы не задерживать остальных
+                if on_queued is not None and position != last_position:
+                    last_position = position
+                    await on_queued(position, self.eta(position))
+
+                async with self.condition:
+                    if not (self.active < self.workers and self.waiting[0] is ticket):
+                        await self.condition.wait()
+        except BaseException:
+            if ticket in self.waiting:
+                self.waiting.remove(ticket)
+                async with self.condition:
+                    self.condition.notify_all()
+            raise
+
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        # Копия контекста сохраняет trace id запроса в логах потока-исполнителя
+        context = contextvars.copy_context()
+        future = loop.run_in_executor(self.executor, functools.partial(context.run, func, *args))
+        # Слот освобождается только когда поток действительно закончил работу,
+        # даже если клиент отключился раньше
+        future.add_done_callback(lambda _: loop.create_task(self._release(started)))
+        return await asyncio.shield(future)
+
+    async def _release(self, started):
+        self.avg_duration = 0.8 * self.avg_duration + 0.2 * (time.monotonic() - started)
+        async with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,220 @@
+import contextvars
+import itertools
+import logging
+import os
+import threading
+import time
+import uuid
+
+
+class JobCancelled(Exception):
+    """Задача отменена клиентом"""
+
+
+class Job:
+    """Фоновая задача с этапом, прогрессом и возможностью отмены"""
+
+    FINISHED = ('done', 'error', 'cancelled')
+
+    def __init__(self, func, priority, size, description, cleanup=None):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.cleanup = cleanup
+        self.priority = priority
+        self.size = size
+        self.description = description
+        self.status = 'queued'
+        self.stage = 'queued'
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        # Задача выполняется в контексте отправившего её запроса (trace id в логах)
+        self.context = contextvars.copy_context()
+        # Номер версии растёт при каждом изменении - по нему ждут подписчики
+        self.version = 0
+        self.changed = threading.Condition()
+
+    def _touch(self):
+        with self.changed:
+            self.version += 1
+            self.changed.notify_all()
+
+    def report(self, stage=None, progress=None):
+        """Обновляет этап/прогресс; в отменённой задаче бросает JobCancelled"""
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        changed = False
+        if stage is not None and stage != self.stage:
+            self.stage = stage
+            changed = True
+        if progress is not None:
+            progress = min(max(progress, 0.0), 1.0)
+            # Подписчиков будим не чаще, чем на каждые полпроцента
+            if abs(progress - self.progress) >= 0.005 or progress == 1.0:
+                self.progress = progress
+                changed = True
+        if changed:
+            self._touch()
+
+    def wait_change(self, version, timeout=15):
+        """Ждёт изменения задачи после версии version, возвращает новую версию"""
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version, timeout=timeout)
+            return self.version
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': round(self.progress, 3),
+            'priority': self.priority,
+            'size': self.size,
+            'description': self.description,
+            'result': self.result,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished
+        }
+
+
+class JobManager:
+    """Очередь фоновых задач с учётом приоритета и размера
+
+    Среди задач одного приоритета первой берётся самая короткая, а
+    ожидание постепенно уменьшает эффективный размер, поэтому длинные
+    задачи не голодают бесконечно.
+    """
+
+    def __init__(self, workers=2, aging_rate=10.0, keep_seconds=3600):
+        self.logger = logging.getLogger(__name__)
+        # На сколько единиц размера (секунд аудио) "укорачивается" задача за секунду ожидания
+        self.aging_rate = aging_rate
+        self.keep_seconds = keep_seconds
+        self.workers = workers
+        # Префикс id задач; в пре-форк режиме по нему находится процесс, владеющий задачей
+        self.id_prefix = ''
+        self._reset()
+        # Потоки и задачи не переживают fork - дочерний процесс начинает с чистой очереди
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.jobs = {}
+        self.queue = []
+        self.condition = threading.Condition()
+        self.sequence = itertools.count()
+        self.active = 0
+        # Потоки запускаются с первой задачей, поэтому процесс без задач можно форкать
+        self.threads = []
+
+    def _start_threads(self):
+        if not self.threads:
+            self.threads = [threading.Thread(target=self._worker, daemon=True, name=f'job-worker-{i}')
+                            for i in range(self.workers)]
+            for thread in self.threads:
+                thread.start()
+
+    @property
+    def queue_depth(self):
+        return len(self.queue)
+
+    def submit(self, func, priority=0, size=0.0, description=None, cleanup=None):
+        """Ставит func(job) в очередь и возвращает задачу
+
+        cleanup() вызывается при любом завершении, в том числе при отмене
+        ещё не начатой задачи.
+        """
+        job = Job(func, priority, size, description, cleanup)
+        job.id = self.id_prefix + job.id
+        with self.condition:
+            self._start_threads()
+            self._purge()
+            self.jobs[job.id] = job
+            self.queue.append((next(self.sequence), job))
+            self.condition.notify()
+        return job
+
+    def get(self, job_id):
+        with self.condition:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Отменяет задачу; выполняющаяся остановится на ближайшем report()"""
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None or job.status in Job.FINISHED:
+                return job
+            job.cancel_event.set()
+            for index, (_, queued) in enumerate(self.queue):
+                if queued is job:
+                    del self.queue[index]
+                    self._finish(job, 'cancelled')
+                    break
+        return job
+
+    def position(self, job):
+        """Позиция задачи в порядке выдачи воркерам (1 - следующая)"""
+        with self.condition:
+            ordered = sorted(self.queue, key=self._key)
+            for index, (_, queued) in enumerate(ordered):
+                if queued is job:
+                    return index + 1
+        return None
+
+    def _key(self, item):
+        sequence, job = item
+        waited = time.time() - job.created
+        return job.priority, job.size - waited * self.aging_rate, sequence
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                item = min(self.queue, key=self._key)
+                self.queue.remove(item)
+                job = item[1]
+                job.status = 'running'
+                job.started = time.time()
+                self.active += 1
+            try:
+                job.report(stage='started')
+                result = job.context.run(job.func, job)
+                with self.condition:
+                    job.result = result
+                    job.progress = 1.0
+                    self._finish(job, 'done')
+            except JobCancelled:
+                with self.condition:
+                    self._finish(job, 'cancelled')
+            except Exception as e:
+                self.logger.error(f"Job {job.id} failed: {e}")
+                with self.condition:
+                    job.error = str(e)
+                    self._finish(job, 'error')
+            finally:
+                with self.condition:
+                    self.active -= 1
+
+    def _finish(self, job, status):
+        job.status = status
+        job.stage = status
+        job.finished = time.time()
+        if job.cleanup is not None:
+            try:
+                job.cleanup()
+            except Exception as e:
+                self.logger.error(f"Job {job.id} cleanup failed: {e}")
+        job._touch()
+
+    def _purge(self):
+        """Забывает давно завершённые задачи"""
+        deadline = time.time() - self.keep_seconds
+        for job_id, job in list(self.jobs.items()):
+            if job.status in Job.FINISHED and job.finished < deadline:
+                del self.jobs[job_id]
@@ -0,0 +1,254 @@
+import contextvars
+import logging
+import math
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Идентификатор запроса, к которому относятся текущие логи и замеры
+trace_id = contextvars.ContextVar('trace_id', default='-')
+
+# Границы корзин гистограмм длительностей, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self, extra=()):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value, extra))
+        return lines
+
+    def _samples(self, key, value, extra=()):
+        return [f"{self.name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Текущее значение; может вычисляться функцией в момент выдачи метрик"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.functions = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function, **labels):
+        self.functions[self._key(labels)] = function
+
+    def render(self, extra=()):
+        for key, function in list(self.functions.items()):
+            try:
+                value = function()
+            except Exception:
+                continue
+            with self.lock:
+                self.values[key] = value
+        return super().render(extra)
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам с суммой и количеством"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    def _samples(self, key, value, extra=()):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, list(extra) + [('le', _format_value(float(bound)))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key, extra)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+
+    def render(self, **labels):
+        """Все метрики в текстовом формате Prometheus; labels добавляются к каждому значению"""
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render(tuple(labels.items())))
+        return '\n'.join(lines) + '\n'
+
+
+def merge_rendered(texts):
+    """Склеивает выводы render() нескольких процессов в один
+
+    Формат Prometheus требует, чтобы значения одной метрики шли подряд
+    после её HELP и TYPE, поэтому строки группируются по метрикам.
+    """
+    families = {}
+    current = None
+    for text in texts:
+        for line in text.splitlines():
+            if line.startswith('# HELP '):
+                current = families.setdefault(line.split(' ', 3)[2], ([], []))
+                if not current[0]:
+                    current[0].append(line)
+            elif line.startswith('# TYPE '):
+                if len(current[0]) < 2:
+                    current[0].append(line)
+            elif line and current is not None:
+                current[1].append(line)
+    return ''.join('\n'.join(header + samples) + '\n' for header, samples in families.values())
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = Histogram('speech_stage_seconds', 'Duration of pipeline stages', ['stage'])
+MODEL_LOAD_SECONDS = Histogram('speech_model_load_seconds', 'Time spent loading models into memory', ['engine'])
+CACHE_REQUESTS = Counter('speech_cache_requests_total', 'Cache lookups by result', ['cache', 'result'])
+HTTP_REQUESTS = Counter('speech_http_requests_total', 'HTTP requests by endpoint and status', ['endpoint', 'status'])
+HTTP_SECONDS = Histogram('speech_http_request_seconds', 'HTTP request handling time', ['endpoint'])
+WEBSOCKET_SESSIONS = Gauge('speech_websocket_sessions', 'Open WebSocket sessions')
+WEBSOCKET_SESSIONS_TOTAL = Counter('speech_websocket_sessions_total', 'WebSocket sessions by mode', ['mode'])
+VAD_SECONDS = Counter('speech_vad_audio_seconds_total', 'Audio seen by the VAD pre-filter', ['kind'])
+CASCADE_SECONDS = Counter('speech_cascade_audio_seconds_total', 'Audio taken from each engine of the cascade', ['engine'])
+WHISPER_BATCH_SIZE = Histogram('speech_whisper_batch_size', 'Requests decoded together in one Whisper batch',
+                               buckets=(1, 2, 4, 8, 16, 32))
+QUEUE_DEPTH = Gauge('speech_queue_depth', 'Requests waiting in a queue', ['queue'])
+
+
+def new_trace(value=None):
+    """Начинает трассировку запроса, возвращает её идентификатор"""
+    value = value or uuid.uuid4().hex[:16]
+    trace_id.set(value)
+    return value
+
+
+def observe_stage(name, seconds):
+    """Записывает длительность этапа в гистограмму и в лог с trace id"""
+    STAGE_SECONDS.observe(seconds, stage=name)
+    logging.getLogger('metrics').info(f"stage={name} seconds={seconds:.3f}")
+
+
+@contextmanager
+def stage(name):
+    """Замеряет этап конвейера внутри блока with"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+class TimedChunks:
+    """Пропускает через себя итератор, суммируя время ожидания следующего элемента
+
+    Позволяет отделить время декодирования от времени распознавания,
+    когда они чередуются в одном потоке.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.seconds = 0.0
+
+    def __iter__(self):
+        iterator = iter(self.chunks)
+        while True:
+            started = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                self.seconds += time.perf_counter() - started
+                return
+            self.seconds += time.perf_counter() - started
+            yield chunk
+
+
+class TraceIdFilter(logging.Filter):
+    """Добавляет trace id текущего запроса в каждую запись лога"""
+
+    def filter(self, record):
+        record.trace_id = trace_id.get()
+        return True
+
+
+def configure_logging(level=logging.INFO):
+    """Настраивает корневой логгер с trace id в каждой строке"""
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s')
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(TraceIdFilter())
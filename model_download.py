@@ -0,0 +1,318 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Размер сегмента, который скачивается одним Range-запросом
+SEGMENT_BYTES = 8 * 2**20
+# Порция чтения ответа и записи в файл
+BLOCK_BYTES = 256 * 2**10
+# Конец архива с центральным каталогом zip скачивается первым
+TAIL_BYTES = 2**20
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadError(Exception):
+    """Загрузка не удалась или файл не прошёл проверку"""
+
+
+class RangedDownload:
+    """Загрузка файла параллельными Range-запросами с возобновлением
+
+    Данные пишутся в <dest>.part, а скачанные границы каждого сегмента -
+    в <dest>.part.json. После обрыва повторный запуск докачивает только
+    недостающее, если размер и ETag файла на сервере не изменились.
+    """
+
+    def __init__(self, url, dest, connections=4, segment_bytes=SEGMENT_BYTES, session=None,
+                 retries=5, timeout=(5, 60), on_progress=None):
+        self.url = url
+        self.dest = dest
+        self.part_path = dest + '.part'
+        self.state_path = dest + '.part.json'
+        self.connections = connections
+        self.segment_bytes = segment_bytes
+        self.session = session or requests.Session()
+        self.retries = retries
+        self.timeout = timeout
+        self.on_progress = on_progress
+        self.size = None
+        self.validator = None
+        self.segments = []
+        self.error = None
+        self.finished = False
+        self.condition = threading.Condition()
+        self.save_lock = threading.Lock()
+        self.last_save = 0.0
+
+    def probe(self):
+        """Узнаёт размер файла и поддержку Range; False - нужен обычный GET"""
+        response = self.session.head(self.url, allow_redirects=True, timeout=self.timeout)
+        if response.status_code == 405:
+            return False
+        response.raise_for_status()
+        self.url = response.url
+        size = response.headers.get('Content-Length')
+        if response.headers.get('Accept-Ranges', '').lower() != 'bytes' or not size:
+            return False
+        self.size = int(size)
+        self.validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+        return self.size > 0
+
+    def _load_state(self):
+        """Сегменты [начало, скачано до, конец]; прогресс прошлой попытки, если он применим"""
+        self.segments = [[start, start, min(start + self.segment_bytes, self.size)]
+                         for start in range(0, self.size, self.segment_bytes)]
+        if not (os.path.exists(self.state_path) and os.path.exists(self.part_path)):
+            return
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if (state.get('size'), state.get('validator'), state.get('segment_bytes')) != \
+                (self.size, self.validator, self.segment_bytes):
+            logger.info(f"Remote file changed, restarting download of {self.url}")
+            return
+        for segment, done in zip(self.segments, state.get('done', [])):
+            segment[1] = min(max(done, segment[0]), segment[2])
+        logger.info(f"Resuming {self.url}: {self.downloaded / 2**20:.0f} of {self.size / 2**20:.0f} MB present")
+
+    def _save_state(self, force=False):
+        # Сохраняет не чаще раза в секунду; пока сохраняет другой поток - пропускаем
+        if not self.save_lock.acquire(blocking=force):
+            return
+        try:
+            now = time.monotonic()
+            if not force and now - self.last_save < 1.0:
+                return
+            self.last_save = now
+            with self.condition:
+                state = {'size': self.size, 'validator': self.validator, 'segment_bytes': self.segment_bytes,
+                         'done': [segment[1] for segment in self.segments]}
+            # Запись через временный файл: состояние не бывает полузаписанным
+            with open(self.state_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(self.state_path + '.tmp', self.state_path)
+        finally:
+            self.save_lock.release()
+
+    @property
+    def downloaded(self):
+        with self.condition:
+            return sum(done - start for start, done, _ in self.segments)
+
+    def abort(self, reason):
+        """Останавливает загрузку; скачанное остаётся для возобновления"""
+        with self.condition:
+            if self.error is None:
+                self.error = DownloadError(reason)
+            self.condition.notify_all()
+
+    def available(self, start, end):
+        """Скачаны ли все байты диапазона [start, end)"""
+        with self.condition:
+            for segment_start, done, segment_end in self.segments:
+                if segment_end <= start or segment_start >= end:
+                    continue
+                if done < min(end, segment_end):
+                    return False
+            return True
+
+    def wait_for(self, start, end):
+        """Ждёт, пока диапазон будет скачан; бросает ошибку загрузки"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.error or self.finished or self.available(start, end))
+            if self.error:
+                raise self.error
+            if not self.available(start, end):
+                raise DownloadError(f"Range {start}-{end} was not downloaded")
+
+    def _fetch_segment(self, index):
+        start, done, end = self.segments[index]
+        for attempt in range(self.retries):
+            if self.error:
+                return
+            try:
+                with self.session.get(self.url, headers={'Range': f'bytes={done}-{end - 1}'},
+                                      stream=True, timeout=self.timeout) as response:
+                    if response.status_code != 206:
+                        raise DownloadError(f"Server ignored range request (HTTP {response.status_code})")
+                    # Без буферизации: записанное сразу видно распаковщику
+                    with open(self.part_path, 'r+b', buffering=0) as f:
+                        f.seek(done)
+                        for block in response.iter_content(BLOCK_BYTES):
+                            if self.error:
+                                return
+                            block = block[:end - done]
+                            f.write(block)
+                            done += len(block)
+                            with self.condition:
+                                self.segments[index][1] = done
+                                self.condition.notify_all()
+                            self._save_state()
+                            if self.on_progress is not None:
+                                self.on_progress(self.downloaded, self.size)
+                            if done >= end:
+                                break
+                if done >= end:
+                    return
+                raise DownloadError("Connection closed before the segment was complete")
+            except (requests.RequestException, DownloadError) as e:
+                if attempt == self.retries - 1:
+                    raise DownloadError(f"Segment {start}-{end} failed: {e}") from e
+                logger.warning(f"Segment {start}-{end} interrupted at {done}: {e}; retrying")
+                time.sleep(min(2 ** attempt * 0.5, 10))
+
+    def run(self):
+        """Скачивает все недостающие сегменты; конец файла - в первую очередь
+
+        Ошибка не пробрасывается, а сохраняется в self.error, чтобы run
+        можно было запускать в отдельном потоке.
+        """
+        try:
+            self._load_state()
+            mode = 'r+b' if os.path.exists(self.part_path) else 'wb'
+            with open(self.part_path, mode) as f:
+                f.truncate(self.size)
+            pending = [index for index, (_, done, end) in enumerate(self.segments) if done < end]
+            # Центральный каталог zip лежит в конце - он нужен распаковке раньше остального
+            tail = [index for index in pending if self.segments[index][2] > self.size - TAIL_BYTES]
+            order = tail + [index for index in pending if index not in tail]
+            with ThreadPoolExecutor(max_workers=self.connections) as pool:
+                for future in [pool.submit(self._fetch_segment, index) for index in order]:
+                    future.result()
+            self._save_state(force=True)
+        except Exception as e:
+            logger.error(f"Download of {self.url} failed: {e}")
+            self.abort(str(e))
+            if os.path.exists(self.part_path):
+                self._save_state(force=True)
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    def cleanup(self):
+        for path in (self.part_path, self.state_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _download_whole(url, dest, session, timeout, on_progress=None):
+    """Обычная загрузка одним запросом для серверов без поддержки Range"""
+    with session.get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        total = int(response.headers.get('Content-Length') or 0)
+        done = 0
+        with open(dest + '.part', 'wb') as f:
+            for block in response.iter_content(BLOCK_BYTES):
+                f.write(block)
+                done += len(block)
+                if on_progress is not None:
+                    on_progress(done, total)
+    if total and done != total:
+        raise DownloadError(f"Downloaded {done} of {total} bytes")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_BYTES * 4), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _extract_progressively(download, zip_path, target):
+    """Распаковывает члены архива по мере того, как их байты скачаны
+
+    Каталог архива читается из уже скачанного конца файла. Если он не
+    уместился в хвост, распаковка ждёт окончания загрузки.
+    """
+    download.wait_for(max(0, download.size - TAIL_BYTES), download.size)
+    try:
+        archive = zipfile.ZipFile(zip_path)
+    except zipfile.BadZipFile:
+        download.wait_for(0, download.size)
+        archive = zipfile.ZipFile(zip_path)
+    with archive:
+        members = sorted(archive.infolist(), key=lambda info: info.header_offset)
+        ends = [info.header_offset for info in members[1:]] + [archive.start_dir]
+        for member, end in zip(members, ends):
+            download.wait_for(member.header_offset, end)
+            # ZipExtFile проверяет CRC каждого члена при чтении
+            archive.extract(member, target)
+
+
+def fetch_and_extract(url, directory, name, connections=4, sha256=None, session=None,
+                      segment_bytes=SEGMENT_BYTES, on_progress=None, require_sha256=False):
+    """Скачивает zip url и распаковывает из него каталог name в directory
+
+    Распаковка идёт параллельно с загрузкой во временный каталог и
+    переносится на место только после проверки размера, CRC и (если
+    известна) SHA-256 архива, поэтому прерванная загрузка не оставляет
+    полусобранную модель. Частично скачанный архив сохраняется для
+    возобновления.
+
+    CRC ловит только повреждение при передаче, но не подменённый архив.
+    Без sha256 загрузка при require_sha256 отклоняется, а иначе в лог
+    пишется предупреждение с дайджестом скачанного архива, чтобы его
+    можно было сверить с опубликованным и закрепить.
+    """
+    session = session or requests.Session()
+    zip_path = os.path.join(directory, f'{name}.zip')
+    staging = os.path.join(directory, f'.{name}.extracting')
+    shutil.rmtree(staging, ignore_errors=True)
+
+    download = RangedDownload(url, zip_path, connections, segment_bytes, session, on_progress=on_progress)
+    started = time.perf_counter()
+    try:
+        if download.probe():
+            worker = threading.Thread(target=download.run, daemon=True, name=f'download-{name}')
+            worker.start()
+            try:
+                _extract_progressively(download, download.part_path, staging)
+            except BaseException:
+                download.abort("Extraction failed")
+                raise
+            finally:
+                worker.join()
+            if download.error:
+                raise download.error
+        else:
+            logger.info(f"{url}: server does not support ranges, downloading in one request")
+            _download_whole(url, zip_path, session, download.timeout, on_progress)
+            with zipfile.ZipFile(zip_path + '.part') as archive:
+                archive.extractall(staging)
+
+        digest = file_sha256(zip_path + '.part')
+        if sha256 and digest != sha256.lower():
+            download.cleanup()
+            raise DownloadError(f"Checksum mismatch for {url}")
+        if not sha256:
+            if require_sha256:
+                download.cleanup()
+                raise DownloadError(f"No SHA-256 configured for {url}, refusing unverified archive")
+            logger.warning(f"{url}: no SHA-256 configured, archive not verified (sha256 {digest})")
+
+        extracted = os.path.join(staging, name)
+        if not os.path.isdir(extracted):
+            raise DownloadError(f"Archive {url} does not contain {name}/")
+        os.replace(extracted, os.path.join(directory, name))
+        download.cleanup()
+        elapsed = time.perf_counter() - started
+        logger.info(f"{name}: downloaded and extracted in {elapsed:.1f}s")
+    except zipfile.BadZipFile as e:
+        # Повреждённый архив не стоит докачивать - начинаем заново в следующий раз
+        download.cleanup()
+        raise DownloadError(f"Corrupted archive {url}: {e}") from e
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
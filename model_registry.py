@@ -0,0 +1,156 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from metrics import CACHE_REQUESTS, MODEL_LOAD_SECONDS
+
+
+class _Entry:
+    def __init__(self, model, size, load_seconds):
+        self.model = model
+        self.size = size
+        self.load_seconds = load_seconds
+        self.refs = 0
+
+
+class ModelRegistry:
+    """Общий кэш загруженных моделей с бюджетом памяти и LRU-вытеснением
+
+    Модели, которые сейчас используются (refs > 0), никогда не вытесняются.
+    Если все модели заняты, новая загружается сверх бюджета.
+    """
+
+    def __init__(self, budget_bytes):
+        self.budget = budget_bytes
+        self.logger = logging.getLogger(__name__)
+        self.entries = OrderedDict()
+        self.loading = {}
+        self.condition = threading.Condition()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+        # Загруженные модели наследуются при fork, а блокировка - нет
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self.condition = threading.Condition()
+        self.loading = {}
+
+    @property
+    def used(self):
+        return sum(entry.size for entry in self.entries.values())
+
+    def _take(self, key, loader, size):
+        with self.condition:
+            while True:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.hits += 1
+                    CACHE_REQUESTS.inc(cache='models', result='hit')
+                    self.entries.move_to_end(key)
+                    entry.refs += 1
+                    return entry.model
+                if key not in self.loading:
+                    break
+                # Ту же модель уже загружает другой поток - ждём его
+                self.condition.wait()
+            self.misses += 1
+            CACHE_REQUESTS.inc(cache='models', result='miss')
+            self.loading[key] = True
+            self._evict(size)
+
+        started = time.perf_counter()
+        try:
+            model = loader()
+        except BaseException:
+            with self.condition:
+                del self.loading[key]
+                self.condition.notify_all()
+            raise
+        elapsed = time.perf_counter() - started
+        MODEL_LOAD_SECONDS.observe(elapsed, engine=key[0])
+        self.logger.info(f"Model {key} loaded in {elapsed:.1f}s ({size / 2**20:.0f} MB)")
+
+        with self.condition:
+            del self.loading[key]
+            entry = _Entry(model, size, elapsed)
+            entry.refs = 1
+            self.entries[key] = entry
+            self.load_seconds += elapsed
+            self.condition.notify_all()
+        return model
+
+    def _evict(self, needed):
+        """Вытесняет давно не использованные свободные модели, освобождая место"""
+        for key in list(self.entries):
+            if self.used + needed <= self.budget:
+                return
+            if self.entries[key].refs == 0:
+                self.logger.info(f"Evicting model {key}")
+                del self.entries[key]
+                self.evictions += 1
+        if self.used + needed > self.budget:
+            self.logger.warning("Model memory budget exceeded: all resident models are in use")
+
+    def release(self, key):
+        with self.condition:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry.refs -= 1
+
+    @contextmanager
+    def acquire(self, key, loader, size):
+        """Выдаёт модель на время блока with, загружая её при необходимости"""
+        model = self._take(key, loader, size)
+        try:
+            yield model
+        finally:
+            self.release(key)
+
+    def get(self, key, loader, size):
+        """Загружает модель в кэш (или отмечает использование) без удержания"""
+        model = self._take(key, loader, size)
+        self.release(key)
+        return model
+
+    def is_loaded(self, key):
+        with self.condition:
+            return key in self.entries
+
+    def stats(self):
+        with self.condition:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests, 3) if requests else None,
+                'evictions': self.evictions,
+                'load_seconds_total': round(self.load_seconds, 2),
+                'budget_mb': round(self.budget / 2**20),
+                'used_mb': round(self.used / 2**20),
+                'models': [{
+                    'key': '/'.join(key),
+                    'size_mb': round(entry.size / 2**20),
+                    'refs': entry.refs,
+                    'load_seconds': round(entry.load_seconds, 2)
+                } for key, entry in self.entries.items()]
+            }
+
+
+def path_size(path):
+    """Размер файла или каталога на диске в байтах"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+# Общий реестр для всех сервисов распознавания
+registry = ModelRegistry(int(os.environ.get('MODEL_MEMORY_BUDGET_MB', 8192)) * 2**20)
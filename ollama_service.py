@@ -1,23 +1,128 @@
 import subprocess
 import time
+import json
 import requests
 import logging
+import os
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from result_cache import ResultCache
+from text_utils import chunk_sentences, estimate_tokens, sentence_windows, split_sentences
+from text_index import IndexCache
+from metrics import observe_stage, stage
 
 class OllamaService:
-    def __init__(self):
+    BASE_URL = 'http://localhost:11434'
+    # Таймауты подключения и ожидания очередной порции ответа, секунды
+    TIMEOUT = (3.05, 300)
+    # Тексты длиннее этого бюджета токенов суммаризируются через map-reduce
+    SUMMARY_CHUNK_TOKENS = 1500
+    # Транскрипт длиннее этого бюджета отвечает на вопрос только по найденным фрагментам
+    ASK_FULL_TEXT_TOKENS = 2000
+    ASK_TOP_K = 6
+    # Исправление идёт окнами предложений не длиннее этого бюджета токенов; соседние
+    # предложения передаются модели как контекст, но в ответ не входят
+    CORRECT_WINDOW_TOKENS = 400
+    CORRECT_CONTEXT_SENTENCES = 1
+    # Ответ окна длиннее или короче исходного больше чем во столько раз - обрыв или пересказ
+    CORRECT_MAX_LENGTH_RATIO = 1.5
+    # Сколько запросов к Ollama по умолчанию выполняется одновременно во всём процессе
+    CONCURRENCY = int(os.environ.get('OLLAMA_CONCURRENCY', 4))
+
+    def __init__(self, concurrency=None):
         self.default_model = "electromagneticcyclone/t-lite-q:3_k_l"
         self.loaded_models = set()
+        self.session = self._create_session()
+        # Keep-alive соединения родителя нельзя делить с процессами, созданными через fork
+        os.register_at_fork(after_in_child=lambda: setattr(self, 'session', self._create_session()))
+        # Общий лимит для всех запросов и окон: пулы потоков отдельных вызовов
+        # только распараллеливают работу, а в Ollama одновременно уходит не
+        # больше concurrency генераций. Слоты, занятые потоками родителя, в
+        # дочернем процессе никто не освободит - там лимит создаётся заново
+        self.concurrency = concurrency or self.CONCURRENCY
+        self.slots = threading.BoundedSemaphore(self.concurrency)
+        os.register_at_fork(after_in_child=lambda: setattr(self, 'slots', threading.BoundedSemaphore(self.concurrency)))
+        self.indexes = IndexCache()
+        self.cache = ResultCache(
+            os.path.join('cache', 'llm.sqlite3'),
+            max_bytes=int(os.environ.get('LLM_CACHE_MB', 256)) * 2**20
+        )
+
+    @staticmethod
+    def _create_session():
+        """HTTP сессия с пулом keep-alive соединений и повтором при сбоях"""
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'POST'])
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _generate(self, model, prompt, **params):
+        """Запрос к /api/generate с ответом целиком"""
+        with self.slots:
+            response = self.session.post(f'{self.BASE_URL}/api/generate',
+                json={"model": model, "prompt": prompt, "stream": False, **params},
+                timeout=self.TIMEOUT)
+            response.raise_for_status()
+            return response.json()
+
+    def _generate_stream(self, model, prompt, **params):
+        """Запрос к /api/generate, отдающий токены по мере генерации
 
-    def start(self):
+        Слот лимита занят, пока поток не дочитан или не закрыт.
+        """
+        with self.slots, self.session.post(f'{self.BASE_URL}/api/generate',
+                json={"model": model, "prompt": prompt, "stream": True, **params},
+                timeout=self.TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get('error'):
+                    raise RuntimeError(data['error'])
+                if data.get('response'):
+                    yield data['response']
+                if data.get('done'):
+                    break
+
+    def is_running(self):
         try:
-            subprocess.Popen(['ollama', 'serve'])
-            time.sleep(5)
-            self.load_model(self.default_model)
-            return True
+            return self.session.get(f'{self.BASE_URL}/api/version', timeout=(0.5, 2)).ok
+        except requests.RequestException:
+            return False
+
+    def start(self, timeout=30):
+        """Запускает ollama serve (если он ещё не запущен) и ждёт, пока API ответит"""
+        try:
+            if not self.is_running():
+                subprocess.Popen(['ollama', 'serve'])
+                deadline = time.monotonic() + timeout
+                # Вместо фиксированной паузы опрашиваем API - обычно он готов за доли секунды
+                while not self.is_running():
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"Ollama API did not respond in {timeout}s")
+                    time.sleep(0.1)
+            return self.load_model(self.default_model)
         except Exception as e:
             logging.error(f"Ollama startup error: {e}")
             return False
 
+    def warm_up(self, model_name=None):
+        """Загружает веса модели в память Ollama запросом без промпта"""
+        model = model_name or self.default_model
+        response = self.session.post(f'{self.BASE_URL}/api/generate', json={"model": model}, timeout=self.TIMEOUT)
+        response.raise_for_status()
+
     def load_model(self, model_name):
         if model_name in self.loaded_models:
             return True
@@ -29,25 +134,132 @@ class OllamaService:
             logging.error(f"Failed to load model {model_name}: {e}")
             return False
 
+    def _cached_generate(self, model, prompt, key_parts, accept=None, **params):
+        """Ответ модели с кэшем по (модель, операция, текст, вопрос)
+
+        accept проверяет ответ: отвергнутый не кэшируется, вместо него возвращается None.
+        """
+        key = self.cache.key(model, *key_parts)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        # Дорогой промпт (например, после map-шага) строится только при промахе кэша
+        if callable(prompt):
+            prompt = prompt()
+        with stage(f'llm_{key_parts[0]}'):
+            result = self._generate(model, prompt, **params).get('response')
+        if result and accept is not None and not accept(result):
+            logging.warning(f"Rejected {key_parts[0]} response: {result[:100]}")
+            return None
+        if result:
+            self.cache.put(key, result)
+        return result
+
+    def _cached_stream(self, model, prompt, key_parts, **params):
+        """Поток токенов с тем же кэшем: из кэша ответ приходит одной порцией"""
+        key = self.cache.key(model, *key_parts)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+        if callable(prompt):
+            prompt = prompt()
+        tokens = []
+        started = time.perf_counter()
+        for token in self._generate_stream(model, prompt, **params):
+            if not tokens:
+                observe_stage(f'llm_{key_parts[0]}_first_token', time.perf_counter() - started)
+            tokens.append(token)
+            yield token
+        observe_stage(f'llm_{key_parts[0]}', time.perf_counter() - started)
+        if tokens:
+            self.cache.put(key, ''.join(tokens))
+
     def process_text(self, text, model_name=None):
+        """Исправляет грамматику и пунктуацию, параллельно по окнам предложений
+
+        Модель получает окно вместе с соседними предложениями для контекста,
+        а возвращает только само окно, поэтому исправленные окна просто
+        склеиваются по порядку. Ответы окон кэшируются: после правки текста
+        модель заново спрашивается только про изменившиеся окна.
+        """
         model = model_name or self.default_model
         if not self.load_model(model):
             return text
 
+        sentences = split_sentences(text)
+        windows = sentence_windows(sentences, self.CORRECT_WINDOW_TOKENS)
+        if not windows:
+            return text
+        logging.info(f"Correction: {len(windows)} windows")
+        # Потоки пула наследуют trace id запроса через копию контекста
+        context = contextvars.copy_context()
+        with stage('llm_correct_text'), ThreadPoolExecutor(max_workers=min(self.concurrency, len(windows))) as pool:
+            corrected = list(pool.map(
+                lambda window: context.copy().run(self._correct_window, model, sentences, *window), windows))
+        return ' '.join(corrected)
+
+    def _correct_window(self, model, sentences, start, end):
+        """Исправленный текст предложений [start, end); при ошибке - исходный"""
+        fragment = ' '.join(sentences[start:end])
+        before = ' '.join(sentences[max(start - self.CORRECT_CONTEXT_SENTENCES, 0):start])
+        after = ' '.join(sentences[end:end + self.CORRECT_CONTEXT_SENTENCES])
+        if before or after:
+            prompt = ("Исправь грамматические ошибки и пунктуацию во фрагменте текста. "
+                      "Текст до и после фрагмента дан только для понимания, не исправляй и не повторяй его.\n\n"
+                      f"Текст до: {before or '-'}\n\nФрагмент: {fragment}\n\nТекст после: {after or '-'}\n\n"
+                      "В ответ напиши только исправленный фрагмент, ничего больше.")
+        else:
+            prompt = (f"Исправь грамматические ошибки и пунктуацию в тексте: {fragment}. "
+                      "В ответ напиши только исправленную версию, ничего больше.")
+
+        def plausible(result):
+            ratio = len(result.strip()) / max(len(fragment), 1)
+            return 1 / self.CORRECT_MAX_LENGTH_RATIO <= ratio <= self.CORRECT_MAX_LENGTH_RATIO
+
         try:
-            response = requests.post('http://localhost:11434/api/generate', 
-                json={
-                    "model": model,
-                    "prompt": f"Исправь грамматические ошибки и пунктуацию в тексте: {text}. В ответ напиши только исправленную версию, ничего больше.",
-                    "stream": False,
-                    "temperature": 0.1
-                })
-                
-            data = response.json()
-            return data.get('response', text)
+            result = self._cached_generate(model, prompt, ('correct', fragment, before, after),
+                accept=plausible, temperature=0.1)
         except Exception as e:
             logging.error(f"Ollama processing error: {e}")
-            return text
+            return fragment
+        return result.strip() if result else fragment
+
+    def _summary_prompt(self, model, text):
+        """Промпт итогового описания; длинный текст сначала сворачивается map-шагами"""
+        if estimate_tokens(text) <= self.SUMMARY_CHUNK_TOKENS:
+            return f"Сделай краткое описание текста в нескольких пунктах: {text}"
+        return ("Ниже краткие описания последовательных частей одного текста. "
+                f"Объедини их в одно краткое описание в нескольких пунктах: {self._reduce_text(model, text)}")
+
+    def _reduce_text(self, model, text, max_depth=3):
+        """Заменяет текст описаниями его кусков, пока он не уложится в бюджет"""
+        for _ in range(max_depth):
+            if estimate_tokens(text) <= self.SUMMARY_CHUNK_TOKENS:
+                break
+            chunks = chunk_sentences(split_sentences(text), self.SUMMARY_CHUNK_TOKENS)
+            logging.info(f"Map-reduce summarization: {len(chunks)} chunks")
+            # Потоки пула наследуют trace id запроса через копию контекста
+            context = contextvars.copy_context()
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                partial = list(pool.map(lambda chunk: context.copy().run(self._summarize_chunk, model, chunk), chunks))
+            text = '\n'.join(partial)
+        return text
+
+    def _summarize_chunk(self, model, chunk):
+        result = self._cached_generate(model,
+            f"Кратко перескажи основные факты этого фрагмента текста: {chunk}",
+            ('summarize_chunk', chunk), temperature=0.1, max_tokens=300)
+        if not result:
+            raise RuntimeError("Пустой ответ модели при суммаризации фрагмента")
+        return result
+
+    def _answer_prompt(self, text, question, transcript_id=None):
+        """Промпт ответа: для длинных транскриптов - только релевантные фрагменты"""
+        if estimate_tokens(text) > self.ASK_FULL_TEXT_TOKENS:
+            passages = self.indexes.get(text, transcript_id).search(question, self.ASK_TOP_K)
+            text = '\n...\n'.join(passages)
+        return f"Текст: {text}\n\nВопрос: {question}\n\nОтветь на вопрос используя только информацию из текста."
 
     def summarize_text(self, text, model_name=None):
         model = model_name or self.default_model
@@ -55,38 +267,38 @@ class OllamaService:
             return "Ошибка загрузки модели"
 
         try:
-            response = requests.post('http://localhost:11434/api/generate',
-                json={
-                    "model": model,
-                    "prompt": f"Сделай краткое описание текста в нескольких пунктах: {text}",
-                    "stream": False,
-                    "temperature": 0.1,
-                    "max_tokens": 300
-                })
-                
-            data = response.json()
-            return data.get('response', "Не удалось создать краткое описание")
+            result = self._cached_generate(model, lambda: self._summary_prompt(model, text), ('summarize', text),
+                temperature=0.1, max_tokens=300)
+            return result or "Не удалось создать краткое описание"
         except Exception as e:
             logging.error(f"Ollama summarization error: {e}")
             return "Ошибка при создании краткого описания"
 
-    def answer_question(self, text, question, model_name=None):
+    def stream_summary(self, text, model_name=None):
+        """Краткое описание, отдаваемое по токенам"""
+        model = model_name or self.default_model
+        if not self.load_model(model):
+            raise RuntimeError("Ошибка загрузки модели")
+        yield from self._cached_stream(model, lambda: self._summary_prompt(model, text), ('summarize', text),
+            temperature=0.1, max_tokens=300)
+
+    def answer_question(self, text, question, model_name=None, transcript_id=None):
         model = model_name or self.default_model
         if not self.load_model(model):
             return "Ошибка загрузки модели"
 
         try:
-            response = requests.post('http://localhost:11434/api/generate',
-                json={
-                    "model": model,
-                    "prompt": f"Текст: {text}\n\nВопрос: {question}\n\nОтветь на вопрос используя только информацию из текста.",
-                    "stream": False,
-                    "temperature": 0.1,
-                    "max_tokens": 200
-                })
-                
-            data = response.json()
-            return data.get('response', "Не удалось получить ответ")
+            result = self._cached_generate(model, lambda: self._answer_prompt(text, question, transcript_id), ('ask', text, question),
+                temperature=0.1, max_tokens=200)
+            return result or "Не удалось получить ответ"
         except Exception as e:
             logging.error(f"Ollama question answering error: {e}")
-            return "Ошибка при обработке вопроса"
\ No newline at end of file
+            return "Ошибка при обработке вопроса"
+
+    def stream_answer(self, text, question, model_name=None, transcript_id=None):
+        """Ответ на вопрос по тексту, отдаваемый по токенам"""
+        model = model_name or self.default_model
+        if not self.load_model(model):
+            raise RuntimeError("Ошибка загрузки модели")
+        yield from self._cached_stream(model, lambda: self._answer_prompt(text, question, transcript_id), ('ask', text, question),
+            temperature=0.1, max_tokens=200)
@@ -0,0 +1,114 @@
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def listen(host, port, backlog=128):
+    """Открывает слушающий сокет, который унаследуют процессы-воркеры"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def memory_usage(pid='self'):
+    """Rss, Pss и общая с другими процессами память процесса, байт (Linux)
+
+    Pss делит каждую общую страницу между всеми процессами, которые её
+    держат, поэтому сумма Pss воркеров - реальный расход памяти.
+    """
+    usage = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty'):
+                    usage[name] = int(value.split()[0]) * 1024
+    except OSError:
+        return None
+    return {
+        'rss': usage.get('Rss', 0),
+        'pss': usage.get('Pss', 0),
+        'shared': usage.get('Shared_Clean', 0) + usage.get('Shared_Dirty', 0)
+    }
+
+
+class PreforkServer:
+    """Пре-форк: родитель готовит общее состояние, воркеры обслуживают соединения
+
+    Всё, что загружено в родителе до run() (модели, кэши), достаётся
+    воркерам через fork и делится с ними copy-on-write. Воркеры вызывают
+    accept на одних и тех же унаследованных сокетах, и ядро раздаёт
+    соединения свободным процессам - отдельный процесс-диспетчер не
+    нужен. Упавший воркер перезапускается с тем же номером.
+
+    serve(index) выполняется в дочернем процессе и должен вернуться после
+    SIGTERM; родитель в это время не держит работающих потоков.
+    """
+
+    def __init__(self, workers, serve, restart_delay=1.0):
+        self.workers = workers
+        self.serve = serve
+        self.restart_delay = restart_delay
+        self.children = {}
+        self.stopping = False
+
+    def _spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            # Ctrl+C приходит всей группе процессов - воркер остановит родитель через SIGTERM
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                self.serve(index)
+            except BaseException:
+                logger.exception(f"Worker {index} crashed")
+                code = 1
+            finally:
+                # Без atexit и деструкторов родительских объектов (SQLite, пулы)
+                os._exit(code)
+        self.children[pid] = index
+        logger.info(f"Worker {index} started, pid {pid}")
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        """Запускает воркеров и ждёт их, перезапуская упавших, до SIGTERM/SIGINT"""
+        # Объекты родителя уходят в постоянное поколение: сборщик мусора в
+        # воркерах не будет их обходить и не скопирует их страницы
+        gc.collect()
+        gc.freeze()
+        previous = {sig: signal.signal(sig, self.stop) for sig in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            for index in range(self.workers):
+                self._spawn(index)
+            while self.children:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+                index = self.children.pop(pid, None)
+                if index is None or self.stopping:
+                    continue
+                logger.error(f"Worker {index} (pid {pid}) exited with status {status}, restarting")
+                time.sleep(self.restart_delay)
+                if not self.stopping:
+                    self._spawn(index)
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+            gc.unfreeze()
@@ -0,0 +1,65 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Readiness:
+    """Готовность компонентов сервера для /ready
+
+    Каждый компонент (модель или внешний сервис) проходит состояния
+    pending -> loading -> ready, либо error или skipped (например, модель
+    не скачана и прогрев не нужен). Сервер готов, когда нет компонентов
+    в pending, loading и error.
+    """
+
+    WAITING = ('pending', 'loading')
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.components = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def set(self, name, state, **details):
+        with self.lock:
+            self.components[name] = dict(details, state=state, updated=time.time())
+
+    def state(self, name):
+        with self.lock:
+            component = self.components.get(name)
+            return component['state'] if component else None
+
+    @contextmanager
+    def track(self, name):
+        """Отмечает компонент загружаемым на время блока; ошибка записывается, а не пробрасывается
+
+        Блок может сам выставить итоговое состояние (например, skipped),
+        иначе по его завершении компонент становится ready.
+        """
+        self.set(name, 'loading')
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.logger.error(f"Warm-up of {name} failed: {e}")
+            self.set(name, 'error', error=str(e))
+        else:
+            if self.state(name) == 'loading':
+                self.set(name, 'ready', seconds=round(time.perf_counter() - started, 2))
+
+    def _all_ready(self):
+        return all(component['state'] not in self.WAITING + ('error',) for component in self.components.values())
+
+    @property
+    def ready(self):
+        with self.lock:
+            return self._all_ready()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'ready': self._all_ready(),
+                'uptime': round(time.time() - self.started, 1),
+                'components': {name: dict(component) for name, component in self.components.items()}
+            }
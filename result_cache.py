@@ -0,0 +1,136 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import CACHE_REQUESTS
+
+
+class ResultCache:
+    """Двухуровневый кэш результатов: LRU в памяти и SQLite на диске
+
+    Ключ - хэш содержимого запроса, поэтому одинаковые запросы попадают
+    в одну запись и после перезапуска сервера. Дисковый уровень
+    ограничен по суммарному размеру значений, вытесняются давно
+    не запрашивавшиеся записи.
+    """
+
+    def __init__(self, path, max_bytes=256 * 2**20, memory_items=256, name=None):
+        self.path = path
+        # Имя кэша в метриках, по умолчанию - имя файла базы
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.logger = logging.getLogger(__name__)
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            accessed REAL NOT NULL
+        )""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self.db.commit()
+        self.disk_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        os.register_at_fork(after_in_child=self._reopen)
+
+    def _reopen(self):
+        """Своё соединение с базой в процессе, созданном через fork
+
+        Унаследованное соединение нельзя ни использовать, ни закрывать:
+        закрытие в дочернем процессе может удалить WAL, с которым работает
+        родитель. Поэтому оно просто остаётся висеть в _inherited.
+        """
+        self._inherited = self.db
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+
+    @staticmethod
+    def key(*parts):
+        """Хэш содержимого запроса"""
+        payload = json.dumps(parts, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                CACHE_REQUESTS.inc(cache=self.name, result='memory_hit')
+                return self.memory[key]
+
+            row = self.db.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                CACHE_REQUESTS.inc(cache=self.name, result='miss')
+                return None
+            self.db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+            self.disk_hits += 1
+            CACHE_REQUESTS.inc(cache=self.name, result='disk_hit')
+            value = json.loads(row[0])
+            self._remember(key, value)
+            return value
+
+    def put(self, key, value):
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode('utf-8'))
+        with self.lock:
+            self._remember(key, value)
+            old = self.db.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            self.db.execute("INSERT OR REPLACE INTO cache (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                            (key, data, size, time.time()))
+            self.disk_bytes += size - (old[0] if old else 0)
+            self._evict()
+            self.db.commit()
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def _evict(self):
+        """Удаляет самые давно запрашивавшиеся записи сверх лимита размера"""
+        while self.disk_bytes > self.max_bytes:
+            rows = self.db.execute("SELECT key, size FROM cache ORDER BY accessed LIMIT 64").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.disk_bytes <= self.max_bytes:
+                    break
+                self.db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self.memory.pop(key, None)
+                self.disk_bytes -= size
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            hits = self.memory_hits + self.disk_hits
+            requests = hits + self.misses
+            entries = self.db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round(hits / requests, 3) if requests else None,
+                'evictions': self.evictions,
+                'entries': entries,
+                'disk_mb': round(self.disk_bytes / 2**20, 2),
+                'max_mb': round(self.max_bytes / 2**20, 2)
+            }
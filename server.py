@@ -1,4 +1,4 @@
-from flask import Flask, send_file, request, jsonify
+from flask import Flask, send_file, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS  # Добавляем импорт CORS
 import os
 from vosk_service import VoskService
@@ -6,9 +6,11 @@ from ollama_service import OllamaService
 import subprocess
 import webbrowser
 from whisper_service import WhisperService
-import numpy as np
+from whisper_batching import WhisperBatcher
 import json
+import hashlib
 import websockets
+import requests
 import logging
 import signal
 import sys
@@ -16,56 +18,192 @@ import time
 from werkzeug.serving import make_server
 import threading
 import asyncio
+from inference_pool import InferencePool, QueueFullError
+from audio_utils import (SAMPLE_RATE, AudioAssembler, AudioDecodeError, iter_pcm_chunks,
+                         probe_duration)
+from model_registry import registry
+from whisper_streaming import WhisperStreamingSession
+from vosk_streaming import VoskStreamingSession
+from cascade import CascadeTranscriber
+from transcript_cache import HashingChunks, TranscriptCache, stream_digest
+from vad import SpeechChunks
+from job_manager import JobManager
+from batch_transcribe import collect_inputs, run_batch
+from readiness import Readiness
+from prefork import PreforkServer, listen, memory_usage
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import metrics
+from metrics import (HTTP_REQUESTS, HTTP_SECONDS, QUEUE_DEPTH, WEBSOCKET_SESSIONS,
+                     WEBSOCKET_SESSIONS_TOTAL, new_trace, stage)
 
 app = Flask(__name__)
 CORS(app)  # Включаем CORS для всех маршрутов
-logging.basicConfig(level=logging.INFO)
+metrics.configure_logging()
+
+# Число процессов для параллельного распознавания длинных записей Vosk
+VOSK_PARALLEL_WORKERS = int(os.environ.get('VOSK_PARALLEL_WORKERS', os.cpu_count() or 1))
+# Параллельные задачи Whisper и длина очереди ожидающих клиентов
+WHISPER_WORKERS = int(os.environ.get('WHISPER_WORKERS', 1))
+WHISPER_MAX_QUEUE = int(os.environ.get('WHISPER_MAX_QUEUE', 8))
+# Динамический батчинг Whisper: до WHISPER_BATCH_SIZE коротких записей разных клиентов,
+# пришедших в пределах WHISPER_BATCH_WAIT_MS, распознаются вместе (1 - без батчинга)
+WHISPER_BATCH_SIZE = int(os.environ.get('WHISPER_BATCH_SIZE', 1))
+WHISPER_BATCH_WAIT_MS = float(os.environ.get('WHISPER_BATCH_WAIT_MS', 50))
+# Максимальная порция аудио в одном WebSocket сообщении (сэмплов)
+MAX_CHUNK_SAMPLES = 16000 * 16
+# Предел сообщения WebSocket сверх самой порции: конфигурация, DONE и заголовки
+MESSAGE_HEADROOM_BYTES = 64 * 1024
+MAX_MESSAGE_BYTES = MAX_CHUNK_SAMPLES * 4 + MESSAGE_HEADROOM_BYTES
+# Старые клиенты без поля format присылают всю запись одним float32 сообщением.
+# Такие загрузки принимаются, только если явно задана их наибольшая длина в секундах
+WS_LEGACY_UPLOAD_SECONDS = int(os.environ.get('WS_LEGACY_UPLOAD_SECONDS', 0))
+# Число одновременно выполняемых фоновых задач транскрибации
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+# Потоки для живых сессий Vosk и минимальный интервал между частичными результатами, с
+VOSK_STREAM_WORKERS = int(os.environ.get('VOSK_STREAM_WORKERS', os.cpu_count() or 1))
+VOSK_PARTIAL_INTERVAL = float(os.environ.get('VOSK_PARTIAL_INTERVAL', 0.25))
+# Модели, которые при старте загружаются в память и прогреваются (остальные - по первому запросу)
+WARMUP_VOSK_MODELS = [m for m in os.environ.get('WARMUP_VOSK_MODELS', 'full').split(',') if m]
+WARMUP_WHISPER_MODELS = [m for m in os.environ.get('WARMUP_WHISPER_MODELS', '').split(',') if m]
+# Число процессов-воркеров в пре-форк режиме (0 - всё в одном процессе) и
+# первый из их внутренних портов на localhost для запросов между воркерами
+PREFORK_WORKERS = int(os.environ.get('PREFORK_WORKERS', 0))
+PREFORK_INTERNAL_PORT = int(os.environ.get('PREFORK_INTERNAL_PORT', 5101))
+# Каскад Vosk -> Whisper: фразы со средней уверенностью Vosk ниже порога перераспознаёт Whisper
+CASCADE_THRESHOLD = float(os.environ.get('CASCADE_THRESHOLD', 0.85))
+CASCADE_WHISPER_MODEL = os.environ.get('CASCADE_WHISPER_MODEL', 'large-v3')
+# Каталог, в пределах которого /transcribe_batch читает записи и манифесты и пишет результаты
+BATCH_ROOT = os.path.realpath(os.environ.get('BATCH_ROOT', 'batch'))
+# Отбрасывать тишину перед распознаванием по умолчанию; выключено, чтобы не менять
+# тексты и времена существующих клиентов - запрос включает VAD полем vad=true
+VAD_ENABLED = os.environ.get('VAD_ENABLED', 'false').lower() == 'true'
 
 vosk_service = VoskService()
 ollama = OllamaService()
 whisper_service = WhisperService("large-v3")
+transcript_cache = TranscriptCache()
+# Одновременные декодирования Whisper на всех путях - пул, батчер и каскад делят эти слоты
+whisper_slots = threading.BoundedSemaphore(WHISPER_WORKERS)
+whisper_batcher = WhisperBatcher(whisper_service, WHISPER_BATCH_SIZE, WHISPER_BATCH_WAIT_MS / 1000, WHISPER_WORKERS,
+                                 whisper_slots)
+cascade = CascadeTranscriber(vosk_service, whisper_service, whisper_slots)
+jobs = JobManager(JOB_WORKERS)
+readiness = Readiness()
+QUEUE_DEPTH.set_function(lambda: jobs.queue_depth, queue='jobs')
+# Номер текущего воркера в пре-форк режиме, None - обычный запуск
+worker_index = None
+
+def whisper_slot(func):
+    """Оборачивает прямое декодирование Whisper, чтобы оно занимало общий слот"""
+    def run(*args):
+        with whisper_slots:
+            return func(*args)
+    return run
 
 class SpeechRecognitionServer:
     def __init__(self):
         self.whisper_service = whisper_service
         self.vosk_service = vosk_service
+        self.whisper_pool = InferencePool(WHISPER_WORKERS, WHISPER_MAX_QUEUE)
+        # Короткие записи при батчинге идут через свой пул: каждый декодирующий поток
+        # батчера обслуживает до WHISPER_BATCH_SIZE запросов, и столько их ждут в батчере
+        self.whisper_batch_pool = InferencePool(WHISPER_WORKERS * WHISPER_BATCH_SIZE, WHISPER_MAX_QUEUE)
+        QUEUE_DEPTH.set_function(
+            lambda: self.whisper_pool.queue_depth + self.whisper_batch_pool.queue_depth, queue='whisper')
+        QUEUE_DEPTH.set_function(lambda: whisper_batcher.queue_depth, queue='whisper_batch')
+        # Распознавание живых сессий Vosk идёт в потоках, не блокируя event loop
+        self.vosk_executor = ThreadPoolExecutor(VOSK_STREAM_WORKERS, thread_name_prefix='vosk-stream')
         print("SpeechRecognitionServer инициализирован", flush=True)
 
     async def handle_websocket(self, websocket):
         client_id = id(websocket)
+        # Каждое соединение обрабатывается своей задачей asyncio со своим trace id
+        new_trace()
         print(f"Новое WebSocket соединение: {client_id}", flush=True)
         logging.info(f"Новое WebSocket соединение: {client_id}")
+        WEBSOCKET_SESSIONS.inc()
         
         try:
             # Получаем тип модели и язык
             config = await websocket.recv()
             config = json.loads(config)
             model_type = config.get('model')
+            WEBSOCKET_SESSIONS_TOTAL.inc(mode=f"{model_type or 'vosk'}{'_stream' if config.get('stream') else ''}")
             language = config.get('language', 'ru')  # По умолчанию русский
             whisper_model = config.get('whisper_model', 'large-v3')  # Добавляем получение модели
             
             print(f"Клиент {client_id} выбрал модель: {model_type}, язык: {language}", flush=True)
             
+            legacy_upload = model_type == "whisper" and not config.get('stream') and 'format' not in config
+            if legacy_upload and not WS_LEGACY_UPLOAD_SECONDS:
+                await websocket.send(json.dumps({"error": "Send audio in chunks: set format, chunk_size "
+                                                           "and total_samples in the configuration"}))
+                return
+            if not legacy_upload:
+                limit_messages(websocket, MAX_MESSAGE_BYTES)
             if model_type == "whisper":
+                # Неизвестную или не скачанную модель отвергаем до приёма аудио
+                error = self.whisper_model_error(whisper_model)
+                if error is not None:
+                    await websocket.send(json.dumps({"error": error}))
+                    return
+            
+            if model_type == "whisper" and config.get('stream'):
+                print(f"Клиент {client_id} использует потоковый Whisper {whisper_model}", flush=True)
+                await self.handle_whisper_stream(websocket, client_id, config)
+            elif model_type == "whisper":
                 print(f"Клиент {client_id} использует Whisper модель {whisper_model}", flush=True)
                 try:
-                    # Загружаем модель в память перед использованием
-                    if not self.whisper_service.load_model(whisper_model):
-                        raise ValueError(f"Не удалось загрузить модель {whisper_model} в память")
+                    # Отказываем сразу, не принимая аудио, если очередь уже заполнена
+                    total = config.get('total_samples')
+                    pool = self.whisper_pool_for(total if isinstance(total, int) else None)
+                    if pool.is_full:
+                        raise QueueFullError(pool.eta(pool.queue_depth + 1))
                     
-                    # Получаем аудио данные
-                    audio_data = await websocket.recv()
-                    print(f"Получены аудио данные от клиента {client_id}, размер: {len(audio_data)} байт", flush=True)
-                    
-                    # Конвертируем bytes в numpy array
-                    audio_np = np.frombuffer(audio_data, dtype=np.float32)
-                    print(f"Аудио данные преобразованы в numpy array, размер: {audio_np.shape}", flush=True)
+                    # Получаем аудио порциями в заранее выделенный буфер
+                    assembler = await self.negotiate_audio(websocket, config)
+                    with stage('upload'):
+                        while not assembler.complete:
+                            message = await websocket.recv()
+                            if message in ("DONE", b"DONE"):
+                                break
+                            assembler.add(message)
+                            # Старые клиенты присылают всё аудио одним float32 сообщением
+                            if 'format' not in config:
+                                break
+                    audio_np = assembler.audio
+                    print(f"Получены аудио данные от клиента {client_id}, сэмплов: {len(audio_np)}", flush=True)
                     
                     if len(audio_np) == 0:
                         raise ValueError("Получены пустые аудио данные")
                     
-                    # Распознаем текст через Whisper с выбранным языком
-                    text = self.whisper_service.transcribe_audio(audio_np, language=language)
+                    async def notify_queued(position, eta):
+                        await websocket.send(json.dumps({
+                            "status": "queued",
+                            "position": position,
+                            "eta": eta
+                        }))
+                    
+                    # Та же запись уже распознавалась этой моделью - отвечаем из кэша
+                    vad = bool(config.get('vad', VAD_ENABLED))
+                    # Квантованная модель может распознать иначе - её результаты кэшируются отдельно
+                    cache_model = vad_cache_model(self.whisper_service.registry_key(whisper_model)[1], vad)
+                    pcm_digest = hashlib.sha256(audio_np).hexdigest()
+                    text = transcript_cache.get(pcm_digest, 'whisper', cache_model, language)
+                    if text is None:
+                        # Распознаем текст через Whisper в пуле, не блокируя event loop
+                        if whisper_batcher.accepts(len(audio_np)):
+                            # Батчер сам занимает общий слот на время декодирования батча
+                            pool, transcribe = self.whisper_batch_pool, whisper_batcher.transcribe
+                        else:
+                            pool, transcribe = self.whisper_pool, whisper_slot(self.whisper_service.transcribe_audio)
+                        text = await pool.run(
+                            transcribe,
+                            audio_np, language, whisper_model, vad,
+                            on_queued=notify_queued
+                        )
+                        transcript_cache.put(pcm_digest, 'whisper', cache_model, language, text)
                     print(f"Результат распознавания для клиента {client_id}: {text[:100]}...", flush=True)
                     
                     try:
@@ -75,6 +213,9 @@ class SpeechRecognitionServer:
                         print(f"Соединение закрыто при отправке результата: {e}", flush=True)
                         return
                     
+                except QueueFullError as e:
+                    print(f"Клиент {client_id}: очередь Whisper заполнена", flush=True)
+                    await websocket.send(json.dumps({"error": str(e), "retry_after": e.retry_after}))
                 except Exception as e:
                     error_msg = f"Ошибка при транскрибации Whisper: {str(e)}"
                     print(f"Клиент {client_id}: {error_msg}", flush=True)
@@ -83,21 +224,7 @@ class SpeechRecognitionServer:
                     except:
                         print(f"Не удалось отправить сообщение об ошибке клиенту {client_id}", flush=True)
             else:
-                # Обработка Vosk
-                rec = self.vosk_service.create_recognizer()
-                
-                while True:
-                    audio_chunk = await websocket.recv()
-                    if audio_chunk == b"DONE":
-                        break
-                        
-                    if rec.AcceptWaveform(audio_chunk):
-                        result = rec.Result()
-                        await websocket.send(result)
-                
-                # Отправляем финальный результат
-                final_result = rec.FinalResult()
-                await websocket.send(final_result)
+                await self.handle_vosk_stream(websocket, client_id, config)
                 
         except Exception as e:
             print(f"Ошибка обработки соединения {client_id}: {e}", flush=True)
@@ -107,53 +234,368 @@ class SpeechRecognitionServer:
             except:
                 print(f"Не удалось отправить сообщение об ошибке клиенту {client_id}", flush=True)
         finally:
+            WEBSOCKET_SESSIONS.dec()
             print(f"Соединение {client_id} закрыто", flush=True)
 
-async def start_websocket_server():
+    async def handle_vosk_stream(self, websocket, client_id, config):
+        """Живое распознавание Vosk: фразы и частичные результаты по мере поступления PCM"""
+        model_type = config.get('vosk_model', 'small')
+        if model_type not in self.vosk_service.MODELS:
+            await websocket.send(json.dumps({"error": f"Invalid model type: {model_type}"}))
+            return
+        if readiness.state(f'vosk/{model_type}') in Readiness.WAITING:
+            await websocket.send(json.dumps({"error": f"Model {model_type} is still being prepared", "retry_after": 10}))
+            return
+        
+        loop = asyncio.get_running_loop()
+        # Клиент может попросить частичные результаты реже, но не чаще серверного минимума
+        partial_interval = max(float(config.get('partial_interval', VOSK_PARTIAL_INTERVAL)), VOSK_PARTIAL_INTERVAL)
+        # Загрузка модели при промахе реестра тоже не должна блокировать event loop
+        session = await loop.run_in_executor(self.vosk_executor, lambda: VoskStreamingSession(
+            self.vosk_service, model_type,
+            sample_rate=int(config.get('sample_rate', 16000)),
+            partial_interval=partial_interval,
+            words=bool(config.get('words'))
+        ))
+        print(f"Клиент {client_id} использует потоковый Vosk {model_type}", flush=True)
+        try:
+            while True:
+                audio_chunk = await websocket.recv()
+                if audio_chunk in (b"DONE", "DONE"):
+                    break
+                # Порции одной сессии обрабатываются строго по очереди
+                for message in await loop.run_in_executor(self.vosk_executor, session.accept, audio_chunk):
+                    await websocket.send(message)
+            
+            # Отправляем финальный результат
+            await websocket.send(await loop.run_in_executor(self.vosk_executor, session.finish))
+            print(f"Клиент {client_id}: {session.audio_seconds:.1f} с аудио, RTF {session.real_time_factor or 0:.3f}", flush=True)
+        finally:
+            # При обрыве соединения распознаватель освобождает модель в реестре
+            await loop.run_in_executor(self.vosk_executor, session.close)
+
+    def whisper_model_error(self, whisper_model):
+        """Причина отказа для модели Whisper из конфигурации клиента или None"""
+        if not isinstance(whisper_model, str) or whisper_model not in self.whisper_service.MODEL_FILES:
+            return f"Invalid Whisper model: {whisper_model}"
+        if not self.whisper_service.is_model_downloaded(whisper_model):
+            return f"Whisper model {whisper_model} is not downloaded"
+        return None
+
+    def whisper_pool_for(self, samples):
+        """Пул для записи длиной samples (None - неизвестна): короткие при батчинге ждут в батчере"""
+        if samples is not None and whisper_batcher.accepts(samples):
+            return self.whisper_batch_pool
+        return self.whisper_pool
+
+    async def negotiate_audio(self, websocket, config):
+        """Согласует формат аудио из конфигурации клиента
+
+        Клиент указывает format (pcm_s16le или f32le), chunk_size - сэмплов
+        в одном сообщении и total_samples - общую длину, если она известна.
+        В ответ сервер подтверждает принятый размер порции.
+        """
+        audio_format = config.get('format', 'f32le')
+        if 'format' not in config:
+            return AudioAssembler(audio_format, max_chunk_samples=None,
+                                  max_samples=WS_LEGACY_UPLOAD_SECONDS * SAMPLE_RATE)
+        
+        chunk_size = min(int(config.get('chunk_size') or MAX_CHUNK_SAMPLES), MAX_CHUNK_SAMPLES)
+        assembler = AudioAssembler(audio_format, config.get('total_samples'), chunk_size)
+        # Сообщение больше согласованной порции отвергает уже библиотека, не буферизуя его
+        limit_messages(websocket, chunk_size * assembler.dtype().itemsize + MESSAGE_HEADROOM_BYTES)
+        await websocket.send(json.dumps({"type": "ready", "format": audio_format, "chunk_size": chunk_size}))
+        return assembler
+
+    async def handle_whisper_stream(self, websocket, client_id, config):
+        """Потоковый Whisper: частичные результаты по мере поступления аудио"""
+        session = WhisperStreamingSession(
+            self.whisper_service,
+            config.get('whisper_model', 'large-v3'),
+            config.get('language', 'ru')
+        )
+        # Потоковый режим всегда присылает порции, поэтому формат согласуется и для старых клиентов
+        assembler = await self.negotiate_audio(websocket, {'format': 'f32le', **config})
+        decoding = None
+        
+        async def decode(final=False):
+            audio, offset, prompt = session.take_window()
+            if len(audio) == 0:
+                return
+            words = await self.whisper_pool.run(whisper_slot(session.decode), audio, offset, prompt)
+            new_text, tentative = session.update(words, final=final)
+            if not final and (new_text or tentative):
+                await websocket.send(json.dumps({
+                    "type": "partial",
+                    "committed": session.committed_text,
+                    "tentative": tentative
+                }, ensure_ascii=False))
+        
+        try:
+            while True:
+                message = await websocket.recv()
+                if message in ("DONE", b"DONE"):
+                    break
+                session.insert_audio(assembler.add(message))
+                if assembler.complete:
+                    break
+                
+                if decoding is not None and decoding.done():
+                    decoding.result()  # пробрасываем ошибку декодирования
+                    decoding = None
+                # Новое окно декодируем, только когда предыдущее уже обработано
+                if decoding is None and session.ready():
+                    decoding = asyncio.ensure_future(decode())
+            
+            if decoding is not None:
+                await decoding
+            await decode(final=True)
+            
+            text = session.committed_text
+            await websocket.send(json.dumps({
+                "type": "final",
+                "text": text,
+                "time_to_first_text": session.time_to_first_text,
+                "processing_time": round(time.monotonic() - session.started, 3) if session.started else None
+            }, ensure_ascii=False))
+            print(f"Потоковый результат для клиента {client_id}: {text[:100]}..., "
+                  f"время до первого текста: {session.time_to_first_text} с", flush=True)
+        except QueueFullError as e:
+            await websocket.send(json.dumps({"error": str(e), "retry_after": e.retry_after}))
+        finally:
+            if decoding is not None and not decoding.done():
+                decoding.cancel()
+
+def legacy_message_bytes():
+    """Предел сообщения для старых клиентов, присылающих запись целиком (0 - не принимаются)"""
+    return WS_LEGACY_UPLOAD_SECONDS * SAMPLE_RATE * 4 + MESSAGE_HEADROOM_BYTES if WS_LEGACY_UPLOAD_SECONDS else 0
+
+def limit_messages(websocket, max_bytes):
+    """Меняет предел размера входящего сообщения для одного соединения"""
+    websocket.protocol.max_message_size = max_bytes
+
+async def start_websocket_server(sock=None):
     print("Запуск WebSocket сервера...", flush=True)
+    # В пре-форк режиме сокет открыт родителем и общий для всех воркеров
+    address = {'sock': sock} if sock is not None else {'host': "0.0.0.0", 'port': 8765}
     async with websockets.serve(
         SpeechRecognitionServer().handle_websocket,
-        "0.0.0.0",
-        8765,
-        max_size=100 * 1024 * 1024,  # Увеличиваем до 100MB
+        **address,
+        # Предел до конфигурации клиента; после неё каждое соединение получает
+        # свой - по согласованной порции или по WS_LEGACY_UPLOAD_SECONDS
+        max_size=max(MAX_MESSAGE_BYTES, legacy_message_bytes()),
         ping_interval=None,  # Отключаем пинги
         ping_timeout=None,   # Отключаем таймаут пингов
     ) as websocket_server:
         print("WebSocket сервер запущен на ws://0.0.0.0:8765", flush=True)
         await asyncio.Future()
 
-def run_websocket_server():
+def run_websocket_server(sock=None):
     print("Инициализация WebSocket сервера...", flush=True)
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     try:
-        loop.run_until_complete(start_websocket_server())
+        loop.run_until_complete(start_websocket_server(sock))
     except Exception as e:
         print(f"Ошибка запуска WebSocket сервера: {e}", flush=True)
         raise
 
+@app.before_request
+def start_trace():
+    # Trace id можно передать заголовком, чтобы связать логи с логами клиента
+    g.trace_id = new_trace(request.headers.get('X-Request-ID'))
+    g.started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    endpoint = request.endpoint or 'unknown'
+    HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    HTTP_SECONDS.observe(time.perf_counter() - g.started, endpoint=endpoint)
+    response.headers['X-Request-ID'] = g.trace_id
+    return response
+
+def job_owner(job_id):
+    """Номер воркера, создавшего задачу (id вида w<номер>-...), или None"""
+    prefix, _, _ = job_id.partition('-')
+    if prefix.startswith('w') and prefix[1:].isdigit():
+        return int(prefix[1:])
+    return None
+
+def forward_to_worker(index):
+    """Проксирует текущий запрос воркеру index через его внутренний порт"""
+    upstream = requests.request(
+        request.method,
+        f'http://127.0.0.1:{PREFORK_INTERNAL_PORT + index}{request.full_path}',
+        data=request.get_data(),
+        headers={'Content-Type': request.content_type or '', 'X-Request-ID': g.trace_id},
+        stream=True,
+        timeout=(5, None)
+    )
+    # Ответ передаётся потоком - так работают и события задачи (SSE)
+    return Response(stream_with_context(upstream.iter_content(None)), status=upstream.status_code,
+                    content_type=upstream.headers.get('Content-Type'))
+
+@app.before_request
+def route_to_job_owner():
+    # Задачи живут в памяти воркера, который их принял, а соединения ядро раздаёт любому
+    job_id = (request.view_args or {}).get('job_id')
+    if worker_index is None or job_id is None:
+        return None
+    owner = job_owner(job_id)
+    if owner is not None and owner != worker_index and owner < PREFORK_WORKERS:
+        return forward_to_worker(owner)
+    return None
+
+def model_warming(model_type):
+    """Ответ 503, пока модель Vosk ещё скачивается при старте сервера"""
+    if readiness.state(f'vosk/{model_type}') in Readiness.WAITING:
+        response = jsonify({'error': f'Model {model_type} is still being prepared'})
+        response.headers['Retry-After'] = '10'
+        return response, 503
+    return None
+
 @app.route('/')
 def home():
     return send_file('index.html')
 
-def convert_to_wav(input_path, output_path):
-    """
-    Конвертирует аудио/видео в WAV формат
-    Поддерживает: mp4, avi, mov, mkv, mp3, m4a, etc.
+def vad_requested(value):
+    """Значение поля формы vad ('true'/'false'), по умолчанию - VAD_ENABLED"""
+    return VAD_ENABLED if value is None else value == "true"
+
+def vad_cache_model(model, vad):
+    # Без тишины текст может немного отличаться - кэшируем такие результаты отдельно
+    return f'{model}+vad' if vad else model
+
+def transcribe_upload(stream, model_type, workers=None, on_chunks=None, vad=False):
+    """Транскрибирует загруженный файл через Vosk с учётом кэша транскриптов
+
+    on_chunks позволяет обернуть поток PCM, например для учёта прогресса.
+    Возвращает текст и отчёт VAD о пропущенной тишине (None без VAD или
+    при ответе из кэша).
     """
+    cache_model = vad_cache_model(model_type, vad)
+    # Повторная загрузка того же файла берётся из кэша без декодирования
+    with stage('upload_hash'):
+        upload_digest = stream_digest(stream)
+    text = transcript_cache.get_by_upload(upload_digest, 'vosk', cache_model, 'ru')
+    if text is not None:
+        app.logger.info('Transcript cache hit')
+        return text, None
+    
+    # Декодируем загрузку потоком прямо в распознаватель, без временных файлов
+    chunks = iter_pcm_chunks(stream)
+    if on_chunks is not None:
+        chunks = on_chunks(chunks)
+    # Хэш считается по исходному PCM, тишина выбрасывается уже после него
+    chunks = HashingChunks(chunks)
+    speech = SpeechChunks(chunks) if vad else None
+    text = vosk_service.transcribe_stream(speech or chunks, model_type, workers=workers)
+    transcript_cache.put(chunks.hexdigest(), 'vosk', cache_model, 'ru', text, upload_digest)
+    return text, speech.map.report() if speech else None
+
+def cascade_options(form):
+    """Модель Whisper и порог уверенности каскада из формы запроса; третий элемент - ошибка"""
+    whisper_model = form.get('whisper_model', CASCADE_WHISPER_MODEL)
     try:
-        subprocess.run([
-            'ffmpeg', '-i', input_path,
-            '-vn',  # пропускаем видеопоток
-            '-acodec', 'pcm_s16le',
-            '-ar', '16000',
-            '-ac', '1',
-            '-y', output_path
-        ], check=True)
-        return True
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Ошибка конвертации: {str(e)}")
-        return False
+        threshold = float(form.get('threshold', CASCADE_THRESHOLD))
+    except ValueError:
+        return None, None, 'Invalid threshold'
+    if not whisper_service.is_model_downloaded(whisper_model):
+        return None, None, f'Whisper model {whisper_model} is not downloaded'
+    return whisper_model, threshold, None
+
+def cascade_upload(stream, model_type, whisper_model, threshold, on_progress=None):
+    """Транскрибирует загрузку каскадом Vosk -> Whisper с учётом кэша транскриптов
+
+    Возвращает текст и отчёт каскада (None при ответе из кэша).
+    on_progress(stage, progress) получает ход декодирования и обоих проходов каскада.
+    """
+    cache_model = f'{model_type}>{whisper_service.registry_key(whisper_model)[1]}@{threshold}'
+    with stage('upload_hash'):
+        upload_digest = stream_digest(stream)
+    text = transcript_cache.get_by_upload(upload_digest, 'cascade', cache_model, 'ru')
+    if text is not None:
+        app.logger.info('Transcript cache hit')
+        return text, None
+    
+    # Whisper нужны произвольные участки записи, поэтому она декодируется целиком
+    chunks = HashingChunks(iter_pcm_chunks(stream))
+    with stage('decode'):
+        pieces = []
+        for chunk in chunks:
+            if on_progress is not None:
+                # Длина заранее неизвестна - только этап, зато отмена проверяется и здесь
+                on_progress('decode', None)
+            pieces.append(chunk)
+        pcm = b''.join(pieces)
+    result = cascade.transcribe(pcm, model_type, whisper_model, threshold, on_progress=on_progress)
+    transcript_cache.put(chunks.hexdigest(), 'cascade', cache_model, 'ru', result['text'], upload_digest)
+    return result['text'], result['report']
+
+def ndjson_transcription(audio_file, model_type, use_ai=False, ollama_model=None, vad=False):
+    """Транскрибация как NDJSON: строка на каждую распознанную фразу и итоговая строка
+
+    Фразы содержат слова с временами и уверенностью; при VAD времена
+    пересчитываются к исходной записи. Итоговая строка {"type": "done"}
+    несёт полный текст (после AI-коррекции, если она запрошена) и отчёт
+    VAD; ошибка приходит строкой {"type": "error"}.
+    """
+    cache_model = vad_cache_model(model_type, vad)
+    # Ответ читается после выхода из view, когда werkzeug уже закрыл загрузку, -
+    # поэтому она сохраняется во временный файл, как и для фоновых задач
+    fd, path = tempfile.mkstemp(prefix='upload_')
+    with os.fdopen(fd, 'wb') as f, stage('upload_save'):
+        audio_file.save(f)
+    
+    def cleanup():
+        if os.path.exists(path):
+            os.remove(path)
+    
+    def lines():
+        started = time.perf_counter()
+        stream = open(path, 'rb')
+        try:
+            with stage('upload_hash'):
+                upload_digest = stream_digest(stream)
+            text = transcript_cache.get_by_upload(upload_digest, 'vosk', cache_model, 'ru')
+            cached = text is not None
+            speech = None
+            if not cached:
+                chunks = HashingChunks(iter_pcm_chunks(stream))
+                speech = SpeechChunks(chunks) if vad else None
+                texts = []
+                for utterance in vosk_service.iter_utterances(speech or chunks, model_type,
+                                                              speech.map if speech else None):
+                    texts.append(utterance['text'])
+                    yield json.dumps(dict(utterance, type='utterance'), ensure_ascii=False) + '\n'
+                text = ' '.join(texts).strip() or 'Текст не распознан'
+                transcript_cache.put(chunks.hexdigest(), 'vosk', cache_model, 'ru', text, upload_digest)
+            
+            done = {'type': 'done', 'text': text, 'cached': cached}
+            if speech is not None:
+                done['vad'] = speech.map.report()
+            if use_ai and text:
+                done['raw_text'] = text
+                done['text'] = ollama.process_text(text, model_name=ollama_model)
+            done['processing_time'] = round(time.perf_counter() - started, 3)
+            yield json.dumps(done, ensure_ascii=False) + '\n'
+        except AudioDecodeError as e:
+            logging.error(f"Ошибка конвертации: {str(e)}")
+            yield json.dumps({'type': 'error', 'error': 'Failed to convert audio to WAV'}) + '\n'
+        except Exception as e:
+            app.logger.error(f'Streaming transcription error: {str(e)}')
+            yield json.dumps({'type': 'error', 'error': str(e)}, ensure_ascii=False) + '\n'
+        finally:
+            stream.close()
+            cleanup()
+    
+    response = Response(stream_with_context(lines()), mimetype='application/x-ndjson', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Клиент может отключиться раньше, чем генератор начнёт работу, - тогда finally не выполнится
+    response.call_on_close(cleanup)
+    return response
 
 @app.route('/transcribe', methods=['POST'])
 def transcribe():
@@ -165,39 +607,226 @@ def transcribe():
     model_type = request.form.get('model', 'full')
     if model_type not in vosk_service.MODELS:
         return jsonify({'error': 'Invalid model type'}), 400
+    warming = model_warming(model_type)
+    if warming:
+        return warming
+    engine = request.form.get('engine', 'vosk')
+    if engine == 'cascade':
+        whisper_model, threshold, error = cascade_options(request.form)
+        if error:
+            return jsonify({'error': error}), 400
+    elif engine != 'vosk':
+        return jsonify({'error': 'Invalid engine'}), 400
         
     audio_file = request.files['audio']
-    original_path = "original_audio"  # Сохраняем с оригинальным расширением
-    temp_path = "temp_audio.wav"
+    
+    # Потоковый режим: фразы отправляются клиенту по мере распознавания
+    if request.form.get('stream') == "true" and engine == 'vosk':
+        return ndjson_transcription(audio_file, model_type,
+                                    use_ai=request.form.get('useAI') == "true",
+                                    ollama_model=request.form.get('ollama_model'),
+                                    vad=vad_requested(request.form.get('vad')))
     
     try:
-        # Сохраняем оригинальный файл
-        audio_file.save(original_path)
-        
-        # Конвертируем в WAV с нужными параметрами
-        if not convert_to_wav(original_path, temp_path):
-            return jsonify({'error': 'Failed to convert audio to WAV'}), 500
-            
-        # Транскрибируем
-        complete_text = vosk_service.transcribe_audio(temp_path, model_type)
+        if engine == 'cascade':
+            complete_text, report = cascade_upload(audio_file.stream, model_type, whisper_model, threshold)
+            report_name = 'cascade'
+        else:
+            # Транскрибируем, длинные записи при необходимости - параллельно
+            workers = VOSK_PARALLEL_WORKERS if request.form.get('parallel') == "true" else None
+            complete_text, report = transcribe_upload(audio_file.stream, model_type, workers,
+                                                      vad=vad_requested(request.form.get('vad')))
+            report_name = 'vad'
         
         # Обработка через AI если требуется
         ollama_model = request.form.get('ollama_model')
         use_ai = request.form.get('useAI') == "true"
         if use_ai and complete_text:
             complete_text = ollama.process_text(complete_text, model_name=ollama_model)
-            
-        return jsonify({'text': complete_text})
-            
+        
+        result = {'text': complete_text}
+        if report is not None:
+            result[report_name] = report
+        return jsonify(result)
+    
+    except AudioDecodeError as e:
+        logging.error(f"Ошибка конвертации: {str(e)}")
+        return jsonify({'error': 'Failed to convert audio to WAV'}), 500
     except Exception as e:
         app.logger.error(f'Error: {str(e)}')
         return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Ставит транскрибацию в фоновую очередь и сразу возвращает id задачи"""
+    if 'audio' not in request.files:
+        return jsonify({'error': 'No audio file'}), 400
+    
+    model_type = request.form.get('model', 'full')
+    if model_type not in vosk_service.MODELS:
+        return jsonify({'error': 'Invalid model type'}), 400
+    warming = model_warming(model_type)
+    if warming:
+        return warming
+    
+    try:
+        priority = int(request.form.get('priority', 0))
+    except ValueError:
+        return jsonify({'error': 'Invalid priority'}), 400
+    engine = request.form.get('engine', 'vosk')
+    if engine == 'cascade':
+        whisper_model, threshold, error = cascade_options(request.form)
+        if error:
+            return jsonify({'error': error}), 400
+    elif engine != 'vosk':
+        return jsonify({'error': 'Invalid engine'}), 400
+    workers = VOSK_PARALLEL_WORKERS if request.form.get('parallel') == "true" else None
+    use_ai = request.form.get('useAI') == "true"
+    ollama_model = request.form.get('ollama_model')
+    vad = vad_requested(request.form.get('vad'))
+    
+    # Загрузка должна пережить запрос, поэтому сохраняем её под уникальным именем
+    audio_file = request.files['audio']
+    fd, path = tempfile.mkstemp(prefix='upload_')
+    with os.fdopen(fd, 'wb') as f, stage('upload_save'):
+        audio_file.save(f)
+    duration = probe_duration(path)
+    
+    def run(job):
+        with open(path, 'rb') as f:
+            def track(chunks):
+                # Прогресс - доля декодированного и распознанного аудио
+                done = 0
+                for chunk in chunks:
+                    done += len(chunk)
+                    job.report(progress=done / 2 / 16000 / duration if duration else None)
+                    yield chunk
+            
+            job.report(stage='recognition')
+            if engine == 'cascade':
+                text, report = cascade_upload(f, model_type, whisper_model, threshold,
+                                              on_progress=lambda name, progress: job.report(name, progress))
+                report_name = 'cascade'
+            else:
+                text, report = transcribe_upload(f, model_type, workers, on_chunks=track, vad=vad)
+                report_name = 'vad'
         
-    finally:
-        # Очистка временных файлов
-        for path in [original_path, temp_path]:
-            if os.path.exists(path):
-                os.remove(path)
+        if use_ai and text:
+            job.report(stage='ai_correction')
+            text = ollama.process_text(text, model_name=ollama_model)
+        result = {'text': text}
+        if report is not None:
+            result[report_name] = report
+        return result
+    
+    def cleanup():
+        if os.path.exists(path):
+            os.remove(path)
+    
+    # Длительность неизвестна - ориентируемся на размер файла (~1 с на 16 КБ)
+    size = duration if duration is not None else os.path.getsize(path) / 16000
+    job = jobs.submit(run, priority=priority, size=size, description=audio_file.filename, cleanup=cleanup)
+    return jsonify({'job_id': job.id, 'status': job.status, 'position': jobs.position(job)}), 202
+
+def batch_path(path):
+    """Путь внутри BATCH_ROOT (относительные - от него) или None, если он ведёт наружу"""
+    if not isinstance(path, str) or not path:
+        return None
+    # realpath раскрывает и '..', и символические ссылки, ведущие за пределы каталога
+    resolved = os.path.realpath(os.path.join(BATCH_ROOT, path))
+    if os.path.commonpath([resolved, BATCH_ROOT]) != BATCH_ROOT:
+        return None
+    return resolved
+
+@app.route('/transcribe_batch', methods=['POST'])
+def transcribe_batch():
+    """Пакетная транскрибация каталога или манифеста на сервере как фоновая задача
+
+    Все пути - входной каталог или манифест, файлы из манифеста и файл
+    результатов - должны лежать внутри BATCH_ROOT.
+    """
+    data = request.json or {}
+    engine = data.get('engine', 'vosk')
+    if not data.get('input') or not data.get('output'):
+        return jsonify({'error': 'input and output are required'}), 400
+    source = batch_path(data['input'])
+    output = batch_path(data['output'])
+    if source is None or output is None:
+        return jsonify({'error': 'Paths must be inside the batch root'}), 400
+    if not os.path.exists(source):
+        return jsonify({'error': 'Input not found'}), 400
+    if engine not in ('vosk', 'whisper'):
+        return jsonify({'error': 'Invalid engine'}), 400
+    try:
+        priority = int(data.get('priority', 1))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid priority'}), 400
+    model = data.get('model', 'small' if engine == 'vosk' else 'large-v3')
+    known = vosk_service.MODELS if engine == 'vosk' else whisper_service.MODEL_FILES
+    if not isinstance(model, str) or model not in known:
+        return jsonify({'error': f'Invalid {engine} model'}), 400
+    # Каждый процесс пула загружает свою копию модели - больше ядер не имеет смысла
+    workers = data.get('workers')
+    if workers is not None and (type(workers) is not int or not 0 < workers <= (os.cpu_count() or 1)):
+        return jsonify({'error': f'workers must be an integer from 1 to {os.cpu_count() or 1}'}), 400
+    try:
+        inputs = collect_inputs(source)
+    except (OSError, UnicodeDecodeError, ValueError, KeyError, TypeError):
+        return jsonify({'error': 'Unreadable manifest'}), 400
+    # Манифест может ссылаться на абсолютные пути и '..' - проверяем каждый файл
+    if any(batch_path(path) is None for path in inputs):
+        return jsonify({'error': 'Paths must be inside the batch root'}), 400
+    
+    def run(job):
+        job.report(stage='recognition')
+        return run_batch(
+            source, output, engine,
+            model=model,
+            language=data.get('language', 'ru'),
+            workers=workers,
+            progress=lambda done, total: job.report(progress=done / total)
+        )
+    
+    # Пакет большой - ставим его за обычными загрузками
+    size = len(inputs) * 600
+    job = jobs.submit(run, priority=priority, size=size, description=source)
+    return jsonify({'job_id': job.id, 'status': job.status}), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(dict(job.to_dict(), position=jobs.position(job)))
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Прогресс задачи как Server-Sent Events до её завершения"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def events():
+        version = -1
+        while True:
+            # По таймауту тоже отправляем состояние: позиция в очереди меняется без версии задачи
+            version = job.wait_change(version)
+            state = dict(job.to_dict(), position=jobs.position(job))
+            yield f"data: {json.dumps(state, ensure_ascii=False)}\n\n"
+            if job.status in job.FINISHED:
+                break
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/summarize', methods=['POST'])
 def summarize():
@@ -224,12 +853,48 @@ def ask_question():
         if not text or not question:
             return jsonify({'error': 'No text or question provided'}), 400
             
-        answer = ollama.answer_question(text, question, model_name=model)
+        answer = ollama.answer_question(text, question, model_name=model,
+                                        transcript_id=data.get('transcript_id'))
         return jsonify({'answer': answer})
     except Exception as e:
         app.logger.error(f'Error: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
+def sse_response(tokens):
+    """Отдаёт поток токенов LLM клиенту как Server-Sent Events"""
+    def events():
+        try:
+            for token in tokens:
+                yield f"data: {json.dumps({'token': token}, ensure_ascii=False)}\n\n"
+            yield f"data: {json.dumps({'done': True})}\n\n"
+        except Exception as e:
+            app.logger.error(f'Streaming error: {str(e)}')
+            yield f"data: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/summarize_stream', methods=['POST'])
+def summarize_stream():
+    text = request.json.get('text')
+    model = request.json.get('model')
+    if not text:
+        return jsonify({'error': 'No text provided'}), 400
+    return sse_response(ollama.stream_summary(text, model_name=model))
+
+@app.route('/ask_stream', methods=['POST'])
+def ask_question_stream():
+    data = request.json
+    text = data.get('text')
+    question = data.get('question')
+    model = data.get('model')
+    if not text or not question:
+        return jsonify({'error': 'No text or question provided'}), 400
+    return sse_response(ollama.stream_answer(text, question, model_name=model,
+                                             transcript_id=data.get('transcript_id')))
+
 @app.route('/check_model', methods=['POST'])
 def check_model():
     try:
@@ -278,10 +943,55 @@ def load_whisper_model():
         app.logger.error(f'Error downloading whisper model: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
+@app.route('/model_stats', methods=['GET'])
+def model_stats():
+    return jsonify(registry.stats())
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Готовность моделей и Ollama; 503, пока что-то ещё загружается или сломалось"""
+    state = readiness.snapshot()
+    for name, component in state['components'].items():
+        engine, _, model = name.partition('/')
+        if engine in ('vosk', 'whisper'):
+            # Прогретая модель могла быть позже вытеснена из памяти бюджетом реестра
+            key = whisper_service.registry_key(model) if engine == 'whisper' else (engine, model)
+            component['resident'] = registry.is_loaded(key)
+    if worker_index is not None:
+        # Pss показывает, сколько памяти воркер реально добавляет к общим с родителем моделям
+        state['worker'] = {'index': worker_index, 'pid': os.getpid(), 'memory': memory_usage()}
+    return jsonify(state), 200 if state['ready'] else 503
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Метрики процесса; в пре-форк режиме - всех воркеров с меткой worker"""
+    if worker_index is None:
+        return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+    if request.args.get('local'):
+        return Response(metrics.REGISTRY.render(worker=worker_index), mimetype='text/plain; version=0.0.4')
+    texts = []
+    for index in range(PREFORK_WORKERS):
+        if index == worker_index:
+            texts.append(metrics.REGISTRY.render(worker=worker_index))
+            continue
+        try:
+            response = requests.get(f'http://127.0.0.1:{PREFORK_INTERNAL_PORT + index}/metrics',
+                                    params={'local': 1}, timeout=5)
+            texts.append(response.text)
+        except requests.RequestException as e:
+            # Перезапускающийся воркер не должен ломать сбор метрик остальных
+            app.logger.warning(f'Metrics of worker {index} unavailable: {e}')
+    return Response(metrics.merge_rendered(texts), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify({'llm': ollama.cache.stats(), 'transcripts': transcript_cache.stats()})
+
 class ServerThread(threading.Thread):
-    def __init__(self, app):
+    def __init__(self, app, host='0.0.0.0', port=5001, sock=None):
         threading.Thread.__init__(self)
-        self.srv = make_server('0.0.0.0', 5001, app)
+        # Готовый сокет (пре-форк) используется вместо нового на host:port
+        self.srv = make_server(host, port, app, fd=sock.fileno() if sock is not None else None)
         self.ctx = app.app_context()
         self.ctx.push()
 
@@ -304,6 +1014,9 @@ def cleanup():
         cleanup.server_thread.join()
         logging.info("Flask сервер остановлен")
     
+    # Останавливаем процессы параллельного распознавания
+    vosk_service.shutdown()
+    
     # Останавливаем Ollama
     try:
         logging.info("Останавливаем Ollama")
@@ -312,46 +1025,139 @@ def cleanup():
     except subprocess.SubprocessError as e:
         logging.error(f"Ошибка при остановке Ollama: {e}")
     
-    # Очищаем временные файлы
-    temp_files = ['original_audio', 'temp_audio.wav']
-    for file in temp_files:
-        if os.path.exists(file):
-            try:
-                os.remove(file)
-                logging.info(f"Удален временный файл: {file}")
-            except Exception as e:
-                logging.error(f"Ошибка при удалении {file}: {e}")
-    
     print("Сервер успешно остановлен", flush=True)
     logging.info("Сервер успешно остановлен")
     sys.stdout.flush()
     sys.exit(0)
 
+def warm_up_vosk_model(model_type, load_only=False):
+    name = f'vosk/{model_type}'
+    with readiness.track(name):
+        vosk_service.download_model(model_type)
+        if model_type in WARMUP_VOSK_MODELS:
+            if load_only:
+                vosk_service.load_model(model_type)
+            else:
+                vosk_service.warm_up(model_type)
+        else:
+            readiness.set(name, 'downloaded')
+
+def warm_up_whisper_model(model_name, load_only=False):
+    name = f'whisper/{model_name}'
+    if not whisper_service.is_model_downloaded(model_name):
+        readiness.set(name, 'skipped', reason='not downloaded')
+        return
+    with readiness.track(name):
+        if load_only:
+            if not whisper_service.load_weights(model_name):
+                # int8-квантование - вычисления torch, их делает каждый воркер после fork
+                readiness.set(name, 'pending', reason='prepared in each worker')
+        else:
+            whisper_service.warm_up(model_name)
+
+def warm_up_ollama():
+    with readiness.track('ollama'):
+        if not ollama.start():
+            raise RuntimeError("Не удалось запустить Ollama")
+        ollama.warm_up()
+
+def plan_warm_up():
+    """Отмечает все компоненты прогрева ожидающими
+
+    Вызывается до открытия портов: иначе /ready с пустым списком
+    компонентов успел бы ответить ready раньше, чем началась загрузка.
+    """
+    for model_type in vosk_service.MODELS:
+        readiness.set(f'vosk/{model_type}', 'pending')
+    for model_name in WARMUP_WHISPER_MODELS:
+        readiness.set(f'whisper/{model_name}', 'pending')
+    readiness.set('ollama', 'pending')
+
+def warm_up(load_only=False):
+    """Фоновая подготовка после открытия портов: Ollama, скачивание и прогрев моделей
+
+    load_only только загружает веса, без пробных распознаваний и
+    квантования: после запуска вычислений torch (OpenMP) fork небезопасен.
+    Остальное делает finish_warm_up в каждом воркере.
+    """
+    tasks = [warm_up_ollama]
+    tasks += [lambda m=model_type: warm_up_vosk_model(m, load_only) for model_type in vosk_service.MODELS]
+    tasks += [lambda m=model_name: warm_up_whisper_model(m, load_only) for model_name in WARMUP_WHISPER_MODELS]
+    # Независимые модели готовятся одновременно
+    with ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix='warm-up') as pool:
+        for task in tasks:
+            pool.submit(task)
+    logging.info(f"Warm-up finished, ready: {readiness.ready}")
+
+def finish_warm_up():
+    """Прогрев в воркере пре-форк режима: пробные распознавания и int8-квантование после fork"""
+    for model_type in WARMUP_VOSK_MODELS:
+        if readiness.state(f'vosk/{model_type}') == 'ready':
+            warm_up_vosk_model(model_type)
+    for model_name in WARMUP_WHISPER_MODELS:
+        if readiness.state(f'whisper/{model_name}') in ('ready', 'pending'):
+            warm_up_whisper_model(model_name)
+
+def serve_worker(index, http_socket, websocket_socket, internal_sockets):
+    """Воркер пре-форк режима: HTTP и WebSocket на общих сокетах плюс свой внутренний порт"""
+    global worker_index
+    worker_index = index
+    jobs.id_prefix = f'w{index}-'
+    threading.Thread(target=finish_warm_up, daemon=True, name='warm-up').start()
+    websocket_thread = threading.Thread(target=run_websocket_server, args=(websocket_socket,), daemon=True)
+    websocket_thread.start()
+    servers = [ServerThread(app, sock=http_socket), ServerThread(app, sock=internal_sockets[index])]
+    for server in servers:
+        server.daemon = True
+        server.start()
+    
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    while not stopped.wait(1):
+        pass
+    for server in servers:
+        server.shutdown()
+    vosk_service.shutdown()
+
+def run_prefork(workers):
+    """Пре-форк режим: модели загружаются один раз здесь и делятся с воркерами copy-on-write"""
+    # Порты открываются сразу: до запуска воркеров соединения ждут в очереди ядра
+    http_socket = listen('0.0.0.0', 5001)
+    websocket_socket = listen('0.0.0.0', 8765)
+    internal_sockets = [listen('127.0.0.1', PREFORK_INTERNAL_PORT + index) for index in range(workers)]
+    print(f"Pre-fork mode: {workers} workers, preparing models...", flush=True)
+    warm_up(load_only=True)
+    print(f"Models ready, memory: {memory_usage()}", flush=True)
+    PreforkServer(workers, lambda index: serve_worker(index, http_socket, websocket_socket,
+                                                      internal_sockets)).run()
+    cleanup()
+
 def signal_handler(signum, frame):
     print("\nПолучен сигнал завершения...", flush=True)
     cleanup()
 
 if __name__ == '__main__':
     print("Starting server...", flush=True)
-    try:
-        # Предзагрузка всех моделей
-        for model_type in vosk_service.MODELS:
-            vosk_service.download_model(model_type)
-            
-        print("Starting Ollama...", flush=True)
-        if ollama.start():
+    plan_warm_up()
+    if PREFORK_WORKERS > 1:
+        # Воркеры остановлены и cleanup выполнен - однопроцессный режим не запускаем
+        run_prefork(PREFORK_WORKERS)
+    else:
+        try:
             # Запускаем WebSocket сервер в отдельном потоке
             websocket_thread = threading.Thread(target=run_websocket_server)
             websocket_thread.daemon = True
             websocket_thread.start()
-            time.sleep(1)  # Даем время на запуск WebSocket сервера
-            
+        
             # Запускаем Flask сервер в отдельном потоке
             print("Starting Flask server on port 5001...", flush=True)
             flask_thread = ServerThread(app)
             flask_thread.daemon = True
             flask_thread.start()
-            
+        
+            # Порты уже открыты: модели и Ollama готовятся в фоне, состояние - в /ready
+            threading.Thread(target=warm_up, daemon=True, name='warm-up').start()
+        
             # Бесконечный цикл для поддержания работы серверов
             try:
                 while True:
@@ -359,9 +1165,6 @@ if __name__ == '__main__':
             except KeyboardInterrupt:
                 print("\nПолучено прерывание клавиатуры", flush=True)
                 cleanup()
-            
-        else:
-            print("Failed to start Ollama", flush=True)
-    except Exception as e:
-        print(f"Error: {e}", flush=True)
-        cleanup()
\ No newline at end of file
+        except Exception as e:
+            print(f"Error: {e}", flush=True)
+            cleanup()
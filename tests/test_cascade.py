@@ -0,0 +1,68 @@
+import numpy as np
+
+from audio_utils import SAMPLE_RATE
+from cascade import CascadeTranscriber
+
+SECONDS = 45
+
+
+class FakeVosk:
+    """Одна неуверенная фраза на всю запись, по слову v<секунда> на каждую секунду"""
+
+    def iter_utterances(self, chunks, model_type='small'):
+        for _ in chunks:
+            pass
+        words = [{'word': f'v{second}', 'start': second + 0.1, 'end': second + 0.9, 'conf': 0.3}
+                 for second in range(SECONDS)]
+        yield {'text': ' '.join(word['word'] for word in words), 'start': words[0]['start'],
+               'end': words[-1]['end'], 'conf': 0.3, 'words': words}
+
+
+class FakeWhisper:
+    """Слышит номер секунды в значениях отсчётов и отвечает словом w<секунда>
+
+    silent - номера вызовов, на которые Whisper ничего не распознаёт.
+    """
+
+    def __init__(self, silent=()):
+        self.silent = set(silent)
+        self.calls = []
+
+    def transcribe_words(self, audio, language, model_name, initial_prompt=None):
+        self.calls.append(len(audio) / SAMPLE_RATE)
+        if len(self.calls) - 1 in self.silent:
+            return []
+        values = np.round(audio * 32768.0).astype(int)
+        words = []
+        for value in np.unique(values[values > 0]):
+            where = np.flatnonzero(values == value) / SAMPLE_RATE
+            words.append({'word': f' w{value - 1}', 'start': where[0], 'end': where[-1]})
+        return sorted(words, key=lambda word: word['start'])
+
+
+def speech_pcm():
+    # В каждой секунде записи отсчёты равны номеру секунды плюс один
+    samples = np.repeat(np.arange(1, SECONDS + 1, dtype=np.int16), SAMPLE_RATE)
+    return samples.tobytes()
+
+
+def test_long_utterance_keeps_every_word():
+    whisper = FakeWhisper()
+    result = CascadeTranscriber(FakeVosk(), whisper).transcribe(speech_pcm(), threshold=0.85)
+
+    assert all(seconds <= 30.0 for seconds in whisper.calls)
+    [utterance] = result['utterances']
+    assert utterance['engine'] == 'whisper'
+    assert {f'w{second}' for second in range(SECONDS)} <= set(utterance['text'].split())
+    assert result['report']['redecoded_seconds'] >= SECONDS
+
+
+def test_silent_piece_falls_back_to_vosk_words():
+    whisper = FakeWhisper(silent={1})
+    result = CascadeTranscriber(FakeVosk(), whisper).transcribe(speech_pcm(), threshold=0.85)
+
+    assert len(whisper.calls) == 2
+    words = set(result['text'].split())
+    # Секунды, которые Whisper не распознал, остаются словами Vosk
+    for second in range(SECONDS):
+        assert f'w{second}' in words or f'v{second}' in words
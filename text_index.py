@@ -0,0 +1,78 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from text_utils import chunk_sentences, split_sentences
+
+
+def tokenize(text):
+    """Слова в нижнем регистре, обрезанные до основы (грубый стемминг для русского)"""
+    return [word[:6] for word in re.findall(r'\w+', text.lower()) if len(word) > 1]
+
+
+class TranscriptIndex:
+    """BM25 индекс фрагментов транскрипта
+
+    Веса BM25 считаются один раз при построении в плотную матрицу
+    (фрагменты x словарь), поэтому поиск - это сумма нескольких столбцов.
+    """
+
+    def __init__(self, text, passage_tokens=200, k1=1.5, b=0.75):
+        self.passages = chunk_sentences(split_sentences(text), passage_tokens)
+        documents = [tokenize(passage) for passage in self.passages]
+
+        self.vocabulary = {}
+        for document in documents:
+            for token in document:
+                self.vocabulary.setdefault(token, len(self.vocabulary))
+
+        tf = np.zeros((len(documents), len(self.vocabulary)), dtype=np.float32)
+        for row, document in enumerate(documents):
+            ids = np.fromiter((self.vocabulary[token] for token in document), dtype=np.int64, count=len(document))
+            np.add.at(tf[row], ids, 1)
+
+        lengths = tf.sum(axis=1, keepdims=True)
+        avg_length = max(lengths.mean(), 1.0)
+        df = np.count_nonzero(tf, axis=0)
+        idf = np.log1p((len(documents) - df + 0.5) / (df + 0.5)).astype(np.float32)
+        self.weights = idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths / avg_length))
+
+    def search(self, query, k=5):
+        """Возвращает k самых релевантных фрагментов в порядке следования в тексте"""
+        ids = [self.vocabulary[token] for token in set(tokenize(query)) if token in self.vocabulary]
+        if not ids or not self.passages:
+            return self.passages[:k]
+        scores = self.weights[:, ids].sum(axis=1)
+        k = min(k, len(self.passages))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[scores[top] > 0]
+        return [self.passages[i] for i in sorted(top)]
+
+
+class IndexCache:
+    """LRU кэш индексов по идентификатору транскрипта"""
+
+    def __init__(self, max_items=32):
+        self.max_items = max_items
+        self.indexes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, text, transcript_id=None):
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        key = transcript_id or digest
+        with self.lock:
+            cached = self.indexes.get(key)
+            # Текст с тем же идентификатором мог быть отредактирован - тогда перестраиваем
+            if cached is not None and cached[0] == digest:
+                self.indexes.move_to_end(key)
+                return cached[1]
+        index = TranscriptIndex(text)
+        with self.lock:
+            self.indexes[key] = (digest, index)
+            self.indexes.move_to_end(key)
+            while len(self.indexes) > self.max_items:
+                self.indexes.popitem(last=False)
+        return index
@@ -0,0 +1,83 @@
+import re
+import zlib
+
+# Грубая оценка: в русском тексте на один токен приходится около 3 символов
+CHARS_PER_TOKEN = 3
+
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+
+
+def estimate_tokens(text):
+    """Приблизительное число токенов в тексте"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def split_sentences(text):
+    """Делит текст на предложения
+
+    Транскрипт Vosk приходит без пунктуации - тогда предложениями
+    считаются куски примерно по 30 слов.
+    """
+    sentences = [s.strip() for s in _SENTENCE_END.split(text) if s.strip()]
+    result = []
+    for sentence in sentences:
+        words = sentence.split()
+        if len(words) <= 60:
+            result.append(sentence)
+            continue
+        # Граница ставится по самим словам, а не по их номеру: вставка слова
+        # сдвигает только ближайшую границу, а не все последующие
+        start = 0
+        for index in range(len(words)):
+            length = index + 1 - start
+            pair = ' '.join(words[index - 1:index + 1]).encode('utf-8')
+            if length >= 40 or (length >= 20 and zlib.crc32(pair) % 10 == 0):
+                result.append(' '.join(words[start:index + 1]))
+                start = index + 1
+        if start < len(words):
+            result.append(' '.join(words[start:]))
+    return result
+
+
+def chunk_sentences(sentences, max_tokens):
+    """Собирает подряд идущие предложения в куски не длиннее max_tokens"""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for sentence in sentences:
+        tokens = estimate_tokens(sentence)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(' '.join(current))
+            current = []
+            current_tokens = 0
+        current.append(sentence)
+        current_tokens += tokens
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+
+def sentence_windows(sentences, max_tokens):
+    """Делит предложения на окна (start, end) с границами, зависящими от содержимого
+
+    Окно, набравшее восьмую часть бюджета, заканчивается на предложении
+    по его хэшу - с вероятностью, пропорциональной длине предложения, так
+    что в среднем окно занимает половину max_tokens. Правка одного
+    предложения сдвигает границы только рядом с ним - остальные окна
+    совпадают с прошлым прогоном.
+    """
+    windows = []
+    start = 0
+    tokens = 0
+    for index, sentence in enumerate(sentences):
+        sentence_tokens = estimate_tokens(sentence)
+        if index > start and tokens + sentence_tokens > max_tokens:
+            windows.append((start, index))
+            start, tokens = index, 0
+        tokens += sentence_tokens
+        if tokens >= max_tokens // 8 and zlib.crc32(sentence.encode('utf-8')) % (max_tokens // 2) < sentence_tokens:
+            windows.append((start, index + 1))
+            start, tokens = index + 1, 0
+    if start < len(sentences):
+        windows.append((start, len(sentences)))
+    return windows
@@ -0,0 +1,61 @@
+import hashlib
+import os
+
+from result_cache import ResultCache
+
+
+def stream_digest(fileobj, block_size=1 << 20):
+    """SHA-256 содержимого потока; позиция потока восстанавливается"""
+    position = fileobj.tell()
+    digest = hashlib.sha256()
+    for block in iter(lambda: fileobj.read(block_size), b''):
+        digest.update(block)
+    fileobj.seek(position)
+    return digest.hexdigest()
+
+
+class HashingChunks:
+    """Пропускает через себя порции PCM, попутно считая их SHA-256"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.digest = hashlib.sha256()
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.digest.update(chunk)
+            yield chunk
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+class TranscriptCache:
+    """Кэш транскриптов по отпечатку декодированного аудио
+
+    Основной ключ - хэш PCM вместе с движком, моделью и языком. Чтобы
+    повторная загрузка того же файла не требовала даже декодирования,
+    хэш исходных байт загрузки хранится как ссылка на хэш PCM.
+    """
+
+    def __init__(self, path=os.path.join('cache', 'transcripts.sqlite3'), max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(os.environ.get('TRANSCRIPT_CACHE_MB', 512)) * 2**20
+        self.store = ResultCache(path, max_bytes=max_bytes)
+
+    def get(self, pcm_digest, engine, model, language):
+        return self.store.get(ResultCache.key('transcript', pcm_digest, engine, model, language))
+
+    def get_by_upload(self, upload_digest, engine, model, language):
+        pcm_digest = self.store.get(ResultCache.key('upload', upload_digest))
+        if pcm_digest is None:
+            return None
+        return self.get(pcm_digest, engine, model, language)
+
+    def put(self, pcm_digest, engine, model, language, text, upload_digest=None):
+        self.store.put(ResultCache.key('transcript', pcm_digest, engine, model, language), text)
+        if upload_digest is not None:
+            self.store.put(ResultCache.key('upload', upload_digest), pcm_digest)
+
+    def stats(self):
+        return self.store.stats()
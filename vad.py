@@ -0,0 +1,203 @@
+import numpy as np
+
+from audio_utils import CHUNK_BYTES, SAMPLE_RATE
+from metrics import VAD_SECONDS
+
+
+def frame_features(samples, sample_rate=SAMPLE_RATE, frame_ms=30):
+    """Уровень (dBFS) и доля пересечений нуля по кадрам; int16 или float32 в [-1, 1]"""
+    frame = int(sample_rate * frame_ms / 1000)
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32), frame
+    frames = samples[:n_frames * frame].reshape(n_frames, frame).astype(np.float32)
+    if np.issubdtype(samples.dtype, np.integer):
+        frames /= 32768.0
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    zcr = np.count_nonzero(np.diff(np.signbit(frames), axis=1), axis=1) / frame
+    return 20 * np.log10(rms + 1e-10), zcr.astype(np.float32), frame
+
+
+def detect_speech(samples, sample_rate=SAMPLE_RATE, frame_ms=30, padding_ms=300,
+                  min_speech_ms=150, unvoiced_zcr=0.25, noise_floor=None):
+    """Участки речи (start, end) в сэмплах по энергии и пересечениям нуля
+
+    Кадр считается речью, если он заметно громче шумового фона записи.
+    Глухие согласные тихие, но с частыми пересечениями нуля, поэтому кадр
+    с высокой ZCR и уровнем чуть выше фона тоже считается речью. Слишком
+    короткие всплески (щелчки) отбрасываются, а найденные участки
+    расширяются на padding_ms, чтобы не обрезать края слов.
+
+    noise_floor (dBFS) - фон, уже известный по предыдущим частям потока:
+    без него фрагмент из одной тишины не отличить от сплошной речи.
+    """
+    levels, zcr, frame = frame_features(samples, sample_rate, frame_ms)
+    if len(levels) == 0:
+        return [(0, len(samples))] if len(samples) else []
+
+    # Порог подстраивается под запись так же, как при поиске пауз для разрезов
+    speech_level = np.percentile(levels, 90)
+    if noise_floor is None:
+        noise_floor = np.percentile(levels, 10)
+        if speech_level - noise_floor < 10:
+            # Нет различимой тишины - запись целиком речь (или целиком тишина)
+            return [(0, len(samples))] if speech_level > -60 else []
+    else:
+        noise_floor = min(noise_floor, np.percentile(levels, 10))
+        if speech_level - noise_floor < 10:
+            # Фрагмент не громче известного фона - это тишина
+            return []
+    threshold = min(max(-45, noise_floor + 10), speech_level - 10)
+    voiced = levels > threshold
+    unvoiced = (zcr > unvoiced_zcr) & (levels > noise_floor + 4)
+    speech = voiced | unvoiced
+
+    # Убираем короткие всплески: участок должен быть не короче min_speech_ms
+    min_frames = max(1, int(min_speech_ms / frame_ms))
+    edges = np.diff(np.concatenate(([0], speech.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    keep = (ends - starts) >= min_frames
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) == 0:
+        return []
+
+    # Расширяем участки и сливаем перекрывшиеся
+    pad = int(padding_ms / frame_ms)
+    starts = np.maximum(starts - pad, 0)
+    ends = np.minimum(ends + pad, len(levels))
+    regions = []
+    for start, end in zip(starts, ends):
+        if regions and start <= regions[-1][1]:
+            regions[-1][1] = max(regions[-1][1], end)
+        else:
+            regions.append([start, end])
+    total = len(samples)
+    result = [(int(start * frame), int(end * frame)) for start, end in regions]
+    # Хвост записи короче кадра относится к последнему участку, если тот доходит до конца
+    if result and regions[-1][1] == len(levels):
+        result[-1] = (result[-1][0], total)
+    return result
+
+
+class SpeechMap:
+    """Соответствие времени в аудио без тишины времени в исходной записи
+
+    Речевые участки склеиваются с короткими паузами между ними; время
+    внутри паузы относится к концу предыдущего участка.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.original_starts = []
+        self.compact_starts = []
+        self.lengths = []
+        self.total_samples = 0
+        self.kept_samples = 0
+        self.compact_samples = 0
+
+    def add(self, original_start, length, gap=0):
+        """Отмечает, что участок исходника длиной length лёг в сжатое аудио (после паузы gap)"""
+        self.compact_samples += gap
+        self.original_starts.append(original_start)
+        self.compact_starts.append(self.compact_samples)
+        self.lengths.append(length)
+        self.compact_samples += length
+        self.kept_samples += length
+
+    def to_original(self, seconds):
+        """Переводит время (скаляр или массив) из сжатого аудио в исходное"""
+        if not self.lengths:
+            return seconds
+        position = np.asarray(seconds, dtype=np.float64) * self.sample_rate
+        compact_starts = np.asarray(self.compact_starts)
+        index = np.clip(np.searchsorted(compact_starts, position, side='right') - 1, 0, len(compact_starts) - 1)
+        offset = np.clip(position - compact_starts[index], 0, np.asarray(self.lengths)[index])
+        result = (np.asarray(self.original_starts)[index] + offset) / self.sample_rate
+        return float(result) if np.ndim(result) == 0 else result
+
+    def report(self):
+        total = self.total_samples / self.sample_rate
+        kept = self.kept_samples / self.sample_rate
+        return {
+            'audio_seconds': round(total, 2),
+            'speech_seconds': round(kept, 2),
+            'skipped_seconds': round(total - kept, 2),
+            'skipped_ratio': round(1 - kept / total, 3) if total else 0.0,
+            # Время декодирования примерно пропорционально длине поданного аудио
+            'estimated_speedup': round(total / (self.compact_samples / self.sample_rate), 2)
+                                 if self.compact_samples else None,
+            'regions': len(self.lengths)
+        }
+
+
+def _record(speech_map):
+    VAD_SECONDS.inc(speech_map.kept_samples / speech_map.sample_rate, kind='speech')
+    VAD_SECONDS.inc((speech_map.total_samples - speech_map.kept_samples) / speech_map.sample_rate, kind='skipped')
+
+
+def compact_speech(samples, sample_rate=SAMPLE_RATE, gap_ms=100, **params):
+    """Склеивает речевые участки массива; возвращает (сжатое аудио, SpeechMap)"""
+    speech_map = SpeechMap(sample_rate)
+    speech_map.total_samples = len(samples)
+    gap = int(sample_rate * gap_ms / 1000)
+    pieces = []
+    for start, end in detect_speech(samples, sample_rate, **params):
+        if pieces:
+            pieces.append(np.zeros(gap, dtype=samples.dtype))
+        pieces.append(samples[start:end])
+        speech_map.add(start, end - start, gap if len(pieces) > 1 else 0)
+    _record(speech_map)
+    if not pieces:
+        return samples[:0], speech_map
+    return np.concatenate(pieces), speech_map
+
+
+class SpeechChunks:
+    """Пропускает через себя поток порций 16-bit PCM, оставляя только речь
+
+    Тишина определяется по блокам block_seconds, поэтому поток не нужно
+    дочитывать до конца, а порог подстраивается под меняющийся фон.
+    После исчерпания потока в map лежит соответствие времён.
+    """
+
+    def __init__(self, chunks, sample_rate=SAMPLE_RATE, block_seconds=30, gap_ms=100, **params):
+        self.chunks = chunks
+        self.sample_rate = sample_rate
+        self.block_bytes = int(block_seconds * sample_rate) * 2
+        self.gap = int(sample_rate * gap_ms / 1000)
+        self.params = params
+        self.map = SpeechMap(sample_rate)
+        self.noise_floor = None
+
+    def _filter_block(self, block):
+        samples = np.frombuffer(block, dtype=np.int16)
+        offset = self.map.total_samples
+        self.map.total_samples += len(samples)
+        regions = detect_speech(samples, self.sample_rate, noise_floor=self.noise_floor, **self.params)
+        # Фон запоминается по блокам, где есть и речь, и тишина, - там он оценён надёжно
+        if regions and sum(end - start for start, end in regions) < len(samples):
+            levels, _, _ = frame_features(samples, self.sample_rate, self.params.get('frame_ms', 30))
+            floor = float(np.percentile(levels, 10))
+            self.noise_floor = floor if self.noise_floor is None else min(self.noise_floor, floor)
+        for start, end in regions:
+            # Речь, продолжающаяся через границу блока, склеивается без паузы
+            previous_end = self.map.original_starts[-1] + self.map.lengths[-1] if self.map.lengths else None
+            gap = self.gap if previous_end not in (None, offset + start) else 0
+            self.map.add(offset + start, end - start, gap)
+            if gap:
+                yield bytes(gap * 2)
+            # Дальше порции обычного размера, чтобы распознаватель отдавал фразы без задержки
+            for position in range(start * 2, end * 2, CHUNK_BYTES):
+                yield block[position:min(position + CHUNK_BYTES, end * 2)]
+
+    def __iter__(self):
+        buffer = bytearray()
+        for chunk in self.chunks:
+            buffer += chunk
+            if len(buffer) >= self.block_bytes:
+                yield from self._filter_block(bytes(buffer))
+                buffer.clear()
+        if buffer:
+            yield from self._filter_block(bytes(buffer[:len(buffer) // 2 * 2]))
+        _record(self.map)
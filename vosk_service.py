@@ -1,59 +1,121 @@
 from pathlib import Path
-import requests
-import zipfile
-import wave
 import json
 import logging
 import subprocess
+import threading
+import time
 from vosk import Model, KaldiRecognizer
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 import os
+from model_registry import registry, path_size
+from metrics import TimedChunks, observe_stage, stage
+from model_download import fetch_and_extract
+from vad import SpeechChunks, compact_speech
+from audio_utils import SAMPLE_RATE, iter_pcm_chunks, pcm_to_samples, split_on_silence
+
+# Модель, загруженная в процессе-воркере параллельного распознавания
+_worker_model = None
+
+
+def _init_worker(model_path):
+    """Загружает модель один раз при старте процесса-воркера"""
+    global _worker_model
+    _worker_model = Model(model_path)
+
+
+def _recognize_segment(pcm):
+    """Распознаёт сегмент PCM в процессе-воркере"""
+    rec = KaldiRecognizer(_worker_model, SAMPLE_RATE)
+    return VoskService.recognize_pcm(rec, pcm)
+
 
 class VoskService:
+    # sha256 - опубликованный дайджест архива модели; задаётся переменными
+    # окружения VOSK_SHA256_FULL / _MEDIUM / _SMALL
     MODELS = {
         'full': {
             'url': "https://alphacephei.com/vosk/models/vosk-model-ru-0.42.zip",
-            'path': "vosk-model-ru-0.42"
+            'path': "vosk-model-ru-0.42",
+            'sha256': os.environ.get('VOSK_SHA256_FULL')
         },
         'medium': {
             'url': "https://alphacephei.com/vosk/models/vosk-model-ru-0.10.zip",
-            'path': "vosk-model-ru-0.10"
+            'path': "vosk-model-ru-0.10",
+            'sha256': os.environ.get('VOSK_SHA256_MEDIUM')
         },
         'small': {
             'url': "https://alphacephei.com/vosk/models/vosk-model-small-ru-0.22.zip",
-            'path': "vosk-model-small-ru-0.22"
+            'path': "vosk-model-small-ru-0.22",
+            'sha256': os.environ.get('VOSK_SHA256_SMALL')
         }
     }
 
-    def __init__(self, models_dir="models"):
+    # Размер порции в кадрах, которой аудио подаётся в распознаватель
+    CHUNK_FRAMES = 4000
+    # Записи короче этого порога распознаются последовательно
+    PARALLEL_MIN_SECONDS = 60
+    # Число параллельных Range-соединений при скачивании одной модели
+    DOWNLOAD_CONNECTIONS = int(os.environ.get('VOSK_DOWNLOAD_CONNECTIONS', 4))
+    # Зеркало с архивами моделей (например, локальный сервер) вместо alphacephei.com
+    MODEL_MIRROR = os.environ.get('VOSK_MODEL_MIRROR')
+    # Отказываться от архива, для которого не задан SHA-256 (иначе - предупреждение в лог)
+    REQUIRE_SHA256 = os.environ.get('VOSK_REQUIRE_SHA256', 'false').lower() == 'true'
+
+    def __init__(self, models_dir="models", model_registry=None):
         self.model_path = Path(models_dir)
         self.logger = logging.getLogger(__name__)
-        self.current_model = None
-        self.current_model_type = None
+        self.registry = model_registry or registry
+        # Пулы процессов параллельного распознавания по (модель, воркеры) и число
+        # запросов, которые ими сейчас пользуются
+        self.pools = {}
+        self.pool_users = {}
+        self.pool_key = None
+        self.pool_lock = threading.Lock()
+
+    def model_url(self, model_type):
+        url = self.MODELS[model_type]['url']
+        if self.MODEL_MIRROR:
+            return f"{self.MODEL_MIRROR.rstrip('/')}/{url.rsplit('/', 1)[1]}"
+        return url
 
     def download_model(self, model_type='full'):
-        """Загружает модель указанного размера, если она еще не загружена"""
+        """Загружает модель указанного размера, если она еще не загружена
+
+        Архив качается параллельными Range-запросами с докачкой после
+        обрыва и распаковывается по мере загрузки.
+        """
         model_info = self.MODELS[model_type]
         model_dir = self.model_path / model_info['path']
         
         if not model_dir.exists():
             self.logger.info(f"Downloading {model_type} model...")
             self.model_path.mkdir(exist_ok=True)
-            
-            response = requests.get(model_info['url'], stream=True)
-            response.raise_for_status()
-            zip_path = self.model_path / f"{model_info['path']}.zip"
-            
-            with open(zip_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-                    
-            self.logger.info("Extracting model...")
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(self.model_path)
-            
-            zip_path.unlink()
+            fetch_and_extract(
+                self.model_url(model_type),
+                str(self.model_path),
+                model_info['path'],
+                connections=self.DOWNLOAD_CONNECTIONS,
+                sha256=model_info.get('sha256'),
+                require_sha256=self.REQUIRE_SHA256
+            )
             self.logger.info("Model ready")
 
+    def download_models(self, model_types=None):
+        """Скачивает несколько моделей одновременно; ошибка одной не прерывает остальные"""
+        model_types = list(model_types or self.MODELS)
+        with ThreadPoolExecutor(max_workers=len(model_types)) as pool:
+            futures = {model_type: pool.submit(self.download_model, model_type) for model_type in model_types}
+        errors = []
+        for model_type, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                self.logger.error(f"Failed to download {model_type} model: {e}")
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
     def resample_audio(self, input_path, output_path, target_sr=16000):
         """Пересэмплирует аудио в формат, необходимый для Vosk"""
         try:
@@ -69,40 +131,202 @@ class VoskService:
             self.logger.error(f"FFmpeg error: {e.stderr.decode()}")
             return False
 
+    def _model_args(self, model_type):
+        model_path = str(self.model_path / self.MODELS[model_type]['path'])
+        return ('vosk', model_type), lambda: Model(model_path), path_size(model_path)
+
     def load_model(self, model_type='full'):
         """Загружает модель в память"""
-        if self.current_model_type != model_type:
-            model_info = self.MODELS[model_type]
-            model_path = str(self.model_path / model_info['path'])
-            self.current_model = Model(model_path)
-            self.current_model_type = model_type
-        return self.current_model
-
-    def transcribe_audio(self, audio_path, model_type='full'):
+        return self.registry.get(*self._model_args(model_type))
+
+    def acquire_model(self, model_type='full'):
+        """Выдаёт модель из общего реестра на время блока with"""
+        return self.registry.acquire(*self._model_args(model_type))
+
+    def warm_up(self, model_type='full'):
+        """Загружает модель и прогоняет секунду тишины, чтобы первый запрос не ждал"""
+        with self.acquire_model(model_type) as model:
+            rec = KaldiRecognizer(model, SAMPLE_RATE)
+            self.recognize_pcm(rec, bytes(SAMPLE_RATE * 2))
+
+    @staticmethod
+    def recognize_chunks(rec, chunks):
+        """Прогоняет порции PCM через распознаватель и возвращает список фраз"""
+        texts = []
+        for data in chunks:
+            if rec.AcceptWaveform(data):
+                text = json.loads(rec.Result()).get('text')
+                if text:
+                    texts.append(text)
+        final_text = json.loads(rec.FinalResult()).get('text', '')
+        if final_text:
+            texts.append(final_text)
+        return texts
+
+    @classmethod
+    def recognize_pcm(cls, rec, pcm):
+        """Прогоняет PCM целиком через распознаватель порциями по CHUNK_FRAMES"""
+        step = cls.CHUNK_FRAMES * 2
+        return cls.recognize_chunks(rec, (pcm[offset:offset + step] for offset in range(0, len(pcm), step)))
+
+    @contextmanager
+    def use_pool(self, model_type, workers):
+        """Выдаёт пул процессов, в каждом из которых загружена модель, на время блока with
+
+        Открытым между запросами остаётся только последний запрошенный пул.
+        Пул другой модели или размера закрывается, лишь когда его отпустит
+        последний пользующийся им запрос, - чужие задачи не отменяются.
+        """
+        key = (model_type, workers)
+        with self.pool_lock:
+            pool = self.pools.get(key)
+            if pool is None:
+                model_path = str(self.model_path / self.MODELS[model_type]['path'])
+                pool = self.pools[key] = ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=_init_worker,
+                    initargs=(model_path,)
+                )
+                self.pool_users[key] = 0
+            self.pool_users[key] += 1
+            self.pool_key = key
+            for stale in [k for k, users in self.pool_users.items() if users == 0 and k != key]:
+                self._close_pool(stale)
+        try:
+            yield pool
+        finally:
+            with self.pool_lock:
+                self.pool_users[key] -= 1
+                if self.pool_users[key] == 0 and key != self.pool_key:
+                    self._close_pool(key)
+
+    def _close_pool(self, key):
+        # Вызывается под pool_lock, когда пулом никто не пользуется
+        self.pools.pop(key).shutdown(wait=False, cancel_futures=True)
+        del self.pool_users[key]
+
+    def shutdown(self):
+        """Останавливает все пулы процессов параллельного распознавания"""
+        with self.pool_lock:
+            pools = list(self.pools.values())
+            self.pools.clear()
+            self.pool_users.clear()
+            self.pool_key = None
+        for pool in pools:
+            pool.shutdown(cancel_futures=True)
+
+    def transcribe_pcm(self, pcm, model_type='full', workers=None, vad=False):
+        """Транскрибирует 16 kHz mono PCM, при workers > 1 - параллельно по паузам
+
+        vad=True выбрасывает тишину перед распознаванием.
+        """
+        if vad:
+            with stage('vad'):
+                samples, speech_map = compact_speech(pcm_to_samples(pcm))
+            self.logger.info(f"VAD: {speech_map.report()}")
+            pcm = samples.tobytes()
+        duration = len(pcm) / 2 / SAMPLE_RATE
+        if not workers or workers < 2 or duration < self.PARALLEL_MIN_SECONDS:
+            with self.acquire_model(model_type) as model, stage('vosk_recognition'):
+                rec = KaldiRecognizer(model, SAMPLE_RATE)
+                texts = self.recognize_pcm(rec, pcm)
+        else:
+            with stage('vosk_split'):
+                segments = split_on_silence(pcm_to_samples(pcm))
+            self.logger.info(f"Parallel transcription: {len(segments)} segments, {workers} workers")
+            chunks = (pcm[start * 2:end * 2] for start, end in segments)
+            with self.use_pool(model_type, workers) as pool, stage('vosk_parallel_recognition'):
+                texts = [text for segment in pool.map(_recognize_segment, chunks) for text in segment]
+
+        return ' '.join(texts).strip() or 'Текст не распознан'
+
+    def transcribe_stream(self, chunks, model_type='full', workers=None, vad=False):
+        """Транскрибирует поток порций PCM по мере их поступления
+
+        Параллельному режиму нужна вся запись целиком, поэтому при workers > 1
+        поток сначала дочитывается до конца. Для отчёта о пропущенной
+        тишине вызывающий код может сам обернуть поток в SpeechChunks.
+        """
+        if vad:
+            chunks = SpeechChunks(chunks)
+        # Декодирование и распознавание чередуются - время ожидания порций считаем отдельно
+        chunks = TimedChunks(chunks)
+        if workers and workers > 1:
+            pcm = b''.join(chunks)
+            observe_stage('decode', chunks.seconds)
+            return self.transcribe_pcm(pcm, model_type, workers)
+        with self.acquire_model(model_type) as model:
+            started = time.perf_counter()
+            rec = KaldiRecognizer(model, SAMPLE_RATE)
+            texts = self.recognize_chunks(rec, chunks)
+            observe_stage('decode', chunks.seconds)
+            observe_stage('vosk_recognition', time.perf_counter() - started - chunks.seconds)
+        return ' '.join(texts).strip() or 'Текст не распознан'
+
+    @staticmethod
+    def _utterance(result):
+        """Фраза из результата распознавателя: текст, границы и средняя уверенность"""
+        words = [{
+            'word': word['word'],
+            'start': round(word['start'], 2),
+            'end': round(word['end'], 2),
+            'conf': round(word['conf'], 3)
+        } for word in result.get('result', [])]
+        if not words:
+            return None
+        return {
+            'text': result.get('text', ''),
+            'start': words[0]['start'],
+            'end': words[-1]['end'],
+            'conf': round(sum(word['conf'] for word in words) / len(words), 3),
+            'words': words
+        }
+
+    @staticmethod
+    def _remap(utterance, speech_map):
+        """Переводит времена фразы из аудио без тишины во времена исходной записи"""
+        for word in utterance['words']:
+            word['start'] = round(speech_map.to_original(word['start']), 2)
+            word['end'] = round(speech_map.to_original(word['end']), 2)
+        utterance['start'] = utterance['words'][0]['start']
+        utterance['end'] = utterance['words'][-1]['end']
+        return utterance
+
+    def iter_utterances(self, chunks, model_type='full', speech_map=None):
+        """Отдаёт каждую завершённую фразу со словами и временами сразу после распознавания
+
+        Если chunks прошли через SpeechChunks, его speech_map возвращает
+        времена слов к исходной записи.
+        """
+        chunks = TimedChunks(chunks)
+        with self.acquire_model(model_type) as model:
+            started = time.perf_counter()
+            rec = KaldiRecognizer(model, SAMPLE_RATE)
+            rec.SetWords(True)
+            # Время, пока генератор стоит на yield, - это ожидание клиента, а не распознавание
+            waiting = 0.0
+            for data in chunks:
+                if rec.AcceptWaveform(data):
+                    utterance = self._utterance(json.loads(rec.Result()))
+                    if utterance is not None:
+                        if speech_map is not None:
+                            utterance = self._remap(utterance, speech_map)
+                        paused = time.perf_counter()
+                        yield utterance
+                        waiting += time.perf_counter() - paused
+            utterance = self._utterance(json.loads(rec.FinalResult()))
+            if utterance is not None and speech_map is not None:
+                utterance = self._remap(utterance, speech_map)
+            observe_stage('decode', chunks.seconds)
+            observe_stage('vosk_recognition', time.perf_counter() - started - chunks.seconds - waiting)
+        if utterance is not None:
+            yield utterance
+
+    def transcribe_audio(self, audio_path, model_type='full', workers=None, vad=False):
         """Транскрибирует аудио файл в текст"""
         try:
-            model = self.load_model(model_type)
-            
-            with wave.open(audio_path, 'rb') as wf:
-                rec = KaldiRecognizer(model, 16000)
-                full_text = []
-                
-                while True:
-                    data = wf.readframes(4000)
-                    if len(data) == 0:
-                        break
-                    if rec.AcceptWaveform(data):
-                        result = json.loads(rec.Result())
-                        if result.get('text'):
-                            full_text.append(result['text'])
-                
-                final_result = rec.FinalResult()
-                final_text = json.loads(final_result).get('text', '')
-                if final_text:
-                    full_text.append(final_text)
-                    
-                return ' '.join(full_text).strip() or 'Текст не распознан'
-                
+            return self.transcribe_stream(iter_pcm_chunks(audio_path), model_type, workers, vad)
+
         except Exception as e:
             self.logger.error(f'Transcription error: {str(e)}')
-            raise
\ No newline at end of file
+            raise
@@ -0,0 +1,73 @@
+import json
+import time
+from contextlib import ExitStack
+
+from vosk import KaldiRecognizer
+
+from audio_utils import SAMPLE_RATE
+
+
+class VoskStreamingSession:
+    """Живое распознавание Vosk для одного соединения
+
+    У каждой сессии свой KaldiRecognizer, а модель общая: она берётся из
+    реестра на всё время сессии и поэтому не будет вытеснена. Методы
+    синхронные и рассчитаны на вызов из пула потоков - Vosk отпускает
+    GIL во время распознавания, так что сессии работают параллельно.
+    Распознаватель не потокобезопасен: порции одной сессии должны
+    подаваться последовательно.
+
+    Сообщения совпадают с форматом Vosk: {"text": ...} для завершённой
+    фразы и {"partial": ...} для промежуточного результата.
+    """
+
+    def __init__(self, vosk_service, model_type='small', sample_rate=SAMPLE_RATE,
+                 partial_interval=0.25, words=False):
+        self.stack = ExitStack()
+        model = self.stack.enter_context(vosk_service.acquire_model(model_type))
+        self.rec = KaldiRecognizer(model, sample_rate)
+        self.rec.SetWords(words)
+        self.sample_rate = sample_rate
+        # Частичный результат дорог (обход решётки), поэтому не чаще раза в partial_interval
+        self.partial_interval = partial_interval
+        self.last_partial_time = 0.0
+        self.last_partial = ''
+        self.audio_seconds = 0.0
+        self.busy_seconds = 0.0
+        self.closed = False
+
+    def accept(self, pcm):
+        """Подаёт порцию 16-bit PCM, возвращает список сообщений для клиента"""
+        started = time.perf_counter()
+        self.audio_seconds += len(pcm) / 2 / self.sample_rate
+        messages = []
+        if self.rec.AcceptWaveform(pcm):
+            messages.append(self.rec.Result())
+            self.last_partial = ''
+            self.last_partial_time = started
+        elif started - self.last_partial_time >= self.partial_interval:
+            self.last_partial_time = started
+            partial = json.loads(self.rec.PartialResult()).get('partial', '')
+            # Неизменившийся частичный результат повторно не отправляется
+            if partial != self.last_partial:
+                self.last_partial = partial
+                messages.append(json.dumps({'partial': partial}, ensure_ascii=False))
+        self.busy_seconds += time.perf_counter() - started
+        return messages
+
+    def finish(self):
+        """Завершает распознавание и возвращает финальный результат"""
+        try:
+            return self.rec.FinalResult()
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.stack.close()
+
+    @property
+    def real_time_factor(self):
+        """Время распознавания на секунду аудио (меньше 1 - быстрее реального времени)"""
+        return self.busy_seconds / self.audio_seconds if self.audio_seconds else None
@@ -0,0 +1,123 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+from metrics import WHISPER_BATCH_SIZE, observe_stage, stage
+
+
+class _Request:
+    def __init__(self, audio, key):
+        self.audio = audio
+        self.key = key
+        self.queued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class WhisperBatcher:
+    """Динамический батчинг Whisper между одновременными запросами
+
+    Запись не длиннее окна Whisper (30 с) ставится в общую очередь и ждёт
+    попутчиков с той же моделью и языком, пока батч не наберёт max_batch
+    записей или первая из них не прождёт max_wait секунд. Батч проходит
+    кодировщик и декодер за один вызов, и каждый запрос получает свой
+    текст. Длинные записи и max_batch < 2 распознаются как раньше, по одной.
+
+    transcribe блокирует вызывающий поток до результата, поэтому число
+    потоков, одновременно ждущих в transcribe, должно быть не меньше
+    max_batch - иначе батчу не из чего собраться. Сами декодирования
+    занимают слоты whisper_slots (семафор), общие с остальными путями
+    распознавания Whisper.
+    """
+
+    def __init__(self, whisper_service, max_batch=8, max_wait=0.05, workers=1, whisper_slots=None):
+        self.whisper_service = whisper_service
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.workers = workers
+        self.whisper_slots = whisper_slots or threading.BoundedSemaphore(workers)
+        self.logger = logging.getLogger(__name__)
+        self._reset()
+        # Потоки не переживают fork - воркер запустит свои при первом запросе
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.threads = []
+
+    def _start_threads(self):
+        if not self.threads:
+            self.threads = [threading.Thread(target=self._worker, daemon=True, name=f'whisper-batch-{i}')
+                            for i in range(self.workers)]
+            for thread in self.threads:
+                thread.start()
+
+    @property
+    def queue_depth(self):
+        return len(self.queue)
+
+    def accepts(self, samples):
+        """Пойдёт ли запись длиной samples через батч, а не в обычное распознавание"""
+        return self.max_batch > 1 and samples <= self.whisper_service.WINDOW_SAMPLES
+
+    def transcribe(self, audio, language='ru', model_name=None, vad=False):
+        """Распознаёт запись, по возможности в одном батче с записями других запросов"""
+        model_name = model_name or self.whisper_service.current_model_name
+        if not self.accepts(len(audio)):
+            return self.whisper_service.transcribe_audio(audio, language, model_name, vad)
+        if vad:
+            audio = self.whisper_service.drop_silence(audio)
+            if len(audio) == 0:
+                return ""
+
+        request = _Request(audio, (model_name, language))
+        with self.condition:
+            self._start_threads()
+            self.queue.append(request)
+            self.condition.notify_all()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _next_batch(self):
+        """Ждёт, пока у головы очереди наберётся батч или истечёт её ожидание"""
+        with self.condition:
+            while True:
+                if not self.queue:
+                    self.condition.wait()
+                    continue
+                head = self.queue[0]
+                batch = [request for request in self.queue if request.key == head.key][:self.max_batch]
+                remaining = head.queued + self.max_wait - time.perf_counter()
+                if len(batch) >= self.max_batch or remaining <= 0:
+                    for request in batch:
+                        self.queue.remove(request)
+                    return batch
+                self.condition.wait(remaining)
+
+    def _worker(self):
+        while True:
+            batch = self._next_batch()
+            started = time.perf_counter()
+            for request in batch:
+                observe_stage('whisper_batch_wait', started - request.queued)
+            WHISPER_BATCH_SIZE.observe(len(batch))
+            model_name, language = batch[0].key
+            try:
+                with self.whisper_slots, stage('whisper_batch_recognition'):
+                    texts = self.whisper_service.decode_batch([request.audio for request in batch],
+                                                              language, model_name)
+                for request, text in zip(batch, texts):
+                    request.result = text
+            except Exception as e:
+                self.logger.error(f"Batch of {len(batch)} failed: {e}")
+                for request in batch:
+                    request.error = e
+            finally:
+                for request in batch:
+                    request.done.set()
@@ -1,8 +1,46 @@
-import whisper
 import numpy as np
 import os
+import sys
 from typing import Optional
 import logging
+from model_registry import registry
+from metrics import stage
+from vad import compact_speech
+
+
+def quantize_model(model):
+    """Динамическое int8-квантование линейных слоёв модели Whisper на месте
+
+    Веса Linear хранятся в int8, активации квантуются на лету, поэтому
+    калибровка не нужна. Свёртки, эмбеддинги и LayerNorm остаются fp32.
+    """
+    import torch
+    # Linear из whisper - подкласс nn.Linear, который только приводит веса к
+    # типу входа; квантование понимает лишь сам nn.Linear
+    for module in model.modules():
+        if isinstance(module, torch.nn.Linear):
+            module.__class__ = torch.nn.Linear
+    # inplace: копия large-v3 на время квантования удвоила бы пик памяти
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def _load_whisper_model(model_name, download_root, precision='fp32', threads=0):
+    # whisper тянет за собой torch, импорт которого занимает секунды, -
+    # поэтому он откладывается до первой загрузки модели
+    import torch
+    import whisper
+    if threads:
+        torch.set_num_threads(threads)
+    if precision == 'int8':
+        # Квантованные слои работают только на CPU
+        model = quantize_model(whisper.load_model(model_name, device='cpu', download_root=download_root))
+    else:
+        model = whisper.load_model(model_name, download_root=download_root)
+    # Банк мел-фильтров whisper читает с диска при первом распознавании и
+    # кэширует - загружаем его сразу, чтобы не платить за это в запросе
+    whisper.audio.mel_filters(model.device, model.dims.n_mels)
+    return model
+
 
 class WhisperService:
     # Словарь с именами файлов для каждой модели
@@ -30,9 +68,29 @@ class WhisperService:
         'large-v3': ['large-v3.pt']
     }
     
-    def __init__(self, default_model="large-v3"):
-        self.model = None
+    # Точность инференса: fp32 или int8 (динамическое квантование, только CPU)
+    PRECISION = os.environ.get('WHISPER_PRECISION', 'fp32')
+    # Потоки torch для инференса на CPU, 0 - значение torch по умолчанию
+    THREADS = int(os.environ.get('WHISPER_THREADS', 0))
+    # Доля памяти fp32-модели, которую занимает квантованная: Linear - около 90% весов
+    INT8_SIZE_RATIO = 0.35
+    # Окно Whisper: более короткие записи можно распознавать батчем, дополнив тишиной
+    WINDOW_SAMPLES = 30 * 16000
+    # Температуры и пороги отката для ненадёжного результата - как в whisper.transcribe
+    TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+    COMPRESSION_RATIO_THRESHOLD = 2.4
+    LOGPROB_THRESHOLD = -1.0
+    NO_SPEECH_THRESHOLD = 0.6
+    
+    def __init__(self, default_model="large-v3", model_registry=None, precision=None, threads=None):
         self.current_model_name = None
+        self.registry = model_registry or registry
+        self.precision = precision or self.PRECISION
+        if self.precision not in ('fp32', 'int8'):
+            raise ValueError(f"Неизвестная точность: {self.precision}")
+        self.threads = self.THREADS if threads is None else threads
+        # На CPU whisper всё равно считает в fp32, но без явного fp16=False предупреждает об этом
+        self.decode_options = {'fp16': False} if self.precision == 'int8' else {}
         self.project_root = os.path.dirname(os.path.abspath(__file__))
         self.models_dir = os.path.join(self.project_root, 'models', 'whisper')
         os.makedirs(self.models_dir, exist_ok=True)
@@ -62,36 +120,167 @@ class WhisperService:
                 print(f"Скачивание модели {model_name}...", flush=True)
                 os.environ["WHISPER_MODEL_DIR"] = self.models_dir
                 # Только скачиваем модель
-                whisper.load_model(model_name, download_root=self.models_dir)
+                _load_whisper_model(model_name, self.models_dir)
                 print(f"Модель {model_name} успешно скачана", flush=True)
             return True
         except Exception as e:
             print(f"Ошибка скачивания модели {model_name}: {e}", flush=True)
             return False
     
+    def registry_key(self, model_name):
+        """Ключ модели в реестре: квантованная и fp32 версии - разные модели"""
+        return ('whisper', model_name if self.precision == 'fp32' else f'{model_name}/{self.precision}')
+
+    def _model_args(self, model_name, threads=None):
+        if not self.is_model_downloaded(model_name):
+            raise ValueError(f"Модель {model_name} не найдена. Сначала скачайте её.")
+        # Веса хранятся в fp16, в памяти на CPU модель занимает примерно вдвое больше
+        size = os.path.getsize(self.get_model_path(model_name)) * 2
+        if self.precision == 'int8':
+            size = int(size * self.INT8_SIZE_RATIO)
+        threads = self.threads if threads is None else threads
+        loader = lambda: _load_whisper_model(model_name, self.models_dir, self.precision, threads)
+        return self.registry_key(model_name), loader, size
+
+    def acquire_model(self, model_name):
+        """Выдаёт модель из общего реестра на время блока with"""
+        return self.registry.acquire(*self._model_args(model_name))
+
+    def warm_up(self, model_name):
+        """Загружает модель и распознаёт секунду тишины, чтобы первый запрос не ждал"""
+        with self.acquire_model(model_name) as model:
+            model.transcribe(np.zeros(16000, dtype=np.float32), language='ru', **self.decode_options)
+        self.current_model_name = model_name
+
+    def load_weights(self, model_name):
+        """Загружает веса модели без вычислений torch - так её можно делить с процессами после fork
+
+        После того как torch запустил пул потоков (умножения матриц,
+        квантование), fork небезопасен: дочерний процесс может зависнуть.
+        Квантование int8 - это вычисления, поэтому такая модель здесь не
+        загружается, и её готовит каждый процесс сам. Возвращает, загружена
+        ли модель.
+        """
+        if self.precision != 'fp32':
+            return False
+        self.registry.get(*self._model_args(model_name, threads=0))
+        return True
+
     def load_model(self, model_name):
         """Загружаем модель в память"""
         try:
-            if not self.is_model_downloaded(model_name):
-                raise ValueError(f"Модель {model_name} не найдена. Сначала скачайте её.")
-            
-            if self.current_model_name != model_name:
-                print(f"Загрузка модели {model_name} в память...", flush=True)
-                self.model = whisper.load_model(model_name, download_root=self.models_dir)
-                self.current_model_name = model_name
-                print(f"Модель {model_name} загружена в память", flush=True)
+            self.registry.get(*self._model_args(model_name))
+            self.current_model_name = model_name
             return True
         except Exception as e:
             print(f"Ошибка загрузки модели {model_name} в память: {e}", flush=True)
             return False
     
-    def transcribe_audio(self, audio_data, language="ru"):
-        if self.model is None or self.current_model_name is None:
+    @staticmethod
+    def drop_silence(audio_data):
+        """Выбрасывает тишину: Whisper декодирует окнами по 30 с независимо от содержимого"""
+        with stage('vad'):
+            audio_data, speech_map = compact_speech(audio_data)
+        logging.info(f"VAD: {speech_map.report()}")
+        return audio_data
+
+    def transcribe_audio(self, audio_data, language="ru", model_name=None, vad=False):
+        model_name = model_name or self.current_model_name
+        if model_name is None:
             raise ValueError("Модель не загружена в память")
+        
+        if vad:
+            audio_data = self.drop_silence(audio_data)
+            if len(audio_data) == 0:
+                return ""
             
         try:
-            result = self.model.transcribe(audio_data, language=language)
+            # Модель удерживается в реестре до конца распознавания и не будет вытеснена
+            with self.acquire_model(model_name) as model, stage('whisper_recognition'):
+                result = model.transcribe(audio_data, language=language, **self.decode_options)
             return result["text"]
         except Exception as e:
             print(f"Ошибка распознавания: {e}", flush=True)
-            raise 
\ No newline at end of file
+            raise
+
+    def transcribe_words(self, audio_data, language="ru", model_name=None, initial_prompt=None):
+        """Распознаёт аудио и возвращает слова с временными метками"""
+        model_name = model_name or self.current_model_name
+        if model_name is None:
+            raise ValueError("Модель не загружена в память")
+
+        with self.acquire_model(model_name) as model, stage('whisper_stream_decode'):
+            result = model.transcribe(
+                audio_data,
+                language=language,
+                initial_prompt=initial_prompt,
+                word_timestamps=True,
+                condition_on_previous_text=False,
+                **self.decode_options
+            )
+        return [
+            {'word': word['word'], 'start': word['start'], 'end': word['end']}
+            for segment in result['segments']
+            for word in segment.get('words', [])
+        ]
+
+    def decode_batch(self, audios, language="ru", model_name=None):
+        """Распознаёт несколько записей не длиннее 30 с одним батчем; возвращает тексты
+
+        Каждая запись дополняется тишиной до окна 30 с, и кодировщик с
+        декодером проходят все окна за один вызов. Результаты с повторами или
+        низкой вероятностью перераспознаются с более высокой температурой,
+        как в whisper.transcribe, - тоже батчем из оставшихся записей.
+        """
+        import torch
+        import whisper
+        model_name = model_name or self.current_model_name
+        if model_name is None:
+            raise ValueError("Модель не загружена в память")
+        if any(len(audio) > self.WINDOW_SAMPLES for audio in audios):
+            raise ValueError("Батчем распознаются только записи не длиннее 30 с")
+
+        with self.acquire_model(model_name) as model:
+            mel = torch.stack([
+                whisper.log_mel_spectrogram(whisper.pad_or_trim(np.asarray(audio, dtype=np.float32)),
+                                            model.dims.n_mels, device=model.device)
+                for audio in audios
+            ])
+            # fp16 на CPU не работает, и transcribe сам отключает его там же
+            fp16 = self.decode_options.get('fp16', model.device.type == 'cuda')
+            results = [None] * len(audios)
+            pending = list(range(len(audios)))
+            for temperature in self.TEMPERATURES:
+                options = whisper.DecodingOptions(language=language, temperature=temperature,
+                                                  without_timestamps=True, fp16=fp16)
+                retry = []
+                for index, result in zip(pending, model.decode(mel[pending], options)):
+                    results[index] = result
+                    if self._needs_fallback(result):
+                        retry.append(index)
+                pending = retry
+                if not pending:
+                    break
+
+        # Окно без речи whisper.transcribe пропускает - здесь оно даёт пустой текст
+        return ['' if result.no_speech_prob > self.NO_SPEECH_THRESHOLD
+                and result.avg_logprob < self.LOGPROB_THRESHOLD else result.text
+                for result in results]
+
+    @classmethod
+    def _needs_fallback(cls, result):
+        if result.no_speech_prob > cls.NO_SPEECH_THRESHOLD and result.avg_logprob < cls.LOGPROB_THRESHOLD:
+            return False
+        return (result.compression_ratio > cls.COMPRESSION_RATIO_THRESHOLD
+                or result.avg_logprob < cls.LOGPROB_THRESHOLD)
+
+
+def _apply_threads():
+    """Потоки torch в дочернем процессе: родитель пре-форк режима их не настраивает"""
+    if WhisperService.THREADS and 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(WhisperService.THREADS)
+
+
+# Один обработчик на модуль: снять обработчик fork нельзя, и по одному на
+# каждый экземпляр сервиса они копились бы вместе с самими экземплярами
+os.register_at_fork(after_in_child=_apply_threads)
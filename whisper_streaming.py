@@ -0,0 +1,128 @@
+import re
+import time
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+def _normalize(word):
+    return re.sub(r'[^\w]', '', word.lower())
+
+
+class WhisperStreamingSession:
+    """Инкрементальное распознавание Whisper по скользящему окну
+
+    Окно начинается с конца последнего подтверждённого слова, поэтому
+    подтверждённый текст повторно не декодируется. Слово подтверждается,
+    когда два последовательных декодирования окна согласны в нём
+    (LocalAgreement-2).
+
+    Неподтверждённое аудио не длиннее max_window_seconds (меньше окна
+    Whisper 30 с): при переполнении старые слова гипотезы подтверждаются
+    принудительно, а аудио без слов отбрасывается.
+
+    Работа разделена между потоками: take_window и update вызываются из
+    event loop, decode - в пуле инференса.
+    """
+
+    def __init__(self, whisper_service, model_name, language="ru",
+                 step_seconds=2.0, max_window_seconds=25.0):
+        self.whisper_service = whisper_service
+        self.model_name = model_name
+        self.language = language
+        self.step = int(step_seconds * SAMPLE_RATE)
+        self.max_window = max_window_seconds
+        self.chunks = []
+        self.buffer = np.empty(0, dtype=np.float32)
+        self.buffer_offset = 0.0  # время начала буфера от начала записи, секунды
+        self.pending = 0
+        self.committed = []
+        self.hypothesis = []
+        self.started = None
+        self.first_text_at = None
+
+    @property
+    def committed_text(self):
+        return ''.join(word['word'] for word in self.committed).strip()
+
+    @property
+    def committed_end(self):
+        return self.committed[-1]['end'] if self.committed else 0.0
+
+    def insert_audio(self, samples):
+        if self.started is None:
+            self.started = time.monotonic()
+        self.chunks.append(samples)
+        self.pending += len(samples)
+
+    def ready(self):
+        return self.pending >= self.step
+
+    def take_window(self):
+        """Снимок неподтверждённой части аудио для декодирования"""
+        if self.chunks:
+            self.buffer = np.concatenate([self.buffer] + self.chunks)
+            self.chunks = []
+        self.pending = 0
+        return self.buffer, self.buffer_offset, self.committed_text[-200:]
+
+    def decode(self, audio, offset, prompt):
+        """Декодирует окно и возвращает слова с абсолютными временами"""
+        words = self.whisper_service.transcribe_words(
+            audio, language=self.language, model_name=self.model_name, initial_prompt=prompt or None
+        )
+        return [dict(word, start=word['start'] + offset, end=word['end'] + offset) for word in words]
+
+    def update(self, words, final=False):
+        """Подтверждает согласованный префикс гипотезы
+
+        Возвращает (новый подтверждённый текст, неподтверждённый хвост).
+        """
+        boundary = self.committed_end
+        # Слова, целиком лежащие в уже подтверждённой части, отбрасываем
+        words = [word for word in words if word['end'] > boundary + 0.01]
+
+        if final:
+            agreed = len(words)
+        else:
+            agreed = 0
+            for new, old in zip(words, self.hypothesis):
+                if _normalize(new['word']) != _normalize(old['word']):
+                    break
+                agreed += 1
+            # Окно стало слишком длинным - подтверждаем всё, кроме последних секунд
+            window_end = self.buffer_offset + len(self.buffer) / SAMPLE_RATE
+            if window_end - self.buffer_offset > self.max_window:
+                while agreed < len(words) and words[agreed]['end'] < window_end - 5.0:
+                    agreed += 1
+
+        newly_committed = words[:agreed]
+        self.committed.extend(newly_committed)
+        self.hypothesis = words[agreed:]
+
+        if newly_committed:
+            # Отрезаем подтверждённое аудио: дальше декодируется только хвост
+            cut = int((self.committed_end - self.buffer_offset) * SAMPLE_RATE)
+            cut = min(max(cut, 0), len(self.buffer))
+            self.buffer = self.buffer[cut:]
+            self.buffer_offset += cut / SAMPLE_RATE
+        # Без слов в начале окна (шум, музыка) подтверждать нечего, но буфер всё
+        # равно не растёт дальше окна: иначе каждое декодирование дороже прошлого.
+        # Слова, кончающиеся раньше последних секунд окна, уже подтверждены выше
+        excess = len(self.buffer) - int(self.max_window * SAMPLE_RATE)
+        if not final and excess > 0:
+            self.buffer = self.buffer[excess:]
+            self.buffer_offset += excess / SAMPLE_RATE
+
+        new_text = ''.join(word['word'] for word in newly_committed).strip()
+        tentative = ''.join(word['word'] for word in self.hypothesis).strip()
+        if self.first_text_at is None and (new_text or tentative):
+            self.first_text_at = time.monotonic()
+        return new_text, tentative
+
+    @property
+    def time_to_first_text(self):
+        if self.first_text_at is None or self.started is None:
+            return None
+        return round(self.first_text_at - self.started, 3)